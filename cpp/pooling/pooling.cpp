@@ -1,4 +1,5 @@
 #include "pooling.h"
+#include <math.h>
 
 double mag_pool(float* array, size_t size, double m, int iter) {
     size_t numValid;
@@ -33,3 +34,61 @@ double mag_pool(float* array, size_t size, double m, int iter) {
 
     return mean;
 }
+
+double temporal_pooling(float* array, size_t size, double m) {
+    return mag_pool(array, size, m, 1);
+}
+
+void spatial_pooling(float* array_mag, float* array_dir, float* pooled_mag, float* pooled_dir, int rows, int cols, int pooling) {
+    int rows_pooled = rows / pooling;
+    int cols_pooled = cols / pooling;
+
+    // Blocks are centered, remainders of the division are split between the edges
+    int row_offset = (rows % pooling) / 2;
+    int col_offset = (cols % pooling) / 2;
+
+    double block_size = pooling * pooling;
+
+    for (int i = 0; i < rows_pooled; i++) {
+        for (int j = 0; j < cols_pooled; j++) {
+            int row_start = row_offset + i * pooling;
+            int col_start = col_offset + j * pooling;
+
+            double sum = 0;
+
+            for (int r = row_start; r < row_start + pooling; r++) {
+                for (int c = col_start; c < col_start + pooling; c++) {
+                    sum += array_mag[(size_t)r * cols + c];
+                }
+            }
+
+            double mean = sum / block_size;
+
+            // Mean of the magnitudes >= block mean, directions of the same vectors with NaN skipped
+            size_t numValid = 0;
+            size_t numDirections = 0;
+            double maskedSum = 0;
+            double directionSum = 0;
+
+            for (int r = row_start; r < row_start + pooling; r++) {
+                for (int c = col_start; c < col_start + pooling; c++) {
+                    size_t k = (size_t)r * cols + c;
+
+                    if (array_mag[k] >= mean) {
+                        numValid++;
+                        maskedSum += array_mag[k];
+
+                        if (!isnan(array_dir[k])) {
+                            numDirections++;
+                            directionSum += array_dir[k];
+                        }
+                    }
+                }
+            }
+
+            size_t p = (size_t)i * cols_pooled + j;
+            pooled_mag[p] = numValid > 0 ? maskedSum / numValid : 0;
+            pooled_dir[p] = numDirections > 0 ? directionSum / numDirections : NAN;
+        }
+    }
+}
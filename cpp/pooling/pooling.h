@@ -1,6 +1,17 @@
 #pragma once
 
+#include <stddef.h>
+
 #define EXTERN_C extern "C"
+
+#ifdef _WIN32
 #define DLL_API EXTERN_C __declspec(dllexport)
+#else
+#define DLL_API EXTERN_C __attribute__((visibility("default")))
+#endif
 
 DLL_API double mag_pool(float* array, size_t size, double m, int iter);
+
+DLL_API double temporal_pooling(float* array, size_t size, double m);
+
+DLL_API void spatial_pooling(float* array_mag, float* array_dir, float* pooled_mag, float* pooled_dir, int rows, int cols, int pooling);
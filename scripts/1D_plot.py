@@ -19,6 +19,7 @@ Created by Robert Ljubicic.
 try:
 	from __init__ import *
 	from class_console_printer import tag_print, unix_path
+	from class_diagnostics_table import Diagnostics_table
 	from utilities import cfg_get, exit_message, present_exception_and_exit
 
 	import matplotlib.pyplot as plt
@@ -43,11 +44,11 @@ __units__ = [
 	'[px/frame]',
 ]
 
-__files__ = [
-	'coverage.txt',
-	'disp_mean.txt',
-	'disp_median.txt',
-	'disp_max.txt',
+__columns__ = [
+	'coverage',
+	'disp_mean',
+	'disp_median',
+	'disp_max',
 ]
 
 
@@ -58,6 +59,18 @@ def try_load_file(fname):
 		return None
 
 
+def load_diagnostics(diagnostics_folder, i):
+	"""
+	Reads a column of the per-pair diagnostics table, or the separate text file of projects processed by older versions.
+	"""
+	table = Diagnostics_table.load(diagnostics_folder)
+
+	if table is not None:
+		return table[__columns__[i]]
+
+	return try_load_file(f'{diagnostics_folder}/{__columns__[i]}.txt')
+
+
 if __name__ == '__main__':
 	try:
 		parser = ArgumentParser()
@@ -86,15 +99,13 @@ if __name__ == '__main__':
 		ax.set_ylabel(f'{data_type} {units}')
 
 		if args.data in range(4):
-			diagnostics_data_path = f'{diagnostics_folder}/{__files__[args.data]}'
-			diagnostics_data = try_load_file(diagnostics_data_path)
+			diagnostics_data = load_diagnostics(diagnostics_folder, args.data)
 
 			ax.plot(range(diagnostics_data.size), diagnostics_data)
 
 		elif args.data == 4:
 			for i in range(1, 4):
-				diagnostics_data_path = f'{diagnostics_folder}/{__files__[i]}'
-				diagnostics_data = try_load_file(diagnostics_data_path)
+				diagnostics_data = load_diagnostics(diagnostics_folder, i)
 				ax.plot(range(diagnostics_data.size), diagnostics_data)
 
 			plt.legend([x for x in __types__[1:4]])
@@ -22,6 +22,7 @@ try:
 	from sys import exit
 	from glob import glob
 	from class_console_printer import tag_print, unix_path
+	from class_field_store import Field_store
 	from vel_ratio import L1
 	from utilities import cfg_get, exit_message, present_exception_and_exit
 
@@ -54,8 +55,8 @@ def update_vmax(val):
 
 
 def update_slider(val):
-	mags = try_load_file(mag_list[val]) * v_ratio
-	dirs = try_load_file(dir_list[val])
+	mags = load_field(mag_list, val) * v_ratio
+	dirs = load_field(dir_list, val)
 	us, vs = cv2.polarToCart(mags, dirs, angleInDegrees=True)
 
 	data_new = [us, vs, mags, dirs]
@@ -112,6 +113,16 @@ def try_load_file(fname):
 		return None
 
 
+def load_field(field_list, i):
+	"""
+	Loads the i-th per-frame field from a Field_store or from a list of text files.
+	"""
+	if isinstance(field_list, Field_store):
+		return field_list[i]
+
+	return try_load_file(field_list[i])
+
+
 if __name__ == '__main__':
 	try:
 		parser = ArgumentParser()
@@ -167,8 +178,14 @@ if __name__ == '__main__':
 		alpha = 1.0 if not frames_available else 0.5
 
 		if average_only == 0:
-			mag_list = glob(f'{project_folder}/optical_flow/magnitudes/*.txt')
-			dir_list = glob(f'{project_folder}/optical_flow/directions/*.txt')
+			fields_folder = f'{project_folder}/optical_flow/fields'
+
+			if Field_store.exists(f'{fields_folder}/magnitudes'):
+				mag_list = Field_store(f'{fields_folder}/magnitudes')
+				dir_list = Field_store(f'{fields_folder}/directions')
+			else:
+				mag_list = glob(f'{project_folder}/optical_flow/magnitudes/*.txt')
+				dir_list = glob(f'{project_folder}/optical_flow/directions/*.txt')
 			num_frames = len(mag_list)
 
 			if num_frames == 0:
@@ -217,8 +234,8 @@ if __name__ == '__main__':
 			data = data_list[plot_type]
 
 		elif plot_mode == 2:     # Instantaneous      
-			mags = try_load_file(mag_list[0]) * v_ratio
-			dirs = try_load_file(dir_list[0])
+			mags = load_field(mag_list, 0) * v_ratio
+			dirs = load_field(dir_list, 0)
 			h, w = mags.shape
 
 			us, vs = cv2.polarToCart(mags, dirs, angleInDegrees=True)
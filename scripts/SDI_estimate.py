@@ -20,6 +20,7 @@ Created by Robert Ljubicic.
 try:
 	from __init__ import *
 	from class_console_printer import Console_printer, tag_string, tag_print, unix_path
+	from class_frame_reader import Frame_reader
 	from class_progress_bar import Progress_bar
 	from class_logger import time_hms
 	from class_timing import Timer, time_hms
@@ -118,8 +119,7 @@ def seeding_metrics(img_path_list, ROI, threshold, block_size, min_tracer_area,
 	progress_bar = Progress_bar(total=num_frames, prefix=tag_string('info', 'SDI estimation for frame '))
 	timer = Timer(total_iter=num_frames)
 	
-	for i, img_path in enumerate(img_path_list):
-		img = cv2.imread(img_path, 0)
+	for i, img in enumerate(Frame_reader(img_path_list)):
 		img_crop = img[ys: ye, xs: xe]
 		img_binary = cv2.threshold(img_crop, int(threshold*255), 255, cv2.THRESH_BINARY)[1]
 
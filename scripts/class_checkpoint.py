@@ -0,0 +1,102 @@
+"""
+This is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This package is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this package. If not, you can get eh GNU GPL from
+https://www.gnu.org/licenses/gpl-3.0.en.html.
+
+Created by Robert Ljubicic.
+"""
+
+try:
+	from __init__ import *
+	import json
+	import hashlib
+	from os import path, remove, replace
+	from utilities import present_exception_and_exit
+
+except Exception:
+	present_exception_and_exit('Import failed! For more information see traceback below. Please report this issue to the author:')
+
+
+# Parameters which do not change the results, e.g. the number of processes, may differ between the run and the resume
+FINGERPRINT_EXCLUDE = ('LivePreview', 'LivePreviewRate', 'CheckpointInterval', 'Workers', 'TileWorkers', 'OutOfCore', 'MemoryLimit')
+
+
+def config_fingerprint(cfg, section: str, img_list: list) -> str:
+	"""
+	Hash of the parameters in :section: of the configuration, except FINGERPRINT_EXCLUDE, and of the list of frames, in order.
+	"""
+	exclude = {key.lower() for key in FINGERPRINT_EXCLUDE}
+	parameters = [(key, value) for key, value in cfg[section].items() if key.lower() not in exclude] if cfg.has_section(section) else []
+
+	content = {
+		'parameters': sorted(parameters),
+		'frames': [path.basename(f) for f in img_list],
+	}
+
+	return hashlib.sha1(json.dumps(content).encode('utf-8')).hexdigest()
+
+
+class Checkpoint:
+	"""
+	Periodic snapshot of the running state of optical_flow.py, used by --resume after an interrupted run.
+	The state is a dictionary of arrays (e.g. accumulators and the number of processed frame pairs), stored in
+	a single .npz file together with the configuration fingerprint. Large stacks are not part of the state,
+	they are kept in memory-mapped files and only flushed before .save().
+	"""
+
+	def __init__(self, filename: str, fingerprint: str):
+		"""
+		:param filename:	Path to the .npz file.
+		:param fingerprint:	Configuration fingerprint, see config_fingerprint().
+		"""
+		self.filename = filename
+		self.fingerprint = fingerprint
+
+	def exists(self) -> bool:
+		return path.exists(self.filename)
+
+	def save(self, state: dict):
+		"""
+		Writes :state: to a temporary file first, so that an interruption never leaves a broken checkpoint.
+		"""
+		temp = f'{self.filename}.tmp.npz'
+		np.savez(temp, fingerprint=np.array(self.fingerprint), **state)
+		replace(temp, self.filename)
+
+	def load(self) -> dict:
+		"""
+		:return:	Saved state, or None if the checkpoint was made with a different configuration or frame list.
+		"""
+		with np.load(self.filename) as data:
+			if str(data['fingerprint']) != self.fingerprint:
+				return None
+
+			return {key: data[key] for key in data.files if key != 'fingerprint'}
+
+	def remove(self):
+		if self.exists():
+			remove(self.filename)
+
+
+def prefix_state(prefix: str, state: dict) -> dict:
+	"""
+	Prefixes the keys of :state: for storing the states of several objects in a single checkpoint.
+	"""
+	return {f'{prefix}.{key}': value for key, value in state.items()}
+
+
+def unprefix_state(prefix: str, state: dict) -> dict:
+	"""
+	Inverse of prefix_state(), returns only the keys with :prefix:.
+	"""
+	return {key[len(prefix) + 1:]: value for key, value in state.items() if key.startswith(f'{prefix}.')}
@@ -0,0 +1,122 @@
+"""
+This is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This package is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this package. If not, you can get eh GNU GPL from
+https://www.gnu.org/licenses/gpl-3.0.en.html.
+
+Created by Robert Ljubicic.
+"""
+
+try:
+	from __init__ import *
+	from utilities import present_exception_and_exit
+
+except Exception:
+	present_exception_and_exit('Import failed! For more information see traceback below. Please report this issue to the author:')
+
+
+class Direction_accumulator:
+	"""
+	Streaming magnitude-weighted circular mean of the flow direction, replaces the direction stack of optical_flow.py.
+	Every pooled cell keeps the sums of mag*sin(dir) and mag*cos(dir), so the memory is O(cells) and the
+	mean direction is the direction of the mean displacement vector, without any wrap-around at 0/360 deg.
+	Use .update(pooled_mag, pooled_dir) for every frame pair, then .mean().
+	"""
+
+	def __init__(self, shape: tuple):
+		"""
+		:param shape:	Pooled grid shape [rows, cols].
+		"""
+		self.shape = tuple(shape)
+
+		self.sin_sum = np.zeros(self.shape, dtype='float64')
+		self.cos_sum = np.zeros(self.shape, dtype='float64')
+		self.weight_sum = np.zeros(self.shape, dtype='float64')
+
+	def get_state(self) -> dict:
+		return {'sin_sum': self.sin_sum, 'cos_sum': self.cos_sum, 'weight_sum': self.weight_sum}
+
+	def set_state(self, state: dict):
+		self.sin_sum[:] = state['sin_sum']
+		self.cos_sum[:] = state['cos_sum']
+		self.weight_sum[:] = state['weight_sum']
+
+	def update(self, pooled_mag: np.ndarray, pooled_dir: np.ndarray):
+		"""
+		Adds a single frame pair. Cells with NaN magnitude or direction (e.g. masked cells) are skipped.
+		"""
+		valid = np.isfinite(pooled_mag) & np.isfinite(pooled_dir)
+		weights = np.where(valid, pooled_mag, 0)
+		radians = np.deg2rad(np.where(valid, pooled_dir, 0))
+
+		self.sin_sum += weights * np.sin(radians)
+		self.cos_sum += weights * np.cos(radians)
+		self.weight_sum += weights
+
+	def mean(self) -> np.ndarray:
+		"""
+		:return:	Mean directions [deg] in range [0, 360) as float32 array of shape [rows, cols], NaN where no direction was available.
+		"""
+		angle_mean = np.mod(np.rad2deg(np.arctan2(self.sin_sum, self.cos_sum)), 360)
+
+		return np.where(self.weight_sum > 0, angle_mean, np.nan).astype('float32')
+
+
+if __name__ == '__main__':
+	# Time and accuracy against the previous weighted average of the direction stack
+	from time import time
+	from temporal_filtering import temporal_filtering
+	from class_console_printer import tag_print
+
+	def weighted_angle_mean_reference(mag_stack, angle_stack, mag_mean):
+		mag_mean_nonzero = np.where(mag_mean == 0, 0.01, mag_mean)
+		ratio = np.divide(mag_stack, mag_mean_nonzero[..., np.newaxis])
+		ratio_corr = np.where(ratio > 1, 2 - ratio, ratio)
+		mag_weights = np.where(ratio_corr < 0, 0, ratio_corr)
+
+		angle_masked = np.ma.masked_array(angle_stack, np.isnan(angle_stack))
+		return np.ma.average(angle_masked, axis=-1, weights=mag_weights)
+
+	rng = np.random.default_rng(0)
+	shape = (90, 160, 1000)
+	mag_stack = rng.gamma(2.0, 1.0, size=shape).astype('float32')
+	angle_stack = rng.normal(90, 20, size=shape).astype('float32')
+	angle_stack[rng.random(shape) < 0.1] = np.nan
+
+	mag_mean = temporal_filtering(mag_stack)[4]
+
+	start = time()
+	reference = weighted_angle_mean_reference(mag_stack, angle_stack, mag_mean)
+	time_reference = time() - start
+
+	accumulator = Direction_accumulator(shape[:2])
+
+	start = time()
+	for j in range(shape[2]):
+		accumulator.update(mag_stack[:, :, j], angle_stack[:, :, j])
+	circular = accumulator.mean()
+	time_circular = time() - start
+
+	tag_print('info', f'Stack weighted average: {time_reference:.2f} sec, {mag_stack.nbytes * 2 / 2**20:.0f} MB of stacks')
+	tag_print('info', f'Circular accumulator  : {time_circular:.2f} sec, {accumulator.sin_sum.nbytes * 3 / 2**20:.1f} MB')
+	tag_print('info', f'Mean abs. difference  : {np.mean(np.abs(reference - circular)):.3f} deg')
+
+	# Directions around 0/360 deg, the arithmetic mean is off by up to 180 deg
+	angle_stack = np.mod(rng.normal(0, 10, size=shape), 360).astype('float32')
+	accumulator = Direction_accumulator(shape[:2])
+
+	for j in range(shape[2]):
+		accumulator.update(mag_stack[:, :, j], angle_stack[:, :, j])
+
+	circular = accumulator.mean()
+	tag_print('info', f'Max. deviation from 0 deg across wrap-around: circular = {np.max(np.minimum(circular, 360 - circular)):.3f} deg, '
+					  f'arithmetic = {np.max(np.minimum(angle_stack.mean(axis=-1), 360 - angle_stack.mean(axis=-1))):.3f} deg')
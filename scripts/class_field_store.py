@@ -0,0 +1,151 @@
+"""
+This is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This package is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this package. If not, you can get eh GNU GPL from
+https://www.gnu.org/licenses/gpl-3.0.en.html.
+
+Created by Robert Ljubicic.
+"""
+
+try:
+	from __init__ import *
+	import json
+	from os import path
+	from utilities import present_exception_and_exit
+
+except Exception:
+	present_exception_and_exit('Import failed! For more information see traceback below. Please report this issue to the author:')
+
+
+# Per-frame fields of optical_flow.py: name -> (legacy text format, quantization resolution)
+FIELDS = {
+	'magnitudes': ('%.2f', 0.01),
+	'directions': ('%.1f', 0.1),
+	'U':          ('%.2f', 0.01),
+	'V':          ('%.2f', 0.01),
+}
+
+
+class Field_store:
+	"""
+	Binary storage for a single per-frame field (e.g. magnitudes), replacing one text file per frame.
+	Frames are stored as contiguous chunks of a [frames, rows, cols] .npy file with a small .json header,
+	either as float32 or quantized to int16 with a fixed resolution (NaN stored as NODATA).
+	Values beyond the int16 range (+-INT16_MAX * resolution) are clipped and counted in .clipped.
+	Use .write(i, field) and .read(i) or store[i] for random access by frame index.
+	Use .close() to flush the data to disk.
+	"""
+
+	NODATA = -32768
+	INT16_MAX = 32767
+
+	def __init__(self, path_base: str, shape=None, resolution=None, mode='r'):
+		"""
+		:param path_base:	Path to the store without extension.
+		:param shape:		Shape [frames, rows, cols], required for mode='w'.
+		:param resolution:	Quantization step for int16 storage, or None for float32. Only used for mode='w'.
+		:param mode:		'r' to read an existing store, 'w' to create a new one, 'a' to continue writing to an existing one.
+		"""
+		self.path_base = path_base
+		self.mode = mode
+		self.clipped = 0
+
+		if mode == 'w':
+			self.resolution = resolution
+			dtype = 'float32' if resolution is None else 'int16'
+			self.data = np.lib.format.open_memmap(f'{path_base}.npy', mode='w+', dtype=dtype, shape=tuple(shape))
+
+			with open(f'{path_base}.json', 'w') as f:
+				json.dump({'resolution': resolution, 'nodata': self.NODATA}, f)
+		else:
+			with open(f'{path_base}.json', 'r') as f:
+				self.resolution = json.load(f)['resolution']
+
+			self.data = np.load(f'{path_base}.npy', mmap_mode='r+' if mode == 'a' else 'r')
+
+	@staticmethod
+	def exists(path_base: str) -> bool:
+		return path.exists(f'{path_base}.npy') and path.exists(f'{path_base}.json')
+
+	def __len__(self) -> int:
+		return self.data.shape[0]
+
+	def __getitem__(self, i: int) -> np.ndarray:
+		return self.read(i)
+
+	def write(self, i: int, field: np.ndarray):
+		if self.resolution is None:
+			self.data[i] = field
+		else:
+			with np.errstate(invalid='ignore'):
+				q = np.round(field / self.resolution)
+				self.clipped += np.count_nonzero(np.abs(q) > self.INT16_MAX)
+				q = np.clip(q, -self.INT16_MAX, self.INT16_MAX)
+
+			self.data[i] = np.where(np.isnan(q), self.NODATA, q)
+
+	def read(self, i: int) -> np.ndarray:
+		raw = self.data[i]
+
+		if self.resolution is None:
+			return np.array(raw)
+
+		field = raw.astype('float32') * np.float32(self.resolution)
+		field[raw == self.NODATA] = np.nan
+
+		return field
+
+	def flush(self):
+		if self.mode in ['w', 'a']:
+			self.data.flush()
+
+	def close(self):
+		self.flush()
+
+		del self.data
+
+
+if __name__ == '__main__':
+	from tempfile import TemporaryDirectory
+	from time import time
+	from class_console_printer import tag_print
+
+	rng = np.random.default_rng(0)
+	fields = rng.uniform(0, 30, size=(200, 135, 240)).astype('float32')
+	fields[:, :10, :10] = np.nan
+
+	with TemporaryDirectory() as tmp:
+		start = time()
+		for i in range(fields.shape[0]):
+			np.savetxt(f'{tmp}/{i}.txt', fields[i], fmt='%.2f')
+		text = [np.loadtxt(f'{tmp}/{i}.txt') for i in range(fields.shape[0])]
+		tag_print('info', f'Text files:       {time() - start:.3f} sec')
+
+		for resolution in [None, 0.01]:
+			start = time()
+			store = Field_store(f'{tmp}/store_{resolution}', fields.shape, resolution, mode='w')
+			for i in range(fields.shape[0]):
+				store.write(i, fields[i])
+			store.close()
+
+			store = Field_store(f'{tmp}/store_{resolution}')
+			binary = [store[i] for i in range(len(store))]
+			elapsed = time() - start
+			store.close()
+
+			max_diff = max(np.nanmax(np.abs(a - b)) for a, b in zip(text, binary))
+			tag_print('info', f'Binary ({"float32" if resolution is None else "int16"}): {elapsed:.3f} sec, max. abs. difference to text = {max_diff:.4f}')
+
+		store = Field_store(f'{tmp}/store_clipped', [1, 2, 2], 0.01, mode='w')
+		store.write(0, np.array([[0, 100], [-400, 500]], dtype='float32'))
+		tag_print('info', f'Clipped int16 values: {store.clipped}, read back as {store[0].ravel().tolist()}')
+		store.close()
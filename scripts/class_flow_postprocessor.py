@@ -0,0 +1,176 @@
+"""
+This is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This package is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this package. If not, you can get eh GNU GPL from
+https://www.gnu.org/licenses/gpl-3.0.en.html.
+
+Created by Robert Ljubicic.
+"""
+
+try:
+	from __init__ import *
+	from pooling_kernels import spatial_pooling
+	from utilities import present_exception_and_exit
+
+except Exception:
+	present_exception_and_exit('Import failed! For more information see traceback below. Please report this issue to the author:')
+
+
+DIRECTION_FILTER_THRESHOLD = 0.001
+
+
+class Flow_postprocessor:
+	"""
+	Filters the dense flow by magnitude and direction and applies spatial pooling, see postprocess_flow() in flow_processing.py.
+	All full resolution buffers are float32 (or bool) and allocated once, the flow of every pair is processed in place.
+	Masks are applied by multiplication instead of masked assignment, which is branch-free and several times faster.
+	The returned pooled fields are views of internal buffers and are overwritten by the next call of .process().
+	"""
+
+	def __init__(self, flow_size: tuple, pooled_shape: tuple):
+		"""
+		:param flow_size:		Size (w, h) of the flow at processing resolution.
+		:param pooled_shape:	Shape [h_pooled, w_pooled] of the pooled fields.
+		"""
+		w, h = flow_size
+		h_pooled, w_pooled = pooled_shape
+
+		self.flow_x = np.empty([h, w], dtype='float32')
+		self.flow_y = np.empty([h, w], dtype='float32')
+		self.magnitude = np.empty([h, w], dtype='float32')
+		self.angle = np.empty([h, w], dtype='float32')
+		self.temp = np.empty([h, w], dtype='float32')
+		self.mask = np.empty([h, w], dtype='bool')
+		self.mask_temp = np.empty([h, w], dtype='bool')
+
+		self.pooled_mag = np.empty([h_pooled * w_pooled], dtype='float32')
+		self.pooled_dir = np.empty([h_pooled * w_pooled], dtype='float32')
+		self.pooled_mask = np.empty([h_pooled * w_pooled], dtype='bool')
+
+	def process(self, flow: np.ndarray, params: dict) -> tuple:
+		"""
+		:param flow:	Dense optical flow of shape [h, w, 2] at the processing resolution.
+		:param params:	Dictionary of frame pair parameters, see optical_flow.py.
+		:return:		Tuple (pooled_mag, pooled_dir) of shape [h_pooled, w_pooled], magnitudes at the full resolution.
+		"""
+		angle_func = params['angle_func']
+		angle_lower = params['angle_lower']
+		angle_upper = params['angle_upper']
+		max_magnitude = params['max_magnitude']
+		pooling = params['flow_pooling']
+		w, h = params['flow_size']
+		h_pooled, w_pooled = params['pooled_shape']
+
+		magnitude = self.magnitude
+		angle = self.angle
+		temp = self.temp
+		mask = self.mask
+
+		np.copyto(self.flow_x, flow[..., 0])
+		np.copyto(self.flow_y, flow[..., 1])
+		cv2.cartToPolar(self.flow_x, self.flow_y, magnitude=magnitude, angle=angle, angleInDegrees=True)
+
+		if params['reduction'] > 1:
+			np.multiply(magnitude, params['reduction'], out=magnitude)
+
+		if max_magnitude > 0:
+			np.less_equal(magnitude, max_magnitude, out=mask)
+			np.multiply(magnitude, mask, out=magnitude)
+
+		# Filter by vector angle, mask holds the accepted vectors
+		np.greater_equal(angle, angle_lower, out=mask)
+		np.less_equal(angle, angle_upper, out=self.mask_temp)
+		angle_func(mask, self.mask_temp, out=mask)
+
+		np.multiply(magnitude, mask, out=magnitude)
+
+		# Rejected directions are NaN: 0/0 = NaN, 0/1 = 0
+		np.copyto(temp, mask)
+
+		with np.errstate(invalid='ignore'):
+			np.divide(0, temp, out=temp)
+
+		np.add(angle, temp, out=angle)
+
+		if angle_func.__name__ == "bitwise_or":
+			np.subtract(angle, angle_upper, out=angle)
+			np.less_equal(angle, 0, out=mask)
+			np.multiply(mask, np.float32(360), out=temp)
+			np.add(angle, temp, out=angle)
+
+		if pooling > 1:
+			spatial_pooling(magnitude.ravel(), angle.ravel(), self.pooled_mag, self.pooled_dir, h, w, pooling)
+
+			np.less(self.pooled_mag, DIRECTION_FILTER_THRESHOLD, out=self.pooled_mask)
+			np.copyto(self.pooled_dir, np.nan, where=self.pooled_mask)
+
+			return self.pooled_mag.reshape(h_pooled, w_pooled), self.pooled_dir.reshape(h_pooled, w_pooled)
+		else:
+			return magnitude, angle
+
+
+if __name__ == '__main__':
+	# Time and memory per frame pair against the previous postprocess_flow() without pooling
+	import tracemalloc
+	from time import time
+
+	def postprocess_reference(flow, params):
+		angle_func = params['angle_func']
+		angle_lower = params['angle_lower']
+		angle_upper = params['angle_upper']
+
+		magnitude, angle = cv2.cartToPolar(flow[..., 0], flow[..., 1], angleInDegrees=True)
+		magnitude[magnitude > params['max_magnitude']] = 0
+
+		angle = np.where(angle_func((angle >= angle_lower), (angle <= angle_upper)), angle, np.nan)
+		mask_magnitude = np.where(angle >= 0, 1, 0)
+		magnitude *= mask_magnitude
+
+		if angle_func.__name__ == "bitwise_or":
+			angle -= angle_upper
+			angle = np.where(angle <= 0, angle + 360, angle)
+
+		return magnitude, angle
+
+	h, w = 1080, 1920
+	rng = np.random.default_rng(0)
+	flow = rng.normal(0, 3, size=(h, w, 2)).astype('float32')
+
+	params = {
+		'angle_func': np.bitwise_or,
+		'angle_lower': 300,
+		'angle_upper': 60,
+		'max_magnitude': 8,
+		'reduction': 1,
+		'flow_pooling': 1,
+		'flow_size': (w, h),
+		'pooled_shape': (h, w),
+	}
+
+	postprocessor = Flow_postprocessor((w, h), (h, w))
+
+	for name, func in [('Reference', postprocess_reference), ('In place', postprocessor.process)]:
+		func(flow, params)
+
+		tracemalloc.start()
+		start = time()
+		for _ in range(20):
+			mag, ang = func(flow, params)
+		elapsed = (time() - start) / 20
+		peak = tracemalloc.get_traced_memory()[1]
+		tracemalloc.stop()
+
+		print(f'{name:10s}: {elapsed*1000:6.1f} ms/pair, peak allocation {peak / 2**20:6.1f} MB/pair')
+
+	mag_ref, ang_ref = postprocess_reference(flow, params)
+	print(f'Max. abs. difference: magnitude = {np.max(np.abs(mag_ref - mag)):.2e}, '
+		  f'angle = {np.nanmax(np.abs(ang_ref - ang)):.2e}, same NaN = {np.array_equal(np.isnan(ang_ref), np.isnan(ang))}')
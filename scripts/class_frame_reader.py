@@ -0,0 +1,137 @@
+"""
+This is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This package is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this package. If not, you can get eh GNU GPL from
+https://www.gnu.org/licenses/gpl-3.0.en.html.
+
+Created by Robert Ljubicic.
+"""
+
+try:
+	from __init__ import *
+	from collections import deque
+	from concurrent.futures import ThreadPoolExecutor
+	from frame_loading import read_frame
+	from utilities import present_exception_and_exit
+
+except Exception:
+	present_exception_and_exit('Import failed! For more information see traceback below. Please report this issue to the author:')
+
+
+# Number of frames read ahead of the one being processed
+PREFETCH_FRAMES = 4
+
+# Threads reading the frames, cv2.imread() releases the GIL so the reads overlap with the processing
+PREFETCH_WORKERS = 2
+
+
+class Frame_reader:
+	"""
+	Iterator over the frames of :paths:, in order, which reads the next frames on background threads
+	while the current one is processed. At most :prefetch: frames are held in memory ahead of the current one.
+	Unreadable frames are yielded as None, same as cv2.imread().
+
+	Use as:
+		for frame in Frame_reader(paths, grayscale=True):
+			...
+	"""
+
+	def __init__(self, paths: list, grayscale=True, size=None, scale=1.0, prefetch=PREFETCH_FRAMES, workers=PREFETCH_WORKERS, read=None):
+		"""
+		:param paths:		List of frame paths.
+		:param grayscale:	Whether to read the frames as grayscale or as BGR.
+		:param size:		Frame size (w, h) if :scale: != 1.0, see read_frame().
+		:param scale:		Scale factor of the frames.
+		:param prefetch:	Number of frames read ahead, 0 = read synchronously.
+		:param workers:		Number of reading threads.
+		:param read:		Function read(path) -> frame, replaces read_frame() and the arguments above.
+		"""
+		self.paths = list(paths)
+		self.prefetch = max(0, prefetch)
+		self.workers = max(1, workers)
+
+		if read is None:
+			self.read = lambda frame_path: read_frame(frame_path, size, scale, grayscale)
+		else:
+			self.read = read
+
+	def __len__(self) -> int:
+		return len(self.paths)
+
+	def __iter__(self):
+		if self.prefetch == 0:
+			for frame_path in self.paths:
+				yield self.read(frame_path)
+
+			return
+
+		executor = ThreadPoolExecutor(max_workers=self.workers)
+		pending = deque()
+		next_path = 0
+
+		try:
+			while next_path < len(self.paths) or pending:
+				while next_path < len(self.paths) and len(pending) <= self.prefetch:
+					pending.append(executor.submit(self.read, self.paths[next_path]))
+					next_path += 1
+
+				yield pending.popleft().result()
+
+		finally:
+			# Also reached when the loop over the frames is interrupted. Pending reads are cancelled here,
+			# shutdown(cancel_futures=True) is only available since Python 3.9.
+			for future in pending:
+				future.cancel()
+
+			executor.shutdown(wait=False)
+
+
+if __name__ == '__main__':
+	# Throughput of synchronous and prefetched reading with simulated processing and I/O latency
+	from time import time, sleep
+	from tempfile import TemporaryDirectory
+	from class_console_printer import tag_print
+
+	rng = np.random.default_rng(0)
+	num_frames = 40
+	latency = 0.02			# Simulated network storage latency [sec/frame]
+	processing = 0.03		# Simulated processing [sec/frame]
+
+	def slow_read(frame_path):
+		sleep(latency)
+		return cv2.imread(frame_path, 0)
+
+	with TemporaryDirectory() as folder:
+		paths = []
+
+		for i in range(num_frames):
+			paths.append(f'{folder}/{i:03d}.jpg')
+			cv2.imwrite(paths[-1], (rng.random((1080, 1920)) * 255).astype('uint8'))
+
+		for prefetch in [0, 1, 4]:
+			start = time()
+			checksum = 0
+
+			for frame in Frame_reader(paths, prefetch=prefetch, read=slow_read):
+				checksum += int(frame[0, 0])
+				sleep(processing)
+
+			elapsed = time() - start
+			tag_print('info', f'Prefetch = {prefetch}: {num_frames / elapsed:5.1f} fps, checksum = {checksum}')
+
+		# Interrupted loop does not wait for the remaining frames
+		start = time()
+		for n, frame in enumerate(Frame_reader(paths, read=slow_read)):
+			if n == 2:
+				break
+		tag_print('info', f'Interrupted after 3 frames in {time() - start:.2f} sec')
+		sleep(latency * PREFETCH_WORKERS)
@@ -0,0 +1,131 @@
+"""
+This is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This package is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this package. If not, you can get eh GNU GPL from
+https://www.gnu.org/licenses/gpl-3.0.en.html.
+
+Created by Robert Ljubicic.
+"""
+
+try:
+	from __init__ import *
+	from os import remove
+	from class_checkpoint import prefix_state, unprefix_state
+	from class_diagnostics_table import Diagnostics_table
+	from class_direction_accumulator import Direction_accumulator
+	from class_threshold_histogram import Threshold_histogram
+	from flow_mask import expand_cells
+	from temporal_filtering import create_stack, temporal_filtering
+	from utilities import present_exception_and_exit
+
+except Exception:
+	present_exception_and_exit('Import failed! For more information see traceback below. Please report this issue to the author:')
+
+
+class Lag_accumulator:
+	"""
+	Collects the pooled fields of a single velocity step (lag) of the multi-lag optical flow,
+	either in a magnitude stack or in a Threshold_histogram, with a Direction_accumulator and a Diagnostics_table.
+	Use .update(k, pooled_mag, pooled_dir) for every frame pair of the lag, then .filter().
+	"""
+
+	def __init__(self, lag: int, pooled_shape: tuple, pairs: list, histogram_bins=0, histogram_max=25.6,
+				 cell_mask=None, box=None, median_bins=0, stack_path=None, resume=False):
+		"""
+		:param lag:				Velocity step [frames].
+		:param pooled_shape:	Full pooled grid shape [rows, cols].
+		:param pairs:			Frame index pairs (a, b) of this lag, see plan_pairs() in pair_planner.py.
+		:param histogram_bins:	If > 0, a Threshold_histogram is used instead of the stacks.
+		:param histogram_max:	Upper edge of the histogram [px/frame].
+		:param cell_mask:		Pooled water surface mask, see flow_mask.py, or None.
+		:param box:				Bounding box of the masked cells in which the fields are computed.
+		:param median_bins:		If > 0, medians of the diagnostics are approximated from histograms.
+		:param stack_path:		Path to the memory-mapped magnitude stack, or None to keep it in RAM.
+		:param resume:			If True, the existing memory-mapped stack is reopened.
+		"""
+		self.lag = lag
+		self.pairs = pairs
+		self.done = 0
+		self.stack_path = stack_path
+		num_pairs = len(pairs)
+		self.cell_mask = cell_mask
+		self.box = box
+
+		if histogram_bins > 0:
+			self.histogram = Threshold_histogram(pooled_shape, histogram_bins, histogram_max)
+		else:
+			self.histogram = None
+			self.mag_stack = create_stack([*pooled_shape, num_pairs], 'float32', stack_path, 'r+' if resume else 'w+')
+
+		self.directions = Direction_accumulator(pooled_shape)
+
+		self.diagnostics = Diagnostics_table(num_pairs, median_bins, histogram_max)
+
+	def get_state(self) -> dict:
+		"""
+		State for a checkpoint. A memory-mapped stack is flushed to disk, a stack in RAM is part of the state.
+		"""
+		state = {'done': np.array(self.done)}
+		state.update(prefix_state('directions', self.directions.get_state()))
+		state.update(prefix_state('diagnostics', self.diagnostics.get_state()))
+
+		if self.histogram is not None:
+			state.update(prefix_state('histogram', self.histogram.get_state()))
+		elif isinstance(self.mag_stack.base, np.memmap):
+			self.mag_stack.base.flush()
+		else:
+			state['mag_stack'] = self.mag_stack
+
+		return state
+
+	def set_state(self, state: dict):
+		self.done = int(state['done'])
+		self.directions.set_state(unprefix_state('directions', state))
+		self.diagnostics.set_state(unprefix_state('diagnostics', state))
+
+		if self.histogram is not None:
+			self.histogram.set_state(unprefix_state('histogram', state))
+		elif 'mag_stack' in state:
+			self.mag_stack[:] = state['mag_stack']
+
+	def update(self, k: int, pooled_mag: np.ndarray, pooled_dir: np.ndarray):
+		if self.cell_mask is not None:
+			pooled_mag = expand_cells(pooled_mag, self.box, self.cell_mask)
+			pooled_dir = expand_cells(pooled_dir, self.box, self.cell_mask)
+
+		if self.histogram is not None:
+			self.histogram.update(pooled_mag)
+		else:
+			self.mag_stack[:, :, k] = pooled_mag
+
+		self.directions.update(pooled_mag, pooled_dir)
+
+		self.diagnostics.update(k, pooled_mag if self.cell_mask is None else pooled_mag[self.cell_mask], *self.pairs[k])
+		self.done = k + 1
+
+	def filter(self) -> tuple:
+		"""
+		Temporal filtering of the collected fields, releases the stack or the histogram.
+
+		:return:	Tuple (T1, T2, T3, threshold_ratios, mag_mean, angle_mean).
+		"""
+		if self.histogram is not None:
+			results = self.histogram.temporal_filtering()
+			del self.histogram
+		else:
+			results = temporal_filtering(self.mag_stack, mask=self.cell_mask)
+			del self.mag_stack
+
+			if self.stack_path is not None:
+				remove(self.stack_path)
+
+		return (*results, self.directions.mean())
@@ -0,0 +1,160 @@
+"""
+This is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This package is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this package. If not, you can get eh GNU GPL from
+https://www.gnu.org/licenses/gpl-3.0.en.html.
+
+Created by Robert Ljubicic.
+"""
+
+try:
+	from __init__ import *
+	from multiprocessing import Process, Queue
+	from queue import Empty, Full
+	from time import time
+	from utilities import present_exception_and_exit
+
+except Exception:
+	present_exception_and_exit('Import failed! For more information see traceback below. Please report this issue to the author:')
+
+
+# Max. size of the preview images [px], larger snapshots are downsampled before sending
+PREVIEW_MAX_SIZE = 800
+
+# Interval of the GUI event loop in the preview process [sec]
+PREVIEW_POLL_INTERVAL = 0.05
+
+
+def downsample(array: np.ndarray, max_size=PREVIEW_MAX_SIZE) -> np.ndarray:
+	"""
+	Strided copy of :array: with no side longer than :max_size:.
+	"""
+	step = max(1, int(np.ceil(max(array.shape[:2]) / max_size)))
+	return np.array(array[::step, ::step])
+
+
+def preview_process(queue: Queue, pooled_shape: tuple, size: tuple):
+	"""
+	Runs the live preview window. Snapshots (mag_max, frame_path, title) are taken from :queue:
+	until None is received or the window is closed.
+
+	:param pooled_shape:	Full pooled grid shape [rows, cols], defines the extent of the images.
+	:param size:			Frame size (w, h) at processing scale.
+	"""
+	import matplotlib.pyplot as plt
+
+	h_pooled, w_pooled = pooled_shape
+	extent = [-0.5, w_pooled - 0.5, h_pooled - 0.5, -0.5]
+
+	# Background is shown at about the same resolution as the flow
+	background_size = tuple(np.maximum(np.round(np.array(size) / max(1, max(size) / PREVIEW_MAX_SIZE)), 1).astype(int))
+
+	fig, ax = plt.subplots()
+
+	try:
+		mng = plt.get_current_fig_manager()
+		mng.window.state('zoomed')
+		mng.set_window_title('Optical flow')
+	except Exception:
+		pass
+
+	background = plt.imshow(np.zeros(background_size[::-1], dtype='uint8'), cmap='gray', vmin=0, vmax=255, extent=extent)
+	flow_shown = plt.imshow(downsample(np.zeros(pooled_shape, dtype='float32')), cmap='jet', alpha=0.5, extent=extent)
+
+	cbar = plt.colorbar(flow_shown)
+	cbar.solids.set(alpha=1.0)
+	cbar.set_label('Velocity magnitude [px/frame]')
+
+	plt.axis('off')
+	plt.tight_layout()
+
+	while plt.fignum_exists(fig.number):
+		try:
+			snapshot = queue.get_nowait()
+		except Empty:
+			plt.pause(PREVIEW_POLL_INTERVAL)
+			continue
+
+		if snapshot is None:
+			break
+
+		mag_max, frame_path, title = snapshot
+
+		frame = cv2.imread(frame_path, 0)
+
+		if frame is not None:
+			background.set_data(cv2.resize(frame, background_size, interpolation=cv2.INTER_AREA))
+
+		# Color scale ignores the edges of the frame
+		h_buffer = mag_max.shape[0]//10
+		w_buffer = mag_max.shape[1]//10
+		inner = mag_max[h_buffer: mag_max.shape[0] - h_buffer, w_buffer: mag_max.shape[1] - w_buffer]
+		max_cbar = np.nanmax(inner) if np.isfinite(inner).any() else 1
+
+		flow_shown.set_data(mag_max)
+		flow_shown.set_clim(vmax=max_cbar, vmin=0)
+		cbar.solids.set(alpha=1.0)
+
+		plt.title(title)
+		plt.pause(PREVIEW_POLL_INTERVAL)
+
+	plt.close('all')
+
+
+class Live_preview:
+	"""
+	Live preview of optical_flow.py in a separate process, so that rendering never blocks the computation.
+	Use .update(mag_max, frame_path, title) after every frame pair. Snapshots are sent at most :rate: times
+	per second and dropped if the preview is still busy with the previous one. Use .close() at the end.
+	"""
+
+	def __init__(self, pooled_shape: tuple, size: tuple, rate=2.0):
+		"""
+		:param pooled_shape:	Full pooled grid shape [rows, cols].
+		:param size:			Frame size (w, h) at processing scale.
+		:param rate:			Max. number of updates per second.
+		"""
+		self.interval = 1 / rate if rate > 0 else 0
+		self.last_update = 0
+
+		self.queue = Queue(maxsize=1)
+		self.process = Process(target=preview_process, args=(self.queue, tuple(pooled_shape), tuple(size)), daemon=True)
+		self.process.start()
+
+	def update(self, mag_max: np.ndarray, frame_path: str, title: str):
+		now = time()
+
+		if now - self.last_update < self.interval:
+			return
+
+		try:
+			self.queue.put_nowait((downsample(mag_max).astype('float32'), frame_path, title))
+			self.last_update = now
+		except Full:
+			pass
+
+	def close(self, timeout=5):
+		# Drop a pending snapshot so that the stop signal fits into the queue
+		try:
+			self.queue.get_nowait()
+		except Empty:
+			pass
+
+		try:
+			self.queue.put_nowait(None)
+		except Full:
+			pass
+
+		self.process.join(timeout)
+
+		if self.process.is_alive():
+			self.process.terminate()
@@ -0,0 +1,149 @@
+"""
+This is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This package is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this package. If not, you can get eh GNU GPL from
+https://www.gnu.org/licenses/gpl-3.0.en.html.
+
+Created by Robert Ljubicic.
+"""
+
+try:
+	from __init__ import *
+	from math import ceil
+	from utilities import present_exception_and_exit
+
+except Exception:
+	present_exception_and_exit('Import failed! For more information see traceback below. Please report this issue to the author:')
+
+
+# Gain of the velocity update, 1 = velocity is the last displacement
+VELOCITY_GAIN = 0.5
+
+# Gain of the innovation variance update
+INNOVATION_GAIN = 0.2
+
+# Search radius in standard deviations of the innovation
+INNOVATION_SIGMAS = 4.0
+
+# Search radius added to the one from the innovation [px]
+SEARCH_MARGIN = 3
+
+
+class Marker_predictor:
+	"""
+	Constant velocity predictor of the marker positions in the next frame, an alpha-beta filter with alpha = 1 since the
+	tracked positions are kept as they are. For every marker it keeps the velocity and the variance of the innovation
+	(tracked - predicted position), and gives the shift of the search area center and a search area size which covers
+	the innovation with a margin. Search areas start at the full size and shrink as the motion becomes predictable.
+	Use .predict() before every frame, then .update() with the tracked positions.
+	"""
+
+	def __init__(self, num_markers: int, k_size: int, search_size: int):
+		"""
+		:param k_size:		Kernel size [px].
+		:param search_size:	Max. search area size [px], e.g. SearchAreaSize.
+		"""
+		self.k_size = k_size
+		self.search_size = search_size
+
+		self.velocity = np.zeros([num_markers, 2])
+		max_radius = (search_size - k_size) / 2
+		self.innovation_var = np.full(num_markers, (max_radius / INNOVATION_SIGMAS) ** 2)
+
+	def predict(self) -> list:
+		"""
+		:return:	List of (shift_x, shift_y, size) for every marker, where the shift is the predicted displacement
+					rounded to whole pixels [px] and size is the odd search area size [px], at most :search_size:.
+		"""
+		shifts = np.round(self.velocity).astype(int)
+		predictions = []
+
+		for j in range(self.velocity.shape[0]):
+			radius = ceil(INNOVATION_SIGMAS * np.sqrt(self.innovation_var[j])) + SEARCH_MARGIN
+			size = min(self.k_size + 2*radius, self.search_size)
+			predictions.append((int(shifts[j, 0]), int(shifts[j, 1]), size))
+
+		return predictions
+
+	def update(self, previous: list, tracked: list, lost: list):
+		"""
+		:param previous:	Marker positions [x, y] in the previous frame.
+		:param tracked:		Marker positions [x, y] in the current frame.
+		:param lost:		Whether the marker is lost, lost markers are not updated.
+		"""
+		valid = ~np.asarray(lost, dtype=bool)
+		displacement = np.asarray(tracked, dtype='float64') - np.asarray(previous, dtype='float64')
+		innovation = displacement - self.velocity
+
+		self.velocity[valid] += VELOCITY_GAIN * innovation[valid]
+		self.innovation_var[valid] += INNOVATION_GAIN * (np.sum(innovation[valid] ** 2, axis=1) - self.innovation_var[valid])
+
+
+if __name__ == '__main__':
+	# Time and results of the predictive search against the fixed search area, for markers drifting with a varying velocity
+	# and an occasional jump, as from a drone camera
+	from time import time
+	from gcp_search import track_markers
+	from class_console_printer import tag_print
+
+	rng = np.random.default_rng(0)
+	texture = cv2.GaussianBlur((rng.random((1400, 1400)) * 255).astype('uint8'), (9, 9), 2.5)
+	num_frames, num_markers = 80, 12
+	k_size, search_size = 21, 61
+
+	t = np.arange(num_frames)
+	drift = np.stack([12 * np.sin(t / 15) + 0.8 * t, 9 * np.cos(t / 11) - 0.5 * t], axis=1)
+	drift[50:] += [9, -7]
+
+	def frame(n):
+		matrix = np.float32([[1, 0, drift[n, 0]], [0, 1, drift[n, 1]]])
+		return np.clip(cv2.warpAffine(texture, matrix, texture.shape[::-1]) + rng.normal(0, 3, texture.shape), 0, 255).astype('uint8')
+
+	frames = [frame(n) for n in range(num_frames)]
+	start_markers = [list(m) for m in rng.uniform(300, 1100, (num_markers, 2))]
+	kernels = [cv2.getRectSubPix(frames[0], (k_size, k_size), tuple(m)) for m in start_markers]
+
+	params = {'search_size': search_size, 'exp_search_size': 2*search_size + 1, 'k_size': k_size, 'expand_ssim_search': 1,
+			  'expand_ssim_thr': 0.5, 'expand_pyramid': 0, 'update_kernels': 0, 'predict_ssim_thr': 0.8}
+
+	tracks = {}
+
+	for predictive in [False, True]:
+		markers = [m.copy() for m in start_markers]
+		predictor = Marker_predictor(num_markers, k_size, search_size) if predictive else None
+		errors = []
+		widened = 0
+		sizes = []
+
+		start = time()
+
+		for n in range(num_frames):
+			predictions = predictor.predict() if predictive else None
+			results = track_markers(frames[n], markers, kernels, params, predictions=predictions)
+			previous = markers
+			markers = [r['marker'] for r in results]
+
+			if predictive:
+				predictor.update(previous, markers, [r['lost'] for r in results])
+				widened += sum(r['widened'] for r in results)
+				sizes += [p[2] for p in predictions]
+
+			tracks.setdefault(predictive, []).append(markers)
+			errors.append(np.abs(np.array(markers) - np.array(start_markers) - (drift[n] - drift[0])).max())
+
+		elapsed = time() - start
+		mean_size = np.mean(sizes) if sizes else search_size
+		tag_print('info', f'{"Predictive" if predictive else "Fixed":10s} search area: {elapsed / num_frames * 1000:6.1f} ms/frame, '
+						  f'mean SA size = {mean_size:5.1f} px, widened = {widened}, max. error = {max(errors):.3f} px')
+
+	diff = np.abs(np.array(tracks[True]) - np.array(tracks[False]))
+	tag_print('info', f'Predictive against fixed: same positions in {np.mean(np.all(diff < 1e-9, axis=(1, 2))) * 100:.0f}% of frames, max. difference = {diff.max():.3f} px')
@@ -0,0 +1,193 @@
+"""
+This is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This package is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this package. If not, you can get eh GNU GPL from
+https://www.gnu.org/licenses/gpl-3.0.en.html.
+
+Created by Robert Ljubicic.
+"""
+
+try:
+	from __init__ import *
+	from vel_ratio import threshold_ratio_array, vel_ratio_array
+	from utilities import present_exception_and_exit
+
+except Exception:
+	present_exception_and_exit('Import failed! For more information see traceback below. Please report this issue to the author:')
+
+
+class Threshold_histogram:
+	"""
+	Streaming replacement for the magnitude stack of optical_flow.py.
+	Every pooled cell keeps a fixed-bin histogram of magnitudes with the exact sums, minima and maxima of
+	magnitudes per bin, so the memory is O(cells x bins) instead of O(cells x frame pairs).
+	Use .update(pooled_mag) for every frame pair, then .temporal_filtering() for the same results
+	as in temporal_filtering.py.
+
+	T0 is exact. T1, T2 and T3 are exact except for the bin containing the threshold, in which
+	the magnitudes are assumed to be uniformly distributed between the smallest and the largest
+	magnitude of the bin. Magnitudes above :max_value: are collected in the last bin, which is
+	always averaged as a whole.
+	"""
+
+	def __init__(self, shape: tuple, bins=256, max_value=25.6):
+		"""
+		:param shape:		Pooled grid shape [rows, cols].
+		:param bins:		Number of histogram bins.
+		:param max_value:	Upper edge of the histogram [px/frame].
+		"""
+		self.shape = tuple(shape)
+		self.bins = bins
+		self.width = max_value / bins
+
+		cells = self.shape[0] * self.shape[1]
+
+		self.counts = np.zeros([cells, bins], dtype='int32')
+		self.sums = np.zeros([cells, bins], dtype='float64')
+		self.mins = np.full([cells, bins], np.inf, dtype='float32')
+		self.maxs = np.full([cells, bins], -np.inf, dtype='float32')
+
+		self.cell_index = np.arange(cells) * bins
+
+	@staticmethod
+	def memory(shape: tuple, bins: int) -> int:
+		"""
+		Memory required for the histograms [bytes].
+		"""
+		return shape[0] * shape[1] * bins * 20
+
+	def get_state(self) -> dict:
+		return {'counts': self.counts, 'sums': self.sums, 'mins': self.mins, 'maxs': self.maxs}
+
+	def set_state(self, state: dict):
+		self.counts[:] = state['counts']
+		self.sums[:] = state['sums']
+		self.mins[:] = state['mins']
+		self.maxs[:] = state['maxs']
+
+	def update(self, pooled_mag: np.ndarray):
+		"""
+		Adds a single frame pair. NaN magnitudes (e.g. masked cells) are skipped.
+		"""
+		mags = pooled_mag.ravel()
+		valid = np.isfinite(mags)
+
+		with np.errstate(invalid='ignore'):
+			k = np.clip(np.floor(mags / self.width), 0, self.bins - 1)
+
+		# Every cell gets exactly one value, so the indices are unique and += is safe
+		index = self.cell_index[valid] + k[valid].astype('int64')
+		self.counts.ravel()[index] += 1
+		self.sums.ravel()[index] += mags[valid]
+		self.mins.ravel()[index] = np.minimum(self.mins.ravel()[index], mags[valid])
+		self.maxs.ravel()[index] = np.maximum(self.maxs.ravel()[index], mags[valid])
+
+	def threshold_mean(self, threshold: np.ndarray, counts_above: np.ndarray, sums_above: np.ndarray) -> np.ndarray:
+		"""
+		Mean of the magnitudes >= :threshold: for all cells, see threshold_mean() in temporal_filtering.py.
+
+		:param threshold:		Array of shape [cells].
+		:param counts_above:	Counts in the bins above each bin, shape [cells, bins].
+		:param sums_above:		Sums in the bins above each bin, shape [cells, bins].
+		:return:				Array of shape [cells], float64.
+		"""
+		rows = np.arange(threshold.size)
+		t = np.where(np.isfinite(threshold), threshold, 0)
+		k = np.clip(np.floor(t / self.width), 0, self.bins - 1).astype('int64')
+		last = k == self.bins - 1
+
+		count_k = self.counts[rows, k]
+		sum_k = self.sums[rows, k]
+		lo = self.mins[rows, k].astype('float64')
+		hi = self.maxs[rows, k].astype('float64')
+
+		# Part of the threshold bin above the threshold, assuming uniform distribution between the smallest and the largest
+		# magnitude of the bin. The mean of the part is kept within the observed magnitudes of the bin.
+		with np.errstate(divide='ignore', invalid='ignore'):
+			t_bin = np.clip(t, lo, hi)
+			fraction = np.where(hi > lo, (hi - t_bin) / (hi - lo), t <= hi)
+			fraction = np.where(last | (t <= lo), 1, np.where(count_k > 0, fraction, 0))
+			mean_k = np.where(count_k > 0, sum_k / count_k, 0)
+			partial_count = fraction * count_k
+			partial_mean = np.clip(mean_k + (t_bin - lo) / 2, t_bin, hi)
+			partial_sum = np.where(last | (t <= lo), sum_k, partial_count * np.where(count_k > 0, partial_mean, 0))
+
+			total = sums_above[rows, k] + partial_sum
+			count = counts_above[rows, k] + partial_count
+
+			# The largest magnitude is always selected, also when the approximated threshold is above it
+			cell_max = self.maxs.max(axis=1).astype('float64')
+			mean = np.where(count > 0, total / count, cell_max)
+
+			return np.where(np.isfinite(threshold), mean, np.nan)
+
+	def threshold_means(self) -> tuple:
+		"""
+		Threshold means T1, T2 and T3, see threshold_means() in temporal_filtering.py.
+
+		:return:	Tuple (T1, T2, T3) of float64 arrays of shape [cells].
+		"""
+		# Sums over the bins above bin k, excluding k
+		counts_above = np.cumsum(self.counts[:, ::-1], axis=1)[:, ::-1] - self.counts
+		sums_above = np.cumsum(self.sums[:, ::-1], axis=1)[:, ::-1] - self.sums
+
+		with np.errstate(divide='ignore', invalid='ignore'):
+			T0 = self.sums.sum(axis=1) / self.counts.sum(axis=1)
+
+		T1 = self.threshold_mean(T0, counts_above, sums_above)
+		T2 = self.threshold_mean(T1, counts_above, sums_above)
+		T3 = self.threshold_mean(T2, counts_above, sums_above)
+
+		return T1, T2, T3
+
+	def temporal_filtering(self) -> tuple:
+		"""
+		Same as temporal_filtering() in temporal_filtering.py, evaluated from the histograms.
+		Cells without any magnitudes (e.g. masked cells) are NaN.
+
+		:return:	Tuple (T1, T2, T3, threshold_ratios, mag_mean) of float32 arrays of shape [rows, cols].
+		"""
+		T1, T2, T3 = self.threshold_means()
+		results = [T1, T2, T3, threshold_ratio_array(T1, T2, T3), vel_ratio_array(T1, T2, T3)]
+
+		return tuple(np.reshape(r, self.shape).astype('float32') for r in results)
+
+
+if __name__ == '__main__':
+	# Accuracy and memory against the full stack of temporal_filtering.py
+	from temporal_filtering import temporal_filtering
+	from class_console_printer import tag_print
+
+	rng = np.random.default_rng(0)
+
+	# Wide distribution, and a narrow one within a single bin as for a steady flow
+	stacks = {
+		'gamma': rng.gamma(2.0, 1.0, size=(90, 160, 1000)).astype('float32'),
+		'narrow': (3.16 + rng.normal(0, 0.002, size=(12, 28, 300))).astype('float32'),
+		'constant': np.full((12, 28, 300), 3.16, dtype='float32'),
+	}
+
+	for name, stack in stacks.items():
+		exact = temporal_filtering(stack)
+
+		for bins in [64, 256, 1024]:
+			histogram = Threshold_histogram(stack.shape[:2], bins, 25.6)
+
+			for j in range(stack.shape[2]):
+				histogram.update(stack[:, :, j])
+
+			approx = histogram.temporal_filtering()
+
+			errors = [np.nanmax(np.abs(a - b)) for a, b in zip(exact, approx)]
+			nans = np.count_nonzero(np.isnan(approx[4]))
+			tag_print('info', f'{name}: bins = {bins}, memory = {Threshold_histogram.memory(stack.shape[:2], bins) / 2**20:.0f} MB (stack {stack.nbytes / 2**20:.0f} MB)')
+			tag_print('info', f'{name}: max. abs. error T1/T2/T3/ratio/mag_mean = {" / ".join(f"{e:.4f}" for e in errors)}, NaN cells = {nans}')
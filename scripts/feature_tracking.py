@@ -19,26 +19,23 @@ Created by Robert Ljubicic.
 try:
 	from __init__ import *
 	from math import log
-	from itertools import product
 	from os import path
 	from matplotlib.widgets import Slider
 	from class_logger import Logger
 	from class_console_printer import Console_printer, tag_string, tag_print, unix_path
+	from class_frame_reader import Frame_reader
 	from class_progress_bar import Progress_bar
 	from class_timing import Timer, time_hms
 	from glob import glob
-	from CPP.dll_import import DLL_Loader
+	from class_marker_predictor import Marker_predictor
+	from gcp_search import track_markers, pyramid_levels
+	from concurrent.futures import ThreadPoolExecutor
+	from multiprocessing import cpu_count
 	from utilities import fresh_folder, cfg_get, exit_message, present_exception_and_exit
 
 	import matplotlib.pyplot as plt
 	import ctypes
 
-	dll_path = path.split(path.realpath(__file__))[0] + '/CPP'
-	dll_name = 'ssim.dll'
-	dll_loader = DLL_Loader(dll_path, dll_name)
-	# float SSIM_Byte(Byte* pDataX, Byte* pDataY, int step, int width, int height, int win_size, int maxVal);
-	fast_ssim = dll_loader.get_function('float', 'SSIM_Byte', ['byte*', 'byte*', 'int', 'int', 'int', 'int', 'int'])
-
 except Exception as ex:
 	present_exception_and_exit('Import failed! For more information see traceback below. Please report this issue to the author:')
 
@@ -341,48 +338,6 @@ def get_gcps_from_image(image_orig: np.ndarray, initial=[], verbose=False, ia=11
 	return points
 
 
-def find_gcp(search_area: np.ndarray, kernel: np.ndarray) -> tuple:
-	"""
-	Detects a GCP center in the using SSIM.
-
-	:param search_area: 	Input image to search for GCP in.
-	:param kernel:			Kernel to use for SSIM comparison.
-	:param show: 			Whether to show the SSIM map. Default is False.
-	:param padding:			Padding inside search_area.
-	:return: 				Position (x,y) of the GCP center in the input image.
-	"""
-	
-	padding = kernel.shape[0] // 2
-	ssim_map = np.zeros(search_area.shape)
-	search_range = range(padding, search_area.shape[0] - padding)
-
-	for i, j in product(search_range, search_range):
-		subarea = cv2.getRectSubPix(search_area, (k_size, k_size), (i, j))
-		ssim_map[i, j] = fast_ssim(subarea.ravel(), kernel.ravel(), kernel.shape[0], kernel.shape[0], kernel.shape[0], 7, 255)
-
-	try:
-		score_max = np.max(ssim_map)
-	except ValueError:
-		score_max = 0
-		x_pix, y_pix = 0, 0
-		
-		return (x_pix, y_pix), score_max
-
-	x_pix, y_pix = np.unravel_index(np.argmax(ssim_map), ssim_map.shape)
-
-	# To avoid negative or zero numbers in log function, SSIM goes from -1 to 1
-	ssim_map += 2
-
-	# Gaussian 2x3 fit
-	dx = (log(ssim_map[x_pix-1, y_pix]) - log(ssim_map[x_pix+1, y_pix])) / (2*(log(ssim_map[x_pix-1, y_pix]) + log(ssim_map[x_pix+1, y_pix]) - 2*log(ssim_map[x_pix, y_pix])))
-	dy = (log(ssim_map[x_pix, y_pix-1]) - log(ssim_map[x_pix, y_pix+1])) / (2*(log(ssim_map[x_pix, y_pix-1]) + log(ssim_map[x_pix, y_pix+1]) - 2*log(ssim_map[x_pix, y_pix])))
-
-	x_sub = x_pix + dx
-	y_sub = y_pix + dy
-
-	return (x_sub, y_sub), score_max
-
-
 def print_and_log(string, printer_obj: Console_printer, logger_obj: Logger):
 	logger_obj.log(printer_obj.add_line(string))
 
@@ -422,7 +377,11 @@ if __name__ == '__main__':
 		expand_ssim_search = cfg_get(cfg, section, 'ExpandSA', int, 0)
 		expand_coef = cfg_get(cfg, section, 'ExpandSACoef', float, 2.0)
 		expand_ssim_thr = cfg_get(cfg, section, 'ExpandSAThreshold', float, 0.5)
+		expand_pyramid = cfg_get(cfg, section, 'ExpandSAPyramid', int, 0)		# Max. pyramid levels for the expanded search, 0 = full resolution search
 		update_kernels = cfg_get(cfg, section, 'UpdateKernels', int, 0)
+		predictive_search = cfg_get(cfg, section, 'PredictiveSA', int, 0)		# Search areas around the predicted positions, sized by the prediction error
+		predictive_ssim_thr = cfg_get(cfg, section, 'PredictiveSAThreshold', float, 0.8)		# Widen the predicted search area below this SSIM
+		workers = cfg_get(cfg, section, 'Workers', int, 1)		# Threads tracking the markers of a frame, 0 = use all CPU cores
 
 		# Do not change from this point on ------------------------------------------------------------
 		assert search_size > 13 and search_size % 2 == 1 and type(search_size) == int, \
@@ -433,13 +392,15 @@ if __name__ == '__main__':
 			tag_string('error', 'Search area expansion coefficient must be higher than 1!')
 		assert 0 < expand_ssim_thr < 1, \
 			tag_string('error', 'Search area expansion threshold must be in range (0, 1)!')
+		assert expand_pyramid >= 0, \
+			tag_string('error', 'Number of pyramid levels for the expanded search must be >= 0!')
+		assert 0 < predictive_ssim_thr < 1, \
+			tag_string('error', 'Predicted search area threshold must be in range (0, 1)!')
 
-		raw_frames_list = glob(f'{frames_folder}/*.{ext}')
+		raw_frames_list = sorted(glob(f'{frames_folder}/*.{ext}'))
 		num_frames = len(raw_frames_list)
 		numbering_len = int(log(num_frames, 10)) + 1
 
-		is_expanded_search = False
-		init_search_size = search_size
 		exp_search_size = to_odd(search_size*expand_coef)
 
 		img_path = raw_frames_list[0]
@@ -491,6 +452,9 @@ if __name__ == '__main__':
 		for f in folders_to_check:
 			fresh_folder(f)
 
+		workers = cpu_count() if workers <= 0 else min(workers, len(markers))
+		executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+
 		try:
 			log_path = f'{results_folder}/log_gcps.txt'
 			logger = Logger(log_path)
@@ -501,6 +465,12 @@ if __name__ == '__main__':
 			logger.log(tag_string('info', f'Number of markers = {len(markers)}'), to_print=True)
 			logger.log(tag_string('info', f'IA size = {k_size} px'), to_print=True)
 			logger.log(tag_string('info', f'SA size = {search_size} px'), to_print=True)
+
+			if expand_ssim_search and expand_pyramid:
+				logger.log(tag_string('info', f'Expanded SA size = {exp_search_size} px, pyramid search with {pyramid_levels(k_size, expand_pyramid)} level(s)'), to_print=True)
+
+			logger.log(tag_string('info', f'Predictive SA = {"yes" if predictive_search else "no"}'), to_print=True)
+			logger.log(tag_string('info', f'Worker threads = {workers}'), to_print=True)
 			logger.log(tag_string('info', f'Log file {log_path}/\n'), to_print=True)
 
 			printer = Console_printer()
@@ -513,72 +483,46 @@ if __name__ == '__main__':
 				cv2.imwrite(f'{results_folder}/kernels/{len(kernels)}.{ext}', k)
 				kernels.append(k)
 
+			tracking_params = {
+				'search_size': search_size,
+				'exp_search_size': exp_search_size,
+				'k_size': k_size,
+				'expand_ssim_search': expand_ssim_search,
+				'expand_ssim_thr': expand_ssim_thr,
+				'expand_pyramid': expand_pyramid,
+				'update_kernels': update_kernels,
+				'predict_ssim_thr': predictive_ssim_thr,
+			}
+
+			predictor = Marker_predictor(len(markers), k_size, search_size) if predictive_search else None
+			num_widened = 0
+
 			timer = Timer(total_iter=num_frames)
 
 			ssim_scores = np.zeros([num_frames, len(markers)])
 			ssim_score_averages = np.zeros(len(markers))
 
-			for n in range(num_frames):
+			for n, img_gray in enumerate(Frame_reader(raw_frames_list)):
 				try:
 					print_and_log(progress_bar.get(n), printer, logger)
 					print_and_log('', printer, logger)
 
-					img_path = raw_frames_list[n]
-					img_gray = cv2.imread(img_path, 0)
-
-					for j in range(len(markers)):
-						xx, yy = markers[j]
-
-						if xx != 0 and yy != 0:
-							search_space = cv2.getRectSubPix(img_gray, (search_size, search_size), (xx, yy))
-
-							rel_center, ssim_max = find_gcp(search_space, kernels[j])
-
-							if expand_ssim_search and ssim_max < expand_ssim_thr:
-								# print_and_log(
-								# 	tag_string('warning', 'Expanding the search area, SSIM={:.3f} < {:.3f}'.format(ssim_max, expand_ssim_thr)), printer, logger
-								# )
-								logger.log(tag_string('warning', f'Expanding the search area, SSIM={ssim_max:.3f} < {expand_ssim_thr:.3f}'))
+					predictions = predictor.predict() if predictor is not None else None
+					results = track_markers(img_gray, markers, kernels, tracking_params, executor, predictions)
 
-								is_expanded_search = True
-								search_size = exp_search_size
-								search_space = cv2.getRectSubPix(img_gray, (search_size, search_size), (xx, yy))
+					if predictor is not None:
+						predictor.update(markers, [r['marker'] for r in results], [r['lost'] for r in results])
+						num_widened += sum(r['widened'] for r in results)
 
-								rel_center, ssim_max = find_gcp(search_space,
-															kernels[j],
-															)
+					for j, result in enumerate(results):
+						for message in result['messages']:
+							logger.log(message)
 
-							real_x = rel_center[0] + xx - (search_size - 1) / 2
-							real_y = rel_center[1] + yy - (search_size - 1) / 2
+						markers[j] = result['marker']
+						kernels[j] = result['kernel']
+						ssim_scores[n, j] = result['ssim']
 
-							markers[j] = [real_x, real_y]
-							ssim_scores[n, j] = ssim_max
-
-							if is_expanded_search:
-								is_expanded_search = False
-								search_size = init_search_size
-
-							if update_kernels:
-								kernels[j] = cv2.getRectSubPix(img_gray, (k_size, k_size), (real_x, real_y))
-
-							try:
-								cv2.getRectSubPix(img_gray, (search_size, search_size), (real_x, real_y))
-							except SystemError:
-								# print_and_log(
-								# 	tag_string('warning', 'Marker {} lost! Setting coordinates to (0, 0).'.format(j)), printer, logger
-								# )
-								logger.log(tag_string('warning', f'Marker {j} lost! Setting coordinates to (0, 0).'))
-
-								markers[j] = [0, 0]
-								markers_mask[j] = 0
-
-						else:
-							# print_and_log(
-							# 	tag_string('warning', 'Marker {} lost! Setting coordinates to (0, 0).'.format(j)), printer, logger
-							# )
-							logger.log(tag_string('warning', f'Marker {j} lost! Setting coordinates to (0, 0).'))
-
-							markers[j] = [0, 0]
+						if result['lost']:
 							markers_mask[j] = 0
 
 				except (AttributeError, IOError, IndexError):
@@ -610,12 +554,20 @@ if __name__ == '__main__':
 
 				printer.overwrite()
 
+			if predictor is not None:
+				logger.log(tag_string('info', f'Predicted search areas widened {num_widened} times'))
+
 		except IOError:
 			logger.close()
 
 		else:
 			logger.close()
 
+		finally:
+			# Also reached on any other exception, so that the worker threads do not outlive the tracking
+			if executor is not None:
+				executor.shutdown()
+
 		np.savetxt(f'{results_folder}/markers_mask.txt', markers_mask, fmt='%d', delimiter=' ')
 		np.savetxt(f'{results_folder}/ssim_scores.txt', ssim_scores, fmt='%.3f', delimiter=' ')
 		np.savetxt(f'{results_folder}/ssim_score_averages.txt', np.average(ssim_scores, axis=0), fmt='%.3f', delimiter=' ')
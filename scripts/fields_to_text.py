@@ -0,0 +1,86 @@
+"""
+This is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This package is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this package. If not, you can get eh GNU GPL from
+https://www.gnu.org/licenses/gpl-3.0.en.html.
+
+Created by Robert Ljubicic.
+"""
+
+# Exports the binary per-frame fields of optical_flow.py (FieldFormat > 0) to the legacy
+# text files in optical_flow/magnitudes, optical_flow/directions, optical_flow/U and optical_flow/V.
+
+try:
+	from __init__ import *
+	from math import log10, floor
+	from class_console_printer import Console_printer, tag_string, tag_print, unix_path
+	from class_progress_bar import Progress_bar
+	from class_field_store import Field_store, FIELDS
+	from utilities import fresh_folder, cfg_get, exit_message, present_exception_and_exit
+
+except Exception as ex:
+	present_exception_and_exit('Import failed! For more information see traceback below. Please report this issue to the author:')
+
+
+if __name__ == '__main__':
+	try:
+		parser = ArgumentParser()
+		parser.add_argument('--cfg', type=str, help='Path to configuration file')
+		parser.add_argument('--quiet', type=int, help='Quiet mode for batch processing, no RETURN confirmation on success', default=0)
+		args = parser.parse_args()
+
+		cfg = configparser.ConfigParser()
+		cfg.optionxform = str
+
+		try:
+			cfg.read(args.cfg, encoding='utf-8-sig')
+		except Exception:
+			tag_print('error', 'There was a problem reading the configuration file!')
+			tag_print('error', 'Check if project has valid configuration.')
+			exit_message()
+
+		project_folder = unix_path(cfg_get(cfg, 'Project settings', 'Folder', str))
+		results_folder = f'{project_folder}/optical_flow'
+		fields_folder = f'{results_folder}/fields'
+
+		tag_print('start', f'Exporting optical flow fields from [{fields_folder}] to text files\n')
+
+		console_printer = Console_printer()
+
+		for name, (fmt, _) in FIELDS.items():
+			if not Field_store.exists(f'{fields_folder}/{name}'):
+				tag_print('warning', f'No binary data found for [{name}], skipping')
+				continue
+
+			store = Field_store(f'{fields_folder}/{name}')
+			num_fields = len(store)
+			num_digits = floor(log10(max(num_fields, 1))) + 1
+
+			fresh_folder(f'{results_folder}/{name}')
+			console_printer.reset()
+			progress_bar = Progress_bar(total=num_fields, prefix=tag_string('info', f'{name} '))
+
+			for i in range(num_fields):
+				n = str(i).rjust(num_digits, '0')
+				np.savetxt(f'{results_folder}/{name}/{n}.txt', store[i], fmt=fmt)
+				console_printer.single_line(progress_bar.get(i))
+
+			store.close()
+
+		print()
+		tag_print('end', 'Export complete!')
+
+		if args.quiet == 0:
+			exit_message()
+
+	except Exception as ex:
+		present_exception_and_exit()
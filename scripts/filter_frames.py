@@ -20,6 +20,7 @@ try:
 	from __init__ import *
 	from os import makedirs, path
 	from class_console_printer import Console_printer, tag_string, unix_path, tag_print
+	from class_frame_reader import Frame_reader
 	from class_progress_bar import Progress_bar
 	from class_timing import Timer, time_hms
 	from glob import glob
@@ -101,10 +102,9 @@ if __name__ == '__main__':
 		if not path.exists(results_folder):
 			makedirs(results_folder)
 
-		for j in range(len(img_list)):
+		for j, img in enumerate(Frame_reader(img_list, grayscale=False)):
 			colorspace = 'rgb'
 			img_path = img_list[j]
-			img = cv2.imread(img_path)
 			img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
 
 			img = apply_filters(img, filters_data, img_list, ext)
@@ -0,0 +1,177 @@
+"""
+This is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This package is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this package. If not, you can get eh GNU GPL from
+https://www.gnu.org/licenses/gpl-3.0.en.html.
+
+Created by Robert Ljubicic.
+"""
+
+try:
+	from __init__ import *
+	from flow_tiling import create_tiled_engine
+	from utilities import cfg_get, present_exception_and_exit
+
+except Exception as ex:
+	present_exception_and_exit('Import failed! For more information see traceback below. Please report this issue to the author:')
+
+
+ENGINE_FARNEBACK = 0
+ENGINE_DIS = 1
+ENGINE_TVL1 = 2
+
+engine_names = {
+	ENGINE_FARNEBACK: 'Farneback',
+	ENGINE_DIS: 'DIS',
+	ENGINE_TVL1: 'TV-L1',
+}
+
+dis_presets = {
+	0: cv2.DISOPTICAL_FLOW_PRESET_ULTRAFAST,
+	1: cv2.DISOPTICAL_FLOW_PRESET_FAST,
+	2: cv2.DISOPTICAL_FLOW_PRESET_MEDIUM,
+}
+
+dis_preset_names = ['ultrafast', 'fast', 'medium']
+
+# Engines already created in this process, see get_engine()
+engines = {}
+
+
+def engine_params_from_cfg(cfg, section='Optical flow') -> dict:
+	"""
+	Reads the optical flow engine and its parameters from the configuration.
+	The result only contains plain values, so it can be passed to worker processes.
+	"""
+	return {
+		'engine': cfg_get(cfg, section, 'Engine', int, ENGINE_FARNEBACK),		# 0 = Farneback, 1 = DIS, 2 = TV-L1
+		'dis_preset': cfg_get(cfg, section, 'DISPreset', int, 1),				# 0 = ultrafast, 1 = fast, 2 = medium
+		'pyr_scale': cfg_get(cfg, section, 'FarnebackPyrScale', float, 0.5),
+		'levels': cfg_get(cfg, section, 'FarnebackLevels', int, 3),
+		'winsize': cfg_get(cfg, section, 'FarnebackWinSize', int, 15),
+		'iterations': cfg_get(cfg, section, 'FarnebackIterations', int, 2),
+		'poly_n': cfg_get(cfg, section, 'FarnebackPolyN', int, 7),
+		'poly_sigma': cfg_get(cfg, section, 'FarnebackPolySigma', float, 1.5),
+		'warm_levels': cfg_get(cfg, section, 'WarmStartLevels', int, 1),			# Farneback pyramid levels for warm-started pairs
+		'warm_iterations': cfg_get(cfg, section, 'WarmStartIterations', int, 1),	# Farneback iterations for warm-started pairs
+		'tile_size': cfg_get(cfg, section, 'TileSize', int, 0),					# > 0 = compute the flow in tiles of about this size [px at processing scale]
+		'tile_overlap': cfg_get(cfg, section, 'TileOverlap', int, 64),			# px at processing scale, cropped after the flow computation, should exceed winsize * 2^(levels-1)
+		'tile_workers': cfg_get(cfg, section, 'TileWorkers', int, 0),			# Threads computing the tiles, 0 = all CPU cores, split among the Workers
+		'tile_pooling': 1,														# Pooling block at processing scale, tiles are aligned to it
+	}
+
+
+def engine_description(engine_params: dict) -> str:
+	engine = engine_params['engine']
+
+	if engine == ENGINE_FARNEBACK:
+		description = f'Farneback (pyr_scale={engine_params["pyr_scale"]}, levels={engine_params["levels"]}, winsize={engine_params["winsize"]}, ' \
+					  f'iterations={engine_params["iterations"]}, poly_n={engine_params["poly_n"]}, poly_sigma={engine_params["poly_sigma"]})'
+	elif engine == ENGINE_DIS:
+		description = f'DIS ({dis_preset_names[engine_params["dis_preset"]]} preset)'
+	else:
+		description = engine_names[engine]
+
+	if engine_params['tile_size'] > 0:
+		description += f', tiles of {engine_params["tile_size"]} px with {engine_params["tile_overlap"]} px overlap'
+
+	return description
+
+
+def validate_engine(engine_params: dict):
+	"""
+	Raises ValueError for an unknown engine or DIS preset, and RuntimeError if the engine is not available
+	in the installed OpenCV package. Called before any frames are processed, see also create_engine().
+	"""
+	engine = engine_params['engine']
+
+	if engine not in engine_names:
+		raise ValueError(f'Unknown optical flow engine [{engine}]!')
+
+	if engine == ENGINE_DIS and engine_params['dis_preset'] not in dis_presets:
+		raise ValueError(f'Unknown DIS preset [{engine_params["dis_preset"]}]!')
+
+	if engine == ENGINE_TVL1 and not hasattr(getattr(cv2, 'optflow', None), 'DualTVL1OpticalFlow_create'):
+		raise RuntimeError('TV-L1 optical flow requires the opencv-contrib-python package!')
+
+
+def create_engine(engine_params: dict):
+	"""
+	Creates a dense optical flow function flow = engine(frame_A, frame_B, init_flow=None).
+	All engines take 8-bit grayscale frames and return float32 flow of shape [h, w, 2].
+	If :init_flow: is given, it is used as the initial estimate (warm start). Farneback then
+	uses the reduced number of pyramid levels and iterations from :engine_params:.
+	"""
+	validate_engine(engine_params)
+	engine = engine_params['engine']
+
+	if engine == ENGINE_FARNEBACK:
+		farneback_params = [engine_params['pyr_scale'],
+							engine_params['levels'],
+							engine_params['winsize'],
+							engine_params['iterations'],
+							engine_params['poly_n'],
+							engine_params['poly_sigma'],
+							0]
+
+		warm_params = [engine_params['pyr_scale'],
+					   engine_params['warm_levels'],
+					   engine_params['winsize'],
+					   engine_params['warm_iterations'],
+					   engine_params['poly_n'],
+					   engine_params['poly_sigma'],
+					   cv2.OPTFLOW_USE_INITIAL_FLOW]
+
+		def farneback(frame_A, frame_B, init_flow=None):
+			if init_flow is None:
+				return cv2.calcOpticalFlowFarneback(frame_A, frame_B, None, *farneback_params)
+			else:
+				return cv2.calcOpticalFlowFarneback(frame_A, frame_B, init_flow.copy(), *warm_params)
+
+		return farneback
+
+	elif engine == ENGINE_DIS:
+		dis = cv2.DISOpticalFlow_create(dis_presets[engine_params['dis_preset']])
+
+		def dis_flow(frame_A, frame_B, init_flow=None):
+			return dis.calc(frame_A, frame_B, None if init_flow is None else init_flow.copy())
+
+		return dis_flow
+
+	elif engine == ENGINE_TVL1:
+		tvl1 = cv2.optflow.DualTVL1OpticalFlow_create()
+		tvl1_warm = cv2.optflow.DualTVL1OpticalFlow_create()
+		tvl1_warm.setUseInitialFlow(True)
+
+		def tvl1_flow(frame_A, frame_B, init_flow=None):
+			if init_flow is None:
+				return tvl1.calc(frame_A, frame_B, None)
+			else:
+				return tvl1_warm.calc(frame_A, frame_B, init_flow.copy())
+
+		return tvl1_flow
+
+
+def get_engine(engine_params: dict):
+	"""
+	Same as create_engine(), but reuses the engine if it was already created in this process.
+	If engine_params['tile_size'] > 0, the engine computes the flow in tiles, see flow_tiling.py.
+	"""
+	key = tuple(sorted(engine_params.items()))
+
+	if key not in engines:
+		if engine_params['tile_size'] > 0:
+			engines[key] = create_tiled_engine(engine_params, create_engine)
+		else:
+			engines[key] = create_engine(engine_params)
+
+	return engines[key]
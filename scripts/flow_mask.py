@@ -0,0 +1,113 @@
+"""
+This is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This package is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this package. If not, you can get eh GNU GPL from
+https://www.gnu.org/licenses/gpl-3.0.en.html.
+
+Created by Robert Ljubicic.
+"""
+
+try:
+	from __init__ import *
+	from utilities import cfg_get, present_exception_and_exit
+
+except Exception as ex:
+	present_exception_and_exit('Import failed! For more information see traceback below. Please report this issue to the author:')
+
+
+# Min. fraction of a pooling block inside the mask for the cell to be processed
+MASK_MIN_COVERAGE = 0.5
+
+# Cells added around the mask bounding box, keeps the flow near the mask edges away from the frame edges
+MASK_MARGIN = 1
+
+
+def polygon_to_str(points: list) -> str:
+	return '; '.join([f'{int(x)}, {int(y)}' for x, y in points])
+
+
+def str_to_polygon(s: str) -> np.ndarray:
+	"""
+	Parses a polygon in format "x1, y1; x2, y2; ..." to an array of shape [n, 2].
+	"""
+	points = [p.split(',') for p in s.split(';') if p.strip() != '']
+	return np.array([[float(x), float(y)] for x, y in points]).reshape(-1, 2)
+
+
+def load_mask(cfg, section: str, frame_shape: tuple, size: tuple):
+	"""
+	Reads the water surface mask from the configuration, either as a polygon (MaskPolygon)
+	or as a bitmap where nonzero pixels are processed (MaskPath).
+
+	:param frame_shape:	Shape (h, w) of the original frames, in which the mask is defined.
+	:param size:		Size (w, h) of the frames at processing scale.
+	:return:			Boolean array of shape (size[1], size[0]), or None if no mask is defined.
+	"""
+	polygon = cfg_get(cfg, section, 'MaskPolygon', str, '')
+	mask_path = cfg_get(cfg, section, 'MaskPath', str, '')
+
+	if polygon.strip() != '':
+		points = str_to_polygon(polygon)
+
+		if points.shape[0] < 3:
+			return None
+
+		mask = np.zeros(frame_shape[:2], dtype='uint8')
+		cv2.fillPoly(mask, [np.round(points).astype('int32')], 1)
+	elif mask_path != '':
+		mask = cv2.imread(mask_path, 0)
+
+		if mask is None:
+			raise ValueError(f'Mask image [{mask_path}] could not be read!')
+	else:
+		return None
+
+	return cv2.resize(mask, size, interpolation=cv2.INTER_NEAREST) > 0
+
+
+def pool_mask(mask: np.ndarray, pooling: int, pooled_shape: tuple) -> np.ndarray:
+	"""
+	Pooled cells of shape :pooled_shape: with at least MASK_MIN_COVERAGE of their pixels inside :mask:.
+	Pooling blocks are centered in the frame, as in spatial_pooling().
+	"""
+	h_pooled, w_pooled = pooled_shape
+	y_offset = (mask.shape[0] % pooling) // 2
+	x_offset = (mask.shape[1] % pooling) // 2
+	blocks = mask[y_offset: y_offset + h_pooled*pooling, x_offset: x_offset + w_pooled*pooling].reshape(h_pooled, pooling, w_pooled, pooling)
+
+	return blocks.mean(axis=(1, 3)) >= MASK_MIN_COVERAGE
+
+
+def mask_box(cell_mask: np.ndarray, margin=MASK_MARGIN) -> tuple:
+	"""
+	Bounding box (r0, r1, c0, c1) of the masked cells, extended by :margin: cells.
+	"""
+	rows = np.flatnonzero(cell_mask.any(axis=1))
+	cols = np.flatnonzero(cell_mask.any(axis=0))
+
+	if rows.size == 0:
+		raise ValueError('Mask does not contain any pooled cells!')
+
+	return int(max(rows[0] - margin, 0)), int(min(rows[-1] + 1 + margin, cell_mask.shape[0])), \
+		   int(max(cols[0] - margin, 0)), int(min(cols[-1] + 1 + margin, cell_mask.shape[1]))
+
+
+def expand_cells(field: np.ndarray, box: tuple, cell_mask: np.ndarray) -> np.ndarray:
+	"""
+	Places a pooled field computed in :box: into the full pooled grid, with NaN outside of :cell_mask:.
+	"""
+	r0, r1, c0, c1 = box
+	full = np.full(cell_mask.shape, np.nan, dtype='float32')
+	full[r0:r1, c0:c1] = field
+	full[~cell_mask] = np.nan
+
+	return full
@@ -0,0 +1,239 @@
+"""
+This is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This package is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this package. If not, you can get eh GNU GPL from
+https://www.gnu.org/licenses/gpl-3.0.en.html.
+
+Created by Robert Ljubicic.
+"""
+
+try:
+	from __init__ import *
+	from class_diagnostics_table import COVERAGE_FILTER, displacement_diagnostics
+	from class_flow_postprocessor import Flow_postprocessor
+	from class_frame_reader import Frame_reader
+	from flow_engines import get_engine
+	from frame_loading import read_frame
+	from pair_planner import pair_schedule
+	from utilities import present_exception_and_exit
+
+except Exception:
+	present_exception_and_exit('Import failed! For more information see traceback below. Please report this issue to the author:')
+
+
+# Limits for the automatic processing resolution, see auto_reduction()
+AUTO_MIN_BLOCK = 4				# Min. pooling block at processing resolution [px]
+AUTO_MIN_DISPLACEMENT = 1.0		# Min. displacement at processing resolution [px/frame]
+
+# Parameters of the frame pair computation, set once per worker process by init_worker()
+worker_params = None
+
+# Warm start state of the worker process, see warm_pair()
+worker_state = {}
+
+# Frames of the previous pair of the worker process, see worker_pair()
+worker_frames = {}
+
+# Postprocessors already created in this process, see postprocess_flow()
+postprocessors = {}
+
+
+def auto_reduction(pooling: int, min_displacement: float) -> int:
+	"""
+	Picks the resolution reduction factor for the optical flow computation.
+	The factor is the largest divisor of :pooling: which keeps the pooling block at least
+	AUTO_MIN_BLOCK px wide and the expected min. displacement at least AUTO_MIN_DISPLACEMENT px/frame,
+	so that the pooled grid is exactly the same as at the full resolution.
+
+	:param pooling:				Pooling block size [px].
+	:param min_displacement:	Smallest expected displacement at the full resolution [px/frame].
+	:return:					Reduction factor, 1 if the resolution should not be reduced.
+	"""
+	divisors = [d for d in range(1, pooling + 1) if pooling % d == 0]
+	valid = [d for d in divisors if pooling // d >= AUTO_MIN_BLOCK and min_displacement / d >= AUTO_MIN_DISPLACEMENT]
+
+	return max(valid, default=1)
+
+
+def read_pair_frame(frame_path: str, params: dict) -> np.ndarray:
+	"""
+	Reads a frame at the processing resolution. The frame is cropped to params['crop'] = (x0, y0, x1, y1)
+	and, if params['reduction'] > 1, downscaled to params['flow_size'] = (w, h).
+	"""
+	frame = read_frame(frame_path, params['size'], params['scale'])
+	x0, y0, x1, y1 = params['crop']
+
+	if params['reduction'] > 1:
+		frame = cv2.resize(frame[y0:y1, x0:x1], params['flow_size'], interpolation=cv2.INTER_AREA)
+	elif (x1 - x0, y1 - y0) != (frame.shape[1], frame.shape[0]):
+		frame = np.ascontiguousarray(frame[y0:y1, x0:x1])
+
+	return frame
+
+
+def postprocess_flow(flow: np.ndarray, params: dict) -> tuple:
+	"""
+	Filters the dense flow by magnitude and direction and applies spatial pooling.
+	Uses a Flow_postprocessor with preallocated buffers, reused for all frame pairs of the same size in this process.
+
+	:param flow:	Dense optical flow of shape [h, w, 2] at the processing resolution.
+	:param params:	Dictionary of frame pair parameters, see optical_flow.py.
+	:return:		Tuple (pooled_mag, pooled_dir) of shape [h_pooled, w_pooled], magnitudes at the full resolution.
+					Both are overwritten by the next call, copy them if they have to be kept.
+	"""
+	key = (tuple(params['flow_size']), tuple(params['pooled_shape']))
+
+	if key not in postprocessors:
+		postprocessors[key] = Flow_postprocessor(*key)
+
+	return postprocessors[key].process(flow, params)
+
+
+def compute_pair(frame_A: np.ndarray, frame_B: np.ndarray, params: dict) -> tuple:
+	"""
+	Dense optical flow between two frames using the selected engine, followed by postprocess_flow().
+	"""
+	flow = get_engine(params['engine_params'])(frame_A, frame_B)
+
+	return postprocess_flow(flow, params)
+
+
+def warm_pair(i: int, frame_A: np.ndarray, frame_B: np.ndarray, params: dict, state: dict) -> tuple:
+	"""
+	Same as compute_pair(), but seeds the flow with the flow of the previous pair (warm start) if
+	params['warm_start'] is set. The flow is computed from scratch for every params['warm_chain']-th
+	pair, and whenever the mean displacement of the warm-started pair differs from the one of the
+	previous pair by more than params['warm_reset'] (relative), e.g. after a sudden change of the scene.
+	Whether a pair is warm depends only on its index, so the executors have to compute whole chains
+	in order, starting at chain_start().
+
+	:param i:		Frame pair index.
+	:param state:	Dictionary holding the previous pair index, flow and mean displacement, updated in place.
+	"""
+	engine = get_engine(params['engine_params'])
+
+	warm = params['warm_start'] and i % params['warm_chain'] != 0
+
+	if warm and state.get('index') != i - 1:
+		raise RuntimeError(f'Frame pair {i} is warm started, but frame pair {i - 1} was not computed before it!')
+
+	flow = engine(frame_A, frame_B, state['flow'] if warm else None)
+	pooled_mag, pooled_dir = postprocess_flow(flow, params)
+	disp_mean = displacement_diagnostics(pooled_mag)[1]
+
+	if warm and abs(disp_mean - state['disp_mean']) > params['warm_reset'] * max(state['disp_mean'], COVERAGE_FILTER):
+		flow = engine(frame_A, frame_B)
+		pooled_mag, pooled_dir = postprocess_flow(flow, params)
+		disp_mean = displacement_diagnostics(pooled_mag)[1]
+
+	if params['warm_start']:
+		state.update(index=i, flow=flow, disp_mean=disp_mean)
+
+	return pooled_mag, pooled_dir
+
+
+def chain_start(start: int, params: dict) -> int:
+	"""
+	First frame pair to compute for results from frame pair :start: on. With warm start, this is the first pair of the
+	warm start chain containing :start:, so that every pair is computed exactly as in an uninterrupted run.
+	Results of the pairs before :start: are computed only to seed the chain and are dropped.
+	"""
+	if params['warm_start']:
+		return start - start % params['warm_chain']
+
+	return start
+
+
+def serial_pairs(params: dict, start=0):
+	"""
+	Generator of (pooled_mag, pooled_dir) for all frame pairs params['pairs'] from :start:, computed in the current process.
+	Every frame is read only once, following pair_schedule(), and frames are prefetched by a Frame_reader.
+	The yielded fields are overwritten by the next frame pair, see postprocess_flow().
+	"""
+	img_list = params['img_list']
+	first = chain_start(start, params)
+	schedule = pair_schedule(params['pairs'], first)
+	state = {}
+	cache = {}
+
+	frames = iter(Frame_reader([img_list[n] for n in schedule['reads']], read=lambda frame_path: read_pair_frame(frame_path, params)))
+
+	for i in range(first, len(schedule['pairs'])):
+		for n, cached in zip(schedule['pairs'][i].tolist(), schedule['cached'][i]):
+			if not cached:
+				cache[n] = next(frames)
+
+		a, b = schedule['pairs'][i].tolist()
+		result = warm_pair(i, cache[a], cache[b], params, state)
+
+		if i >= start:
+			yield result
+
+		for n in schedule['releases'].get(i, []):
+			del cache[n]
+
+
+def init_worker(params: dict):
+	"""
+	Initializer for the worker processes of parallel_pairs().
+	"""
+	global worker_params
+
+	worker_params = params
+
+	# Workers already use all the cores, avoid oversubscription by OpenCV's own threads
+	cv2.setNumThreads(1)
+
+
+def worker_pair(i: int) -> tuple:
+	"""
+	Computes the frame pair with index :i: inside a worker process.
+	Frames of the previous pair computed by this worker are reused, e.g. within a warm start chain.
+	Fields are returned as copies, since the buffers of postprocess_flow() are reused for the next pair
+	and results of a chunk are pickled together, where the same buffer would be sent only once.
+	"""
+	global worker_frames
+
+	a, b = worker_params['pairs'][i].tolist()
+	frames = {n: worker_frames[n] if n in worker_frames else read_pair_frame(worker_params['img_list'][n], worker_params) for n in (a, b)}
+	worker_frames = frames
+
+	pooled_mag, pooled_dir = warm_pair(i, frames[a], frames[b], worker_params, worker_state)
+
+	return pooled_mag.copy(), pooled_dir.copy()
+
+
+def parallel_pairs(params: dict, workers: int, start=0):
+	"""
+	Generator of (pooled_mag, pooled_dir) for all frame pairs from :start:, computed by a pool of worker processes.
+	Results are yielded in frame pair order, so the output is the same as for serial_pairs().
+	With warm start, each worker receives whole chains of params['warm_chain'] consecutive pairs,
+	the chunks start at chain_start(). With tiling and TileWorkers = 0, the CPU cores are split among the workers.
+	"""
+	from multiprocessing import Pool, cpu_count
+
+	if params['engine_params']['tile_workers'] <= 0:
+		engine_params = dict(params['engine_params'], tile_workers=max(1, cpu_count() // workers))
+		params = dict(params, engine_params=engine_params)
+
+	num_frame_pairs = len(params['pairs'])
+	first = chain_start(start, params)
+	chunksize = params['warm_chain'] if params['warm_start'] else 1
+	pool = Pool(processes=workers, initializer=init_worker, initargs=(params,))
+
+	try:
+		for i, result in enumerate(pool.imap(worker_pair, range(first, num_frame_pairs), chunksize=chunksize), start=first):
+			if i >= start:
+				yield result
+	finally:
+		pool.terminate()
+		pool.join()
@@ -0,0 +1,166 @@
+"""
+This is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This package is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this package. If not, you can get eh GNU GPL from
+https://www.gnu.org/licenses/gpl-3.0.en.html.
+
+Created by Robert Ljubicic.
+"""
+
+try:
+	from __init__ import *
+	from threading import local
+	from concurrent.futures import ThreadPoolExecutor
+	from multiprocessing import cpu_count
+	from utilities import present_exception_and_exit
+
+except Exception as ex:
+	present_exception_and_exit('Import failed! For more information see traceback below. Please report this issue to the author:')
+
+
+def tile_edges(length: int, tile_size: int, pooling: int) -> list:
+	"""
+	Edges of the tiles along a single axis of :length: px. Inner edges fall on the edges of the pooling blocks,
+	which are centered in the frame as in spatial_pooling(), so that every pooling block lies within a single tile.
+	The remainder is added to the last tile if it is shorter than half of a tile.
+
+	:param tile_size:	Approx. tile size [px], rounded to a multiple of :pooling:.
+	:param pooling:		Pooling block size [px].
+	:return:			List of edges [0, ..., length].
+	"""
+	tile_size = max(1, int(round(tile_size / pooling))) * pooling
+	offset = (length % pooling) // 2
+
+	inner = list(range(offset + tile_size, length - tile_size // 2, tile_size))
+
+	return [0] + inner + [length]
+
+
+def tile_grid(shape: tuple, tile_size: int, overlap: int, pooling: int) -> list:
+	"""
+	Overlapping tiles of a frame of :shape: = [h, w].
+
+	:param overlap:	Overlap added on every side of a tile [px], cropped after the flow computation.
+	:return:		List of tuples (core, padded, inner), where core and padded are (row slice, col slice) in the
+					frame and inner is the (row slice, col slice) of the core within the padded tile.
+	"""
+	h, w = shape
+	tiles = []
+
+	row_edges = tile_edges(h, tile_size, pooling)
+	col_edges = tile_edges(w, tile_size, pooling)
+
+	for r0, r1 in zip(row_edges[:-1], row_edges[1:]):
+		for c0, c1 in zip(col_edges[:-1], col_edges[1:]):
+			pr0, pr1 = max(0, r0 - overlap), min(h, r1 + overlap)
+			pc0, pc1 = max(0, c0 - overlap), min(w, c1 + overlap)
+
+			tiles.append(((slice(r0, r1), slice(c0, c1)),
+						  (slice(pr0, pr1), slice(pc0, pc1)),
+						  (slice(r0 - pr0, r1 - pr0), slice(c0 - pc0, c1 - pc0))))
+
+	return tiles
+
+
+def create_tiled_engine(engine_params: dict, create_engine):
+	"""
+	Wraps an optical flow engine so that every frame pair is split into overlapping tiles, see tile_grid(),
+	which are computed in parallel threads, each with its own engine. The overlaps are cropped and the cores
+	assembled into the full flow, so the signature is the same as for the engines of create_engine().
+	With more than one tile thread, OpenCV's own threading is disabled for the whole process.
+
+	:param engine_params:	Engine parameters with 'tile_size', 'tile_overlap', 'tile_workers' and 'tile_pooling'.
+	:param create_engine:	Function creating the engine for a single tile, see flow_engines.py.
+	"""
+	tile_size = engine_params['tile_size']
+	overlap = engine_params['tile_overlap']
+	pooling = engine_params['tile_pooling']
+	workers = engine_params['tile_workers'] if engine_params['tile_workers'] > 0 else cpu_count()
+
+	# Tile threads already use the cores, avoid oversubscription by OpenCV's own threads (process-wide setting)
+	if workers > 1:
+		cv2.setNumThreads(1)
+
+	thread_data = local()
+	executor = ThreadPoolExecutor(max_workers=workers)
+	grids = {}
+
+	def tile_flow(tile, frame_A, frame_B, init_flow, flow):
+		if not hasattr(thread_data, 'engine'):
+			thread_data.engine = create_engine(engine_params)
+
+		core, padded, inner = tile
+		init_tile = None if init_flow is None else np.ascontiguousarray(init_flow[padded])
+		tile_A = np.ascontiguousarray(frame_A[padded])
+		tile_B = np.ascontiguousarray(frame_B[padded])
+
+		flow[core] = thread_data.engine(tile_A, tile_B, init_tile)[inner]
+
+	def tiled(frame_A, frame_B, init_flow=None):
+		shape = frame_A.shape[:2]
+
+		if shape not in grids:
+			grids[shape] = tile_grid(shape, tile_size, overlap, pooling)
+
+		flow = np.empty([*shape, 2], dtype='float32')
+		futures = [executor.submit(tile_flow, tile, frame_A, frame_B, init_flow, flow) for tile in grids[shape]]
+
+		for future in futures:
+			future.result()
+
+		return flow
+
+	return tiled
+
+
+if __name__ == '__main__':
+	# Time and difference of the pooled flow against the untiled computation
+	from time import time
+	from flow_engines import create_engine, ENGINE_FARNEBACK, ENGINE_DIS
+	from pooling_kernels import spatial_pooling
+
+	h, w, pooling = 2000, 6000, 16
+	rng = np.random.default_rng(0)
+	texture = cv2.GaussianBlur((rng.random((h + 20, w + 20)) * 255).astype('uint8'), (5, 5), 1.5)
+	frame_A = np.ascontiguousarray(texture[10:h + 10, 10:w + 10])
+	frame_B = np.ascontiguousarray(texture[7:h + 7, 6:w + 6])	# 4 px right, 3 px down
+
+	def pooled(flow):
+		magnitude, angle = cv2.cartToPolar(flow[..., 0], flow[..., 1], angleInDegrees=True)
+		pooled_mag = np.empty((h // pooling) * (w // pooling), dtype='float32')
+		pooled_dir = np.empty_like(pooled_mag)
+		spatial_pooling(magnitude.ravel(), angle.ravel(), pooled_mag, pooled_dir, h, w, pooling)
+		return pooled_mag, pooled_dir
+
+	opencv_threads = cv2.getNumThreads()
+
+	for engine in [ENGINE_FARNEBACK, ENGINE_DIS]:
+		# Reset by create_tiled_engine()
+		cv2.setNumThreads(opencv_threads)
+
+		engine_params = {'engine': engine, 'dis_preset': 1, 'pyr_scale': 0.5, 'levels': 3, 'winsize': 15, 'iterations': 2,
+						 'poly_n': 7, 'poly_sigma': 1.5, 'warm_levels': 1, 'warm_iterations': 1,
+						 'tile_size': 1024, 'tile_overlap': 64, 'tile_workers': 0, 'tile_pooling': pooling}
+
+		start = time()
+		reference = pooled(create_engine(engine_params)(frame_A, frame_B))
+		time_reference = time() - start
+
+		tiled = create_tiled_engine(engine_params, create_engine)
+
+		start = time()
+		result = pooled(tiled(frame_A, frame_B))
+		time_tiled = time() - start
+
+		diff = np.abs(result[0] - reference[0])
+		print(f'Engine {engine}: untiled {time_reference:.2f} sec, tiled {time_tiled:.2f} sec, '
+			  f'pooled magnitude mean = {reference[0].mean():.3f} px, max. abs. difference = {diff.max():.4f}, mean = {diff.mean():.5f} px')
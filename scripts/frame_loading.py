@@ -0,0 +1,136 @@
+"""
+This is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This package is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this package. If not, you can get eh GNU GPL from
+https://www.gnu.org/licenses/gpl-3.0.en.html.
+
+Created by Robert Ljubicic.
+"""
+
+try:
+	from __init__ import *
+	from os import path
+	from utilities import present_exception_and_exit
+
+except Exception:
+	present_exception_and_exit('Import failed! For more information see traceback below. Please report this issue to the author:')
+
+
+# Extensions which can be decoded directly at a reduced size
+REDUCED_EXTENSIONS = ('.jpg', '.jpeg', '.jpe')
+
+# Reduction factor -> (grayscale flag, color flag) of cv2.imread(), largest factor first
+REDUCED_FLAGS = {
+	8: (cv2.IMREAD_REDUCED_GRAYSCALE_8, cv2.IMREAD_REDUCED_COLOR_8),
+	4: (cv2.IMREAD_REDUCED_GRAYSCALE_4, cv2.IMREAD_REDUCED_COLOR_4),
+	2: (cv2.IMREAD_REDUCED_GRAYSCALE_2, cv2.IMREAD_REDUCED_COLOR_2),
+}
+
+
+def reduced_factor(frame_path: str, scale: float) -> int:
+	"""
+	Largest JPEG decoding reduction factor (2, 4 or 8) which does not go below :scale:, 1 if none can be used.
+	"""
+	if path.splitext(frame_path)[1].lower() not in REDUCED_EXTENSIONS:
+		return 1
+
+	for factor in REDUCED_FLAGS:
+		if factor * scale <= 1.0 + 1e-9:
+			return factor
+
+	return 1
+
+
+def reduced_size(size: tuple, factor: int) -> tuple:
+	"""
+	Size (w, h) of a frame with the full resolution :size: = (w, h), decoded with the reduction :factor:.
+	"""
+	return tuple(-(-s // factor) for s in size)
+
+
+def decode_frame(frame_path: str, scale=1.0, grayscale=True) -> tuple:
+	"""
+	Decodes a frame which is to be resized by :scale:. If :scale: <= 1/2 and the frame is a JPEG, the frame is decoded
+	directly at 1/2, 1/4 or 1/8 of its size, see reduced_factor(), otherwise at full resolution.
+
+	:return:	Frame as uint8 array (None if it cannot be read) and the reduction factor, see reduced_size().
+	"""
+	factor = reduced_factor(frame_path, scale) if scale != 1.0 else 1
+
+	if factor > 1:
+		frame = cv2.imread(frame_path, REDUCED_FLAGS[factor][0 if grayscale else 1])
+	else:
+		frame = cv2.imread(frame_path, cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR)
+
+	return frame, factor
+
+
+def read_frame(frame_path: str, size=None, scale=1.0, grayscale=True, interpolation=cv2.INTER_LINEAR) -> np.ndarray:
+	"""
+	Reads a frame and resizes it to :size: = (w, h) if :scale: != 1.0. If :scale: <= 1/2 and the frame is a JPEG,
+	the frame is decoded directly at 1/2, 1/4 or 1/8 of its size and only the remainder is resized,
+	otherwise the frame is decoded at full resolution and resized, see decode_frame().
+
+	:param size:			Output size (w, h), if None it is computed from :scale: and the full resolution.
+	:param scale:			Scale factor of the frame, used to pick the reduced decoding.
+	:param grayscale:		Whether to read the frame as grayscale or as BGR.
+	:param interpolation:	Interpolation for cv2.resize().
+	:return:				Frame as uint8 array, None if it cannot be read.
+	"""
+	frame, _ = decode_frame(frame_path, scale if size is not None else 1.0, grayscale)
+
+	if frame is None or scale == 1.0:
+		return frame
+
+	if size is None:
+		size = (int(frame.shape[1] * scale), int(frame.shape[0] * scale))
+
+	if (frame.shape[1], frame.shape[0]) != tuple(size):
+		frame = cv2.resize(frame, tuple(size), interpolation=interpolation)
+
+	return frame
+
+
+if __name__ == '__main__':
+	# Decoding throughput of full decoding + resize against the reduced decoding
+	from time import time
+	from tempfile import TemporaryDirectory
+
+	h, w = 3000, 4000
+	rng = np.random.default_rng(0)
+	texture = cv2.GaussianBlur((rng.random((h, w)) * 255).astype('uint8'), (7, 7), 2.0)
+	image = cv2.merge([texture, np.roll(texture, 5, axis=0), np.roll(texture, 5, axis=1)])
+
+	with TemporaryDirectory() as folder:
+		frame_path = f'{folder}/frame.jpg'
+		cv2.imwrite(frame_path, image, [cv2.IMWRITE_JPEG_QUALITY, 95])
+
+		for grayscale in [True, False]:
+			for scale in [0.5, 0.4, 0.25, 0.125]:
+				size = (int(w * scale), int(h * scale))
+				flag = cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR
+				repeats = 10
+
+				start = time()
+				for _ in range(repeats):
+					reference = cv2.resize(cv2.imread(frame_path, flag), size)
+				time_reference = (time() - start) / repeats
+
+				start = time()
+				for _ in range(repeats):
+					reduced = read_frame(frame_path, size, scale, grayscale)
+				time_reduced = (time() - start) / repeats
+
+				diff = np.abs(reduced.astype('float32') - reference.astype('float32'))
+				print(f'{"Grayscale" if grayscale else "Color":9s} {w}x{h} -> scale {scale:.3f} (factor {reduced_factor(frame_path, scale)}): '
+					  f'imread + resize {1 / time_reference:6.1f} fps, reduced {1 / time_reduced:6.1f} fps, '
+					  f'mean abs. difference = {diff.mean():.2f}')
@@ -20,6 +20,7 @@ try:
 	from __init__ import *
 	from class_console_printer import Console_printer, tag_print, tag_string, unix_path
 	from class_progress_bar import Progress_bar
+	from frame_loading import decode_frame, reduced_size
 	from os import path, listdir
 	from datetime import timedelta
 	from glob import glob
@@ -80,8 +81,10 @@ def framesToVideo(output, folder='.', ext='jpg', codec='MJPG', fps=30.00, scale=
 	# TODO: Should I include other extensions?
 	saveStr = f'{folder}/{output}.avi'
 
-	out = cv2.VideoWriter(saveStr, cv2.VideoWriter_fourcc(*codec), fps,
-						  (int(scale * width), int(scale * height)))
+	# Scaled JPEG frames are decoded at a reduced size and only the remainder is resized, see decode_frame()
+	size = (int(scale * width), int(scale * height))
+
+	out = cv2.VideoWriter(saveStr, cv2.VideoWriter_fourcc(*codec), fps, size)
 
 	if verbose:
 		tag_print('start', 'Creating video from frames')
@@ -102,21 +105,20 @@ def framesToVideo(output, folder='.', ext='jpg', codec='MJPG', fps=30.00, scale=
 	for filename in listdir(folder):
 		if filename.endswith('.' + ext) and i < max_frames:
 			try:
-				image = cv2.imread(folder + '/' + filename)
+				image, factor = decode_frame(folder + '/' + filename, scale, grayscale=False)
 				h, w = image.shape[:2]
 
-				# Happens sometimes with oddly packed videos
-				if h != height or w != width:
+				# Happens sometimes with oddly packed videos, the decoded size is compared before resizing
+				if (w, h) != reduced_size((width, height), factor):
 					if not size_adj:
 						tag_print('error', f'Frame {i} does not have the same size as the first frame!')
 						tag_print('error', 'OpenCV Video writer requires all frames to be the same size!')
 						exit_message()
 					else:
-						tag_print('warning', f'Adjusting the size of frame {i} to {width}x{height} px')
-						cv2.resize(image, [height, width], interpolation=interp)
+						tag_print('warning', f'Adjusting the size of frame {i} to {size[0]}x{size[1]} px')
 
-				if scale != 1.0:
-					image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=interp)
+				if (w, h) != size:
+					image = cv2.resize(image, size, interpolation=interp)
 
 				out.write(image)
 
@@ -0,0 +1,316 @@
+"""
+This is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This package is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this package. If not, you can get eh GNU GPL from
+https://www.gnu.org/licenses/gpl-3.0.en.html.
+
+Created by Robert Ljubicic.
+"""
+
+try:
+	from __init__ import *
+	from math import log
+	from class_console_printer import tag_string
+	from ssim_kernels import ssim_map as ssim_scores_map, SSIM_WINDOW
+	from utilities import present_exception_and_exit
+
+except Exception:
+	present_exception_and_exit('Import failed! For more information see traceback below. Please report this issue to the author:')
+
+
+# SSIM window at the downsampled pyramid levels, smaller than SSIM_WINDOW since the kernels are smaller
+PYRAMID_WINDOW = 5
+
+# Smallest kernel size at the coarsest pyramid level [px]
+PYRAMID_MIN_KERNEL = 9
+
+
+def find_gcp(search_area: np.ndarray, kernel: np.ndarray) -> tuple:
+	"""
+	Detects a GCP center in the using SSIM.
+	SSIM scores of all kernel positions within the search area are computed at once, see ssim_kernels.ssim_map().
+
+	:param search_area: 	Input image to search for GCP in.
+	:param kernel:			Kernel to use for SSIM comparison.
+	:return: 				Position (x,y) of the GCP center in the input image.
+	"""
+	
+	padding = kernel.shape[0] // 2
+	ssim_map = np.zeros(search_area.shape)
+	search_end = search_area.shape[0] - padding
+
+	# Map is indexed as [x, y] = position of the kernel center
+	ssim_map[padding: search_end, padding: search_end] = ssim_scores_map(search_area, kernel, SSIM_WINDOW, 255).T
+
+	try:
+		score_max = np.max(ssim_map)
+	except ValueError:
+		score_max = 0
+		x_pix, y_pix = 0, 0
+		
+		return (x_pix, y_pix), score_max
+
+	x_pix, y_pix = np.unravel_index(np.argmax(ssim_map), ssim_map.shape)
+
+	# To avoid negative or zero numbers in log function, SSIM goes from -1 to 1
+	ssim_map += 2
+
+	# Gaussian 2x3 fit
+	dx = (log(ssim_map[x_pix-1, y_pix]) - log(ssim_map[x_pix+1, y_pix])) / (2*(log(ssim_map[x_pix-1, y_pix]) + log(ssim_map[x_pix+1, y_pix]) - 2*log(ssim_map[x_pix, y_pix])))
+	dy = (log(ssim_map[x_pix, y_pix-1]) - log(ssim_map[x_pix, y_pix+1])) / (2*(log(ssim_map[x_pix, y_pix-1]) + log(ssim_map[x_pix, y_pix+1]) - 2*log(ssim_map[x_pix, y_pix])))
+
+	x_sub = x_pix + dx
+	y_sub = y_pix + dy
+
+	return (x_sub, y_sub), score_max
+
+
+def coarse_kernel_span(k_size: int, level: int) -> tuple:
+	"""
+	Crop of a :k_size: kernel after :level: times cv2.pyrDown(), odd-sized and around the kernel center.
+
+	:return:	Tuple (center, span), where center is the pixel of the downsampled kernel closest to the original kernel center
+				and the crop is [center - span, center + span].
+	"""
+	size = k_size
+
+	for _ in range(level):
+		size = (size + 1) // 2
+
+	center = int(round((k_size - 1) / 2 / 2**level))
+
+	return center, min(center, size - 1 - center)
+
+
+def pyramid_levels(k_size: int, max_levels: int) -> int:
+	"""
+	Number of pyramid levels, at most :max_levels:, for which the downsampled kernel is not smaller than PYRAMID_MIN_KERNEL.
+	"""
+	levels = 0
+
+	while levels < max_levels and 2 * coarse_kernel_span(k_size, levels + 1)[1] + 1 >= PYRAMID_MIN_KERNEL:
+		levels += 1
+
+	return levels
+
+
+def find_gcp_pyramid(search_area: np.ndarray, kernel: np.ndarray, max_levels: int) -> tuple:
+	"""
+	Coarse-to-fine version of find_gcp() for large search areas. The GCP is located on the search area and the kernel
+	downsampled by 2^levels, see pyramid_levels(), and then refined with find_gcp() within a neighbourhood of 2^levels + 2 px
+	around that location at full resolution, so the cost grows with the search area only at the coarse level.
+	Same result as find_gcp() whenever the coarse location is within the neighbourhood of the SSIM peak.
+
+	:param max_levels:	Max. number of pyramid levels, find_gcp() is used if no level can be used.
+	:return:			Position (x,y) of the GCP center in the input image and the SSIM score, same as find_gcp().
+	"""
+	k_size = kernel.shape[0]
+	s_size = search_area.shape[0]
+	levels = pyramid_levels(k_size, max_levels)
+	scale = 2**levels
+	radius = scale + 2
+	padding = k_size // 2
+
+	if levels == 0 or s_size < k_size + 2*radius:
+		return find_gcp(search_area, kernel)
+
+	coarse_area, coarse_kernel = search_area, kernel
+
+	for _ in range(levels):
+		coarse_area = cv2.pyrDown(coarse_area)
+		coarse_kernel = cv2.pyrDown(coarse_kernel)
+
+	center, span = coarse_kernel_span(k_size, levels)
+	coarse_kernel = np.ascontiguousarray(coarse_kernel[center - span: center + span + 1, center - span: center + span + 1])
+
+	# Pixel (r, c) of cv2.pyrDown() is centered on pixel (r, c) * scale of the input
+	scores = ssim_scores_map(coarse_area, coarse_kernel, PYRAMID_WINDOW, 255)
+	r, c = np.unravel_index(np.argmax(scores), scores.shape)
+	x0 = int(round((c + span - center) * scale + (k_size - 1) / 2))
+	y0 = int(round((r + span - center) * scale + (k_size - 1) / 2))
+
+	# Full resolution neighbourhood, shifted to fit within the search area
+	x0 = min(max(x0, padding + radius), s_size - 1 - padding - radius)
+	y0 = min(max(y0, padding + radius), s_size - 1 - padding - radius)
+	half = padding + radius
+	neighbourhood = search_area[y0 - half: y0 + half + 1, x0 - half: x0 + half + 1]
+
+	(x_sub, y_sub), score_max = find_gcp(neighbourhood, kernel)
+
+	return (x_sub + x0 - half, y_sub + y0 - half), score_max
+
+
+def track_marker(img_gray: np.ndarray, j: int, marker: list, kernel: np.ndarray, params: dict, prediction=None) -> dict:
+	"""
+	Tracks a single marker in a frame: SSIM search around the previous position, expanded search if the SSIM score is too low,
+	kernel update and the check whether the marker is lost. Markers are independent within a frame, so this can run in parallel
+	for all markers, see track_markers(). Log messages are returned instead of logged, to keep them in marker order.
+
+	With a :prediction:, the search area is centered on the predicted position and has the predicted size. The search is
+	widened to the full search area size if the SSIM score is below 'predict_ssim_thr' or if the SSIM peak is at the
+	edge of the predicted search area, i.e. the marker may be outside of it.
+
+	:param j:			Marker index, for the log messages.
+	:param marker:		Previous marker position [x, y], [0, 0] if the marker is lost.
+	:param params:		Dictionary with 'search_size', 'exp_search_size', 'k_size', 'expand_ssim_search', 'expand_ssim_thr',
+						'expand_pyramid', 'update_kernels' and 'predict_ssim_thr', see feature_tracking.py.
+	:param prediction:	Tuple (shift_x, shift_y, size) from Marker_predictor.predict(), None = search around the previous position.
+	:return:			Dictionary with 'marker' = new position [x, y], 'ssim' = SSIM score, 'kernel' = kernel for the next frame,
+						'lost' = whether the marker is lost, 'widened' = whether the predicted search area was widened
+						and 'messages' = list of log messages.
+	"""
+	xx, yy = marker
+	k_size = params['k_size']
+	result = {'marker': marker, 'ssim': 0, 'kernel': kernel, 'lost': False, 'widened': False, 'messages': []}
+
+	if xx != 0 and yy != 0:
+		search_size = params['search_size']
+		rel_center = None
+
+		if prediction is not None:
+			shift_x, shift_y, size = prediction
+			xx, yy = xx + shift_x, yy + shift_y
+
+			if size < search_size:
+				search_space = cv2.getRectSubPix(img_gray, (size, size), (xx, yy))
+				rel_center, ssim_max = find_gcp(search_space, kernel)
+
+				radius = (size - k_size) // 2
+				offset = max(abs(rel_center[0] - (size - 1) / 2), abs(rel_center[1] - (size - 1) / 2))
+
+				if ssim_max < params['predict_ssim_thr'] or offset > radius - 1:
+					result['widened'] = True
+					rel_center = None
+				else:
+					search_size = size
+
+		if rel_center is None:
+			search_space = cv2.getRectSubPix(img_gray, (search_size, search_size), (xx, yy))
+			rel_center, ssim_max = find_gcp(search_space, kernel)
+
+		if params['expand_ssim_search'] and ssim_max < params['expand_ssim_thr']:
+			result['messages'].append(tag_string('warning', f'Expanding the search area, SSIM={ssim_max:.3f} < {params["expand_ssim_thr"]:.3f}'))
+
+			search_size = params['exp_search_size']
+			search_space = cv2.getRectSubPix(img_gray, (search_size, search_size), (xx, yy))
+
+			if params['expand_pyramid']:
+				rel_center, ssim_max = find_gcp_pyramid(search_space, kernel, params['expand_pyramid'])
+			else:
+				rel_center, ssim_max = find_gcp(search_space, kernel)
+
+		real_x = rel_center[0] + xx - (search_size - 1) / 2
+		real_y = rel_center[1] + yy - (search_size - 1) / 2
+
+		result['marker'] = [real_x, real_y]
+		result['ssim'] = ssim_max
+
+		if params['update_kernels']:
+			result['kernel'] = cv2.getRectSubPix(img_gray, (k_size, k_size), (real_x, real_y))
+
+		try:
+			cv2.getRectSubPix(img_gray, (params['search_size'], params['search_size']), (real_x, real_y))
+		except SystemError:
+			result['lost'] = True
+
+	else:
+		result['lost'] = True
+
+	if result['lost']:
+		result['messages'].append(tag_string('warning', f'Marker {j} lost! Setting coordinates to (0, 0).'))
+		result['marker'] = [0, 0]
+
+	return result
+
+
+def track_markers(img_gray: np.ndarray, markers: list, kernels: list, params: dict, executor=None, predictions=None) -> list:
+	"""
+	Tracks all markers in a frame, see track_marker().
+
+	:param executor:	concurrent.futures executor to track the markers in parallel, None = one after another.
+	:param predictions:	List of predictions for every marker, see track_marker(), None = no prediction.
+	:return:			List of the results of track_marker(), in marker order.
+	"""
+	predictions = [None] * len(markers) if predictions is None else predictions
+	args = (range(len(markers)), markers, kernels, predictions)
+
+	if executor is None:
+		return list(map(lambda j, m, k, p: track_marker(img_gray, j, m, k, params, p), *args))
+
+	return list(executor.map(lambda j, m, k, p: track_marker(img_gray, j, m, k, params, p), *args))
+
+
+if __name__ == '__main__':
+	# Time and accuracy of the pyramid search against find_gcp() on expanded search areas with large drifts,
+	# then time and parity of the parallel marker tracking against the serial one
+	from time import time
+	from concurrent.futures import ThreadPoolExecutor
+	from multiprocessing import cpu_count
+	from class_console_printer import tag_print
+
+	rng = np.random.default_rng(0)
+	frame = cv2.GaussianBlur((rng.random((1000, 1000)) * 255).astype('uint8'), (9, 9), 2.5)
+	noisy = np.clip(frame + rng.normal(0, 4, frame.shape), 0, 255).astype('uint8')
+	trials = 40
+
+	for search_size, k_size, max_levels in [(43, 11, 2), (43, 21, 2), (81, 21, 2), (121, 31, 3), (161, 41, 3)]:
+		times = {'find_gcp': 0.0, 'find_gcp_pyramid': 0.0}
+		matches = 0
+		max_diff = 0
+
+		for _ in range(trials):
+			x, y = rng.uniform(200, 800, 2)
+			dx, dy = rng.uniform(-(search_size - k_size) / 2 + 2, (search_size - k_size) / 2 - 2, 2)
+			kernel = cv2.getRectSubPix(frame, (k_size, k_size), (x + dx, y + dy))
+			search_area = cv2.getRectSubPix(noisy, (search_size, search_size), (x, y))
+
+			start = time()
+			reference, score_reference = find_gcp(search_area, kernel)
+			times['find_gcp'] += time() - start
+
+			start = time()
+			result, score = find_gcp_pyramid(search_area, kernel, max_levels)
+			times['find_gcp_pyramid'] += time() - start
+
+			diff = np.hypot(result[0] - reference[0], result[1] - reference[1])
+			max_diff = max(max_diff, diff)
+			matches += diff < 1e-6 and score == score_reference
+
+		tag_print('info', f'SA {search_size:3d}, IA {k_size}, levels = {pyramid_levels(k_size, max_levels)}: '
+						  f'find_gcp {times["find_gcp"] / trials * 1000:7.2f} ms, pyramid {times["find_gcp_pyramid"] / trials * 1000:6.2f} ms, '
+						  f'same peak in {matches}/{trials}, max. difference = {max_diff:.3f} px')
+
+	num_markers = 24
+	markers = [list(m) for m in rng.uniform(100, 900, (num_markers, 2))]
+	markers[5] = [0, 0]
+	drift = np.array([6.3, -4.1])
+
+	for search_size, k_size in [(21, 11), (61, 31)]:
+		params = {'search_size': search_size, 'exp_search_size': 2*search_size + 1, 'k_size': k_size, 'expand_ssim_search': 1,
+				  'expand_ssim_thr': 0.5, 'expand_pyramid': 0, 'update_kernels': 1, 'predict_ssim_thr': 0.8}
+		kernels = [cv2.getRectSubPix(frame, (k_size, k_size), tuple(m)) for m in markers]
+		shifted = cv2.warpAffine(noisy, np.float32([[1, 0, drift[0]], [0, 1, drift[1]]]), noisy.shape[::-1])
+
+		start = time()
+		serial = track_markers(shifted, markers, kernels, params)
+		time_serial = time() - start
+
+		with ThreadPoolExecutor(max_workers=cpu_count()) as executor:
+			track_markers(shifted, markers, kernels, params, executor)
+
+			start = time()
+			parallel = track_markers(shifted, markers, kernels, params, executor)
+			time_parallel = time() - start
+
+		same = all(a['marker'] == b['marker'] and a['ssim'] == b['ssim'] and a['messages'] == b['messages'] for a, b in zip(serial, parallel))
+		tag_print('info' if same else 'error', f'{num_markers} markers, SA {search_size}, IA {k_size}: serial {time_serial * 1000:6.1f} ms, '
+											   f'{cpu_count()} threads {time_parallel * 1000:6.1f} ms, same results and messages = {same}')
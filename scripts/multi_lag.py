@@ -0,0 +1,105 @@
+"""
+This is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This package is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this package. If not, you can get eh GNU GPL from
+https://www.gnu.org/licenses/gpl-3.0.en.html.
+
+Created by Robert Ljubicic.
+"""
+
+try:
+	from __init__ import *
+	from class_frame_reader import Frame_reader
+	from flow_processing import chain_start, read_pair_frame, warm_pair
+	from pair_planner import plan_multi_lag
+	from utilities import present_exception_and_exit
+
+except Exception as ex:
+	present_exception_and_exit('Import failed! For more information see traceback below. Please report this issue to the author:')
+
+
+def str_to_lags(s: str) -> list:
+	"""
+	Parses a list of velocity steps in format "1, 2, 4".
+	"""
+	return sorted(set([int(x) for x in s.split(',') if x.strip() != '']))
+
+
+def multi_lag_pairs(params: dict, img_list: list, lags: list, pairing: int, primary: int, callback, start=None):
+	"""
+	Generator of (pooled_mag, pooled_dir) for the frame pairs of the :primary: lag, same as serial_pairs().
+	Every frame is read only once and kept until the last frame pair which uses it, see plan_multi_lag(),
+	and the frame pairs of all :lags: are computed in a single pass. Results of the other lags are passed to
+	callback(lag, k, pooled_mag, pooled_dir), where k is the frame pair index within the lag.
+
+	:param start:	Dictionary lag -> index of the first frame pair to compute (e.g. to resume), default is 0 for all lags.
+	"""
+	start = {} if start is None else start
+	first = {lag: chain_start(start.get(lag, 0), params) for lag in lags}
+	reads, pairs_ending, releases = plan_multi_lag(len(img_list), lags, pairing, first)
+
+	buffer = {}
+	states = {lag: {} for lag in lags}
+	frames = Frame_reader([img_list[n] for n in reads], read=lambda frame_path: read_pair_frame(frame_path, params))
+
+	for n, frame in zip(reads, frames):
+		buffer[n] = frame
+
+		for lag, k, a in pairs_ending.get(n, []):
+			pooled_mag, pooled_dir = warm_pair(k, buffer[a], buffer[n], params, states[lag])
+
+			# Only seeds the warm start chain, see chain_start()
+			if k < start.get(lag, 0):
+				continue
+
+			if lag == primary:
+				yield pooled_mag, pooled_dir
+			else:
+				callback(lag, k, pooled_mag, pooled_dir)
+
+		for m in releases.get(n, []):
+			del buffer[m]
+
+
+def merge_lags(mag_means: dict, angle_means: dict, step: int, displacement_range: tuple) -> tuple:
+	"""
+	Merges the filtered fields of several lags by picking, for every cell, the largest lag whose mean
+	displacement is within :displacement_range:. If no lag is within the range, the lag with the
+	displacement closest to the range (by ratio) is used.
+
+	:param mag_means:			Dictionary lag -> filtered magnitudes [px/lag].
+	:param angle_means:			Dictionary lag -> filtered directions [deg].
+	:param step:				Velocity step of the merged magnitudes.
+	:param displacement_range:	Optimal displacement range (min, max) [px/lag].
+	:return:					Tuple (mag_mean [px/step], angle_mean, lag_map) of float32 arrays, NaN where no data.
+	"""
+	lags = sorted(mag_means)
+	low, high = displacement_range
+
+	disp = np.stack([np.asarray(mag_means[lag], dtype='float64') for lag in lags])
+	angles = np.stack([np.ma.filled(np.ma.asarray(angle_means[lag], dtype='float64'), np.nan) for lag in lags])
+
+	with np.errstate(divide='ignore', invalid='ignore'):
+		distance = np.where(disp < low, np.log(low / disp), np.where(disp > high, np.log(disp / high), 0))
+
+	distance = np.nan_to_num(distance, nan=np.inf, posinf=np.inf)
+
+	# argmin() picks the first minimum, reversed order prefers the largest lag
+	choice = len(lags) - 1 - np.argmin(distance[::-1], axis=0)
+	valid = np.isfinite(np.take_along_axis(disp, choice[np.newaxis], axis=0)[0])
+
+	lags_array = np.array(lags, dtype='float64')
+	mag_mean = np.take_along_axis(disp, choice[np.newaxis], axis=0)[0] * step / lags_array[choice]
+	angle_mean = np.where(valid, np.take_along_axis(angles, choice[np.newaxis], axis=0)[0], np.nan)
+	lag_map = np.where(valid, lags_array[choice], np.nan)
+
+	return mag_mean.astype('float32'), angle_mean.astype('float32'), lag_map.astype('float32')
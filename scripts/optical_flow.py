@@ -19,39 +19,35 @@ Created by Robert Ljubicic.
 
 try:
 	from __init__ import *
-	from os import path
+	from os import path, remove
+	from time import time
 	from math import log10, floor
 	from glob import glob
 	from class_console_printer import Console_printer, tag_string, tag_print, unix_path
 	from class_progress_bar import Progress_bar
 	from class_timing import Timer, time_hms
-	from CPP.dll_import import DLL_Loader
-	from ctypes import c_int, c_double, c_size_t
-	from warnings import catch_warnings, simplefilter
-	from vel_ratio import vel_ratio, L1
+	from class_field_store import Field_store, FIELDS
+	from multiprocessing import cpu_count
+	from flow_processing import auto_reduction, serial_pairs, parallel_pairs
+	from flow_mask import load_mask, pool_mask, mask_box, expand_cells
+	from flow_engines import engine_params_from_cfg, engine_description, engine_names, validate_engine
+	from class_threshold_histogram import Threshold_histogram
+	from class_live_preview import Live_preview
+	from class_lag_accumulator import Lag_accumulator
+	from class_direction_accumulator import Direction_accumulator
+	from class_diagnostics_table import Diagnostics_table
+	from class_checkpoint import Checkpoint, config_fingerprint, prefix_state, unprefix_state
+	from multi_lag import str_to_lags, multi_lag_pairs, merge_lags
+	from pair_planner import plan_pairs
+	from temporal_filtering import temporal_filtering, create_stack, chunk_rows, memory_chunk_size, time_chunk
 	from utilities import fresh_folder, cfg_get, exit_message, present_exception_and_exit
 
-	import matplotlib.pyplot as plt
 	import ctypes
 
-	dll_path = path.split(path.realpath(__file__))[0]
-	dll_name = 'CPP/pooling.dll'
-	dll_loader = DLL_Loader(dll_path, dll_name)
-
-	# double temporal_pooling(float* array_mag, size_t size, double m);
-	temporal_pooling = dll_loader.get_function('double', 'temporal_pooling', ['float*', 'size_t', 'double'])
-	
-	# void spatial_pooling(float* array_mag, float* array_dir, float* pooled_mag, float* pooled_dir, int rows, int cols, int pooling);
-	spatial_pooling = dll_loader.get_function('void', 'spatial_pooling', ['float*', 'float*', 'float*', 'float*', 'int', 'int', 'int'])
-	
 except Exception:
 	present_exception_and_exit('Import failed! For more information see traceback below. Please report this issue to the author:')
 
 
-COVERAGE_FILTER = 0.4
-DIRECTION_FILTER_THRESHOLD = 0.001
-
-
 def get_angle_range(angle_main, angle_range):
 	angle_lower = angle_main - angle_range
 	angle_upper = angle_main + angle_range
@@ -67,6 +63,34 @@ def get_angle_range(angle_main, angle_range):
 	return func, angle_lower, angle_upper
 
 
+def unshift_angles(angle_mean, angle_func, angle_upper):
+	"""
+	Reverts the shift of directions applied in postprocess_flow() for direction ranges over 0/360 deg.
+	"""
+	if angle_func.__name__ == "bitwise_or":
+		angle_mean += angle_upper
+		angle_mean = np.where(angle_mean >= 360, angle_mean - 360, angle_mean)
+
+	return angle_mean
+
+
+def save_lag_results(folder, T1_array, T2_array, T3_array, threshold_ratios, mag_mean, angle_mean, diagnostics_table):
+	"""
+	Saves the filtered fields and diagnostics of a single velocity step of the multi-lag optical flow.
+	"""
+	fresh_folder(folder)
+	fresh_folder(f'{folder}/diagnostics')
+
+	for name, array in zip(['T1', 'T2', 'T3'], [T1_array, T2_array, T3_array]):
+		np.savetxt(f'{folder}/diagnostics/{name}.txt', array, fmt='%.3f')
+
+	diagnostics_table.save(f'{folder}/diagnostics')
+
+	np.savetxt(f'{folder}/mag_mean.txt', mag_mean, fmt='%.3f')
+	np.savetxt(f'{folder}/angle_mean.txt', angle_mean, fmt='%.3f')
+	np.savetxt(f'{folder}/threshold_ratios.txt', threshold_ratios, fmt='%.3f')
+
+
 def nan_locate(y):
 	return np.isnan(y), lambda z: z.nonzero()[0]
 
@@ -76,6 +100,7 @@ if __name__ == '__main__':
 		parser = ArgumentParser()
 		parser.add_argument('--cfg', type=str, help='Path to configuration file')
 		parser.add_argument('--quiet', type=int, help='Quiet mode for batch processing, no RETURN confirmation on success', default=0)
+		parser.add_argument('--resume', type=int, help='Continue an interrupted run from its last checkpoint, see CheckpointInterval', default=0)
 		args = parser.parse_args()
 
 		cfg = configparser.ConfigParser()
@@ -103,18 +128,46 @@ if __name__ == '__main__':
 		angle_range = cfg_get(cfg, section, 'AngleRange', float)
 		average_only = cfg_get(cfg, section, 'AverageOnly', int, 0)
 		live_preview = cfg_get(cfg, section, 'LivePreview', int, 0)
+		live_preview_rate = cfg_get(cfg, section, 'LivePreviewRate', float, 2.0)	# Max. preview updates per second
 		max_magnitude = cfg_get(cfg, section, 'MaxMagnitude', float, -1)
 		chain_start = cfg_get(cfg, section, 'ChainStart', str, '0, 0')
 		chain_end = cfg_get(cfg, section, 'ChainEnd', str, '0, 0')
+		workers = cfg_get(cfg, section, 'Workers', int, 1)		# 0 = use all CPU cores
+		out_of_core = cfg_get(cfg, section, 'OutOfCore', int, 0)	# 1 = keep stacks in memory-mapped files
+		histogram_bins = cfg_get(cfg, section, 'HistogramBins', int, 0)	# > 0 = streaming temporal filtering using magnitude histograms instead of stacks
+		histogram_max = cfg_get(cfg, section, 'HistogramMax', float, max_magnitude if max_magnitude > 0 else 25.6)	# px/frame
+		memory_limit = cfg_get(cfg, section, 'MemoryLimit', float, 1024)	# MB, working memory for OutOfCore=1
+		field_format = cfg_get(cfg, section, 'FieldFormat', int, 1)		# 0 = text files, 1 = binary float32, 2 = binary quantized int16
+		engine_params = engine_params_from_cfg(cfg, section)
+		auto_scale = cfg_get(cfg, section, 'AutoScale', int, 0)			# 1 = compute flow at a reduced resolution picked from pooling
+		min_displacement = cfg_get(cfg, section, 'MinDisplacement', float, 2.0)	# Smallest expected displacement [px/frame], for AutoScale=1
+		warm_start = cfg_get(cfg, section, 'WarmStart', int, 0)			# 1 = seed each pair with the flow of the previous pair
+		warm_chain = cfg_get(cfg, section, 'WarmStartChain', int, 50)		# Compute every n-th pair from scratch
+		warm_reset = cfg_get(cfg, section, 'WarmStartReset', float, 0.2)	# Relative jump of mean displacement which resets the warm start
+		steps = cfg_get(cfg, section, 'Steps', str, '')					# Additional velocity steps computed in the same run, e.g. "1, 2, 4"
+		merge_steps = cfg_get(cfg, section, 'MergeSteps', int, 0)		# 1 = pick the velocity step per cell by OptimalDisplacement
+		optimal_displacement = cfg_get(cfg, section, 'OptimalDisplacement', str, '2, 8')	# px/step
+		median_bins = cfg_get(cfg, section, 'DiagnosticsMedianBins', int, 0)	# > 0 = approximate per-pair median displacement from a histogram
+		checkpoint_interval = cfg_get(cfg, section, 'CheckpointInterval', float, 0)	# sec, > 0 = save checkpoints for --resume, stacks are kept on disk
+
+		# Checked before the results of the previous run are deleted
+		try:
+			validate_engine(engine_params)
+		except (ValueError, RuntimeError) as ex:
+			tag_print('error', str(ex))
+			exit_message()
 
-		fresh_folder(results_folder, exclude=['depth_profile.txt'])
-		fresh_folder(results_folder + '/magnitudes')
-		fresh_folder(results_folder + '/directions')
-		fresh_folder(results_folder + '/U')
-		fresh_folder(results_folder + '/V')
-		fresh_folder(results_folder + '/diagnostics')
+		# Results of the interrupted run are kept when resuming
+		if not args.resume:
+			fresh_folder(results_folder, exclude=['depth_profile.txt'])
+			fresh_folder(results_folder + '/magnitudes')
+			fresh_folder(results_folder + '/directions')
+			fresh_folder(results_folder + '/U')
+			fresh_folder(results_folder + '/V')
+			fresh_folder(results_folder + '/fields')
+			fresh_folder(results_folder + '/diagnostics')
 		
-		img_list = glob(f'{frames_folder}/*.{ext}')
+		img_list = sorted(glob(f'{frames_folder}/*.{ext}'))
 
 		if useOnlySDIFrames:
 			try:
@@ -134,159 +187,253 @@ if __name__ == '__main__':
 					exit_message()
 
 		num_frames = len(img_list)
+
+		checkpoint = Checkpoint(f'{results_folder}/checkpoint.npz', config_fingerprint(cfg, section, img_list))
+		resume_state = None
+
+		if args.resume:
+			if not checkpoint.exists():
+				tag_print('error', f'No checkpoint found in [{results_folder}], cannot resume!')
+				exit_message()
+
+			resume_state = checkpoint.load()
+
+			if resume_state is None:
+				tag_print('error', f'[{section}] parameters or the list of frames changed since the checkpoint, cannot resume!')
+				tag_print('error', 'Run the optical flow again without --resume.')
+				exit_message()
+
 		num_digits = floor(log10(num_frames)) + 1
 		angle_func, angle_lower, angle_upper = get_angle_range(angle_main, angle_range)
 		
-		if pairing == 0:
-			paths_frame_A = img_list[0:-velocity_step:velocity_step]
-			paths_frame_B = img_list[velocity_step::velocity_step]
-		elif pairing == 1:
-			paths_frame_A = img_list[:-velocity_step]
-			paths_frame_B = img_list[velocity_step:]
-		elif pairing == 2:
-			paths_frame_B = img_list[velocity_step::velocity_step]
-			paths_frame_A = img_list[0] * len(paths_frame_B)
-		
-		indices_frame_A = [img_list.index(x) for x in paths_frame_A]
-		indices_frame_B = [img_list.index(x) for x in paths_frame_B]
-
-		assert len(paths_frame_A) == len(paths_frame_B), f'Frames A list length = {len(paths_frame_A)} != Frames B list length = {len(paths_frame_B)}'
-		num_frame_pairs = len(paths_frame_A)
+		pairs = plan_pairs(num_frames, velocity_step, pairing)
+		indices_frame_A = pairs[:, 0]
+		indices_frame_B = pairs[:, 1]
+		num_frame_pairs = len(pairs)
 
-		frame_A = cv2.imread(paths_frame_A[0], 0)
+		frame_A = cv2.imread(img_list[0], 0)
 		h, w = frame_A.shape
+		frame_shape = frame_A.shape
 
-		farneback_pyr_scale = 0.5
-		farneback_pyr_levels = 3
-		farneback_avg_win = 15
-		farneback_iters = 2
-		farneback_poly_win = 7
-		farneback_sigma = 1.5
-
-		farneback_params = [farneback_pyr_scale,
-		      				farneback_pyr_levels,
-							farneback_avg_win,
-							farneback_iters,
-							farneback_poly_win,
-							farneback_sigma,
-							0]
-	
 		if scale != 1.0:
 			frame_A = cv2.resize(frame_A, (int(w * scale), int(h * scale)))
 			h, w = frame_A.shape
 
-		h_pooled = int(np.floor(h/pooling))
-		w_pooled = int(np.floor(w/pooling))
-		h_buffer = h_pooled//10
-		w_buffer = w_pooled//10
+		workers = cpu_count() if workers <= 0 else min(workers, max(num_frame_pairs, 1))
 
-		flow_hsv = np.zeros([h_pooled, w_pooled, 2], dtype='uint8')
-		mag_stack = np.zeros([h_pooled, w_pooled, num_frame_pairs], dtype='float32')
-		U_stack = np.zeros([h_pooled, w_pooled, num_frame_pairs], dtype='float32')
-		V_stack = np.zeros([h_pooled, w_pooled, num_frame_pairs], dtype='float32')
-		mag_max = np.zeros(mag_stack.shape[:2])
-		angle_stack = np.zeros(mag_stack.shape)
+		lags = sorted(set(str_to_lags(steps)) | {velocity_step})
 
-		coverage_list = np.zeros(num_frame_pairs, dtype='float32')
-		disp_mean_list = np.zeros(num_frame_pairs, dtype='float32')
-		disp_median_list = np.zeros(num_frame_pairs, dtype='float32')
-		disp_max_list = np.zeros(num_frame_pairs, dtype='float32')
+		multi_lag = len(lags) > 1
 
-		if live_preview:
-			fig, ax = plt.subplots()
+		if multi_lag:
+			# Frames are read once for all lags in a single process
+			workers = 1
 
-			try:
-				mng = plt.get_current_fig_manager()
-				mng.window.state('zoomed')
-				mng.set_window_title('Optical flow')
-			except Exception:
-				pass
+		h_pooled = int(np.floor(h/pooling))
+		w_pooled = int(np.floor(w/pooling))
 
-			background = plt.imshow(frame_A, cmap='gray', extent=[-0.5, mag_max.shape[1], mag_max.shape[0], -0.5])
-			flow_shown = plt.imshow(flow_hsv[:, :, 0], cmap='jet', alpha=0.5)
+		reduction = auto_reduction(pooling, min_displacement) if auto_scale else 1
+		flow_pooling = pooling // reduction
+		engine_params['tile_pooling'] = flow_pooling
+
+		# Flow is computed only in the bounding box of the masked cells
+		mask = load_mask(cfg, section, frame_shape, (w, h))
+
+		if mask is not None:
+			cell_mask = pool_mask(mask, pooling, (h_pooled, w_pooled))
+			box = mask_box(cell_mask)
+		else:
+			cell_mask = None
+			box = (0, h_pooled, 0, w_pooled)
+
+		r0, r1, c0, c1 = box
+
+		if mask is not None or reduction > 1:
+			# Pooling blocks are centered in the frame, as in spatial_pooling()
+			x_offset = (w % pooling) // 2
+			y_offset = (h % pooling) // 2
+			crop = (x_offset + c0 * pooling, y_offset + r0 * pooling, x_offset + c1 * pooling, y_offset + r1 * pooling)
+		else:
+			crop = (0, 0, w, h)
+
+		stack_shape = [h_pooled, w_pooled, num_frame_pairs]
+		stack_path = None
+
+		if histogram_bins > 0:
+			histogram = Threshold_histogram(stack_shape[:2], histogram_bins, histogram_max)
+			out_of_core = 0
+		elif out_of_core or checkpoint_interval > 0 or args.resume:
+			# Checkpointed runs keep the stacks on disk, a resumed run reopens them even if CheckpointInterval
+			# or OutOfCore changed, see FINGERPRINT_EXCLUDE
+			stack_path = f'{results_folder}/mag_stack.npy'
+			mag_stack = create_stack(stack_shape, 'float32', stack_path, 'r+' if args.resume else 'w+')
+			filtering_rows = chunk_rows(stack_shape, memory_chunk_size(memory_limit)) if out_of_core else None
+			flush_frames = time_chunk(stack_shape, memory_limit)
+		else:
+			mag_stack = create_stack(stack_shape, 'float32')
+			filtering_rows = None
+
+		directions = Direction_accumulator(stack_shape[:2])
+
+		mag_max = np.zeros(stack_shape[:2])
+
+		if not average_only and field_format > 0:
+			field_stores = [Field_store(f'{results_folder}/fields/{name}',
+										[num_frame_pairs, h_pooled, w_pooled],
+										resolution if field_format == 2 else None,
+										mode='a' if args.resume else 'w')
+							for name, (_, resolution) in FIELDS.items()]
+
+		diagnostics_table = Diagnostics_table(num_frame_pairs, median_bins, histogram_max)
+
+		pair_params = {
+			'img_list': img_list,
+			'pairs': pairs,
+			'scale': scale,
+			'size': (w, h),
+			'pooled_shape': (r1 - r0, c1 - c0),
+			'pooling': pooling,
+			'reduction': reduction,
+			'crop': crop,
+			'flow_size': ((c1 - c0) * flow_pooling, (r1 - r0) * flow_pooling) if reduction > 1 else (crop[2] - crop[0], crop[3] - crop[1]),
+			'flow_pooling': flow_pooling,
+			'engine_params': engine_params,
+			'angle_func': angle_func,
+			'angle_lower': angle_lower,
+			'angle_upper': angle_upper,
+			'max_magnitude': max_magnitude,
+			'warm_start': warm_start == 1,
+			'warm_chain': max(warm_chain, 1),
+			'warm_reset': warm_reset,
+		}
 
-			cbar = plt.colorbar(flow_shown)
-			cbar.solids.set(alpha=1.0)
-			cbar.set_label('Velocity magnitude [px/frame]')
-			
-			plt.title(f'Frames {indices_frame_A[0]}+{indices_frame_B[0]} of {num_frames} total')
-			plt.axis('off')
-			plt.tight_layout()
+		if live_preview:
+			preview = Live_preview((h_pooled, w_pooled), (w, h), live_preview_rate)
 
 		console_printer = Console_printer()
 		progress_bar = Progress_bar(total=num_frame_pairs, prefix=tag_string('info', 'Frame pair '))
-		timer = Timer(total_iter=num_frame_pairs)
 
-		tag_print('start', 'Optical flow estimation using Farneback algorithm\n')
+		tag_print('start', f'Optical flow estimation using {engine_names[engine_params["engine"]]} algorithm\n')
 		tag_print('info', f'Using frames from folder [{frames_folder}]')
 		tag_print('info', f'Results folder [{results_folder}]')
+		tag_print('info', f'Optical flow engine = {engine_description(engine_params)}')
 		tag_print('info', f'Frame extension = {ext}')
 		tag_print('info', f'Number of frames = {num_frames}')
 		tag_print('info', f'Number of frame pairs = {num_frame_pairs}')
 		tag_print('info', f'Velocity step = {velocity_step}')
 		tag_print('info', f'Frame scaling = {scale:.2f}')
 		tag_print('info', f'Pooling = {pooling} px')
+
+		if reduction > 1:
+			tag_print('info', f'Automatic processing scale = {scale/reduction:.3f}, pooling {flow_pooling} px at processing scale')
+
+		if cell_mask is not None:
+			tag_print('info', f'Water surface mask = {cell_mask.sum()} of {cell_mask.size} cells, flow computed in [{crop[0]}:{crop[2]}, {crop[1]}:{crop[3]}] px')
+
 		tag_print('info', f'Main flow direction = {angle_main:.0f} deg')
 		tag_print('info', f'Direction range = {angle_range:.0f} deg')
-		tag_print('info', f'Maximal magnitude = {max_magnitude:.2f} px/frame\n')
+		tag_print('info', f'Maximal magnitude = {max_magnitude:.2f} px/frame')
+		tag_print('info', f'Worker processes = {workers}')
+
+		if multi_lag:
+			tag_print('info', f'Velocity steps = {", ".join([str(lag) for lag in lags])}, single pass over the frames')
+
+		if warm_start:
+			tag_print('info', f'Warm start, chains of {warm_chain} frame pairs, reset at {warm_reset*100:.0f}% change of mean displacement')
+
+		if histogram_bins > 0:
+			tag_print('info', f'Streaming temporal filtering, {histogram_bins} magnitude bins up to {histogram_max:.2f} px/frame, ' \
+							  f'{Threshold_histogram.memory(stack_shape, histogram_bins) / 2**20:.0f} MB')
+
+		if out_of_core:
+			tag_print('info', f'Out-of-core stacks, memory limit = {memory_limit:.0f} MB')
+			tag_print('info', f'Stacks flushed to disk every {flush_frames} frame pairs, filtered in tiles of {filtering_rows} rows')
+
+		if checkpoint_interval > 0:
+			tag_print('info', f'Checkpoints every {checkpoint_interval:.0f} sec, use --resume 1 to continue an interrupted run')
+
+		print()
 		tag_print('info', 'Starting motion detection...\n')
 
-		j = 0
+		accumulators = {}
 
-		for i in range(num_frame_pairs):
-			if i > 0 and paths_frame_A[i] == paths_frame_B[i-1]:
-				frame_A = frame_B
-			else:
-				frame_A = cv2.imread(paths_frame_A[i], 0)
-				
-			frame_B = cv2.imread(paths_frame_B[i], 0)
-
-			if scale != 1.0:
-				frame_A = cv2.resize(frame_A, (w, h))
-				frame_B = cv2.resize(frame_B, (w, h))
-
-			flow = cv2.calcOpticalFlowFarneback(frame_A, frame_B, None, *farneback_params)
-
-			magnitude, angle = cv2.cartToPolar(flow[..., 0], flow[..., 1], angleInDegrees=True)
-
-			if max_magnitude > 0:
-				magnitude[magnitude > max_magnitude] = 0
-
-			# Filter by vector angle
-			angle = np.where(angle_func((angle >= angle_lower), (angle <= angle_upper)), angle, np.nan)
-			mask_magnitude = np.where(angle >= 0, 1, 0)
-			magnitude *= mask_magnitude
-
-			if angle_func.__name__ == "bitwise_or":
-				angle -= angle_upper
-				angle = np.where(angle <= 0, angle + 360, angle)
-
-			if pooling > 1:
-				with catch_warnings():
-					simplefilter("ignore", category=RuntimeWarning)
-					pooled_mag = np.zeros([h_pooled * w_pooled], dtype='float32')
-					pooled_dir = np.zeros([h_pooled * w_pooled], dtype='float32')
-					spatial_pooling(magnitude.ravel(), angle.ravel(), pooled_mag, pooled_dir, c_int(h), c_int(w), c_int(pooling))
-					pooled_dir[pooled_mag < DIRECTION_FILTER_THRESHOLD] = np.nan
-					pooled_mag = np.reshape(pooled_mag, [h_pooled, w_pooled])
-					pooled_dir = np.reshape(pooled_dir, [h_pooled, w_pooled])
+		if multi_lag:
+			accumulators = {lag: Lag_accumulator(lag, (h_pooled, w_pooled), plan_pairs(num_frames, lag, pairing),
+												 histogram_bins, histogram_max, cell_mask, box, median_bins,
+												 f'{results_folder}/mag_stack_{lag}.npy' if stack_path is not None else None, args.resume)
+							for lag in lags if lag != velocity_step}
+
+		def checkpoint_state(pairs_done):
+			"""
+			Running state after :pairs_done: frame pairs, memory-mapped stacks and fields are flushed to disk.
+			"""
+			if stack_path is not None:
+				mag_stack.flush()
+
+			if not average_only and field_format > 0:
+				for store in field_stores:
+					store.flush()
+
+			state = {'pairs_done': np.array(pairs_done), 'mag_max': mag_max}
+			state.update(prefix_state('directions', directions.get_state()))
+			state.update(prefix_state('diagnostics', diagnostics_table.get_state()))
+
+			if histogram_bins > 0:
+				state.update(prefix_state('histogram', histogram.get_state()))
+
+			for lag, accumulator in accumulators.items():
+				state.update(prefix_state(f'lag_{lag}', accumulator.get_state()))
+
+			return state
+
+		start_pair = 0
+
+		if resume_state is not None:
+			start_pair = int(resume_state['pairs_done'])
+			mag_max = resume_state['mag_max']
+			directions.set_state(unprefix_state('directions', resume_state))
+			diagnostics_table.set_state(unprefix_state('diagnostics', resume_state))
+
+			if histogram_bins > 0:
+				histogram.set_state(unprefix_state('histogram', resume_state))
+
+			for lag, accumulator in accumulators.items():
+				accumulator.set_state(unprefix_state(f'lag_{lag}', resume_state))
+
+			tag_print('info', f'Resuming from the checkpoint after {start_pair} of {num_frame_pairs} frame pairs\n')
+
+		timer = Timer(total_iter=max(num_frame_pairs - start_pair, 1))
+		last_checkpoint = time()
+		j = start_pair
+
+		if multi_lag:
+			def accumulate(lag, k, pooled_mag, pooled_dir):
+				accumulators[lag].update(k, pooled_mag, pooled_dir)
+
+			lag_start = {lag: accumulator.done for lag, accumulator in accumulators.items()}
+			lag_start[velocity_step] = start_pair
+			frame_pairs = multi_lag_pairs(pair_params, img_list, lags, pairing, velocity_step, accumulate, lag_start)
+		elif workers > 1:
+			frame_pairs = parallel_pairs(pair_params, workers, start_pair)
+		else:
+			frame_pairs = serial_pairs(pair_params, start_pair)
+
+		for i, (pooled_mag, pooled_dir) in enumerate(frame_pairs, start=start_pair):
+			if cell_mask is not None:
+				pooled_mag = expand_cells(pooled_mag, box, cell_mask)
+				pooled_dir = expand_cells(pooled_dir, box, cell_mask)
+
+			if histogram_bins > 0:
+				histogram.update(pooled_mag)
 			else:
-				pooled_mag = magnitude
-				pooled_dir = angle
+				mag_stack[:, :, j] = pooled_mag
 
-			mag_stack[:, :, j] = pooled_mag
-			mag_max = np.maximum(mag_max, pooled_mag)
+			directions.update(pooled_mag, pooled_dir)
 
-			disp_nonzero = pooled_mag[pooled_mag > COVERAGE_FILTER]
-			disp_coverage = np.where(pooled_mag > COVERAGE_FILTER, 1, 0).sum() / pooled_mag.size * 100
-			disp_mean = disp_nonzero.mean() if disp_nonzero.size > 0 else 0
-			disp_median = np.median(disp_nonzero) if disp_nonzero.size > 0 else 0
-			disp_max = np.max(pooled_mag)
+			mag_max = np.fmax(mag_max, pooled_mag)
 
-			coverage_list[i] = disp_coverage
-			disp_mean_list[i] = disp_mean
-			disp_median_list[i] = disp_median
-			disp_max_list[i] = disp_max
+			disp_coverage, disp_mean, disp_median, disp_max = diagnostics_table.update(i, pooled_mag if cell_mask is None else pooled_mag[cell_mask],
+																					   indices_frame_A[i], indices_frame_B[i])
 
 			# Original direction interpolation code, not used anymore
 			# nans, x = nan_locate(pooled_dir)
@@ -300,30 +447,23 @@ if __name__ == '__main__':
 			# except ValueError:
 			# 	pass
 
-			angle_stack[:, :, j] = pooled_dir
+			if out_of_core and (j + 1) % flush_frames == 0:
+				mag_stack.flush()
 
 			if not average_only:
-				n = str(i).rjust(num_digits, '0')
-				np.savetxt(f'{results_folder}/magnitudes/{n}.txt', pooled_mag, fmt='%.2f')
-				np.savetxt(f'{results_folder}/directions/{n}.txt', pooled_dir, fmt='%.1f')
-
 				us, vs = cv2.polarToCart(pooled_mag, pooled_dir, angleInDegrees=True)
 
-				np.savetxt(f'{results_folder}/U/{n}.txt', us, fmt='%.2f')
-				np.savetxt(f'{results_folder}/V/{n}.txt', vs, fmt='%.2f')
-
-			if live_preview:
-				max_cbar = np.max(mag_max[h_buffer: -h_buffer, w_buffer: -w_buffer])
+				if field_format > 0:
+					for store, field in zip(field_stores, [pooled_mag, pooled_dir, us, vs]):
+						store.write(i, field)
+				else:
+					n = str(i).rjust(num_digits, '0')
 
-				background.set_data(frame_B)
-				flow_shown.set_data(mag_max)
-				flow_shown.set_clim(vmax=max_cbar, vmin=0)
+					for (name, (fmt, _)), field in zip(FIELDS.items(), [pooled_mag, pooled_dir, us, vs]):
+						np.savetxt(f'{results_folder}/{name}/{n}.txt', field, fmt=fmt)
 
-				cbar.solids.set(alpha=1.0)
-				
-				plt.title(f'Frames {indices_frame_A[i]}+{indices_frame_B[i]} of {num_frames}')
-				plt.pause(0.001)
-				plt.draw()
+			if live_preview:
+				preview.update(mag_max, img_list[indices_frame_B[i]], f'Frames {indices_frame_A[i]}+{indices_frame_B[i]} of {num_frames}')
 
 			timer.update()
 
@@ -343,81 +483,95 @@ if __name__ == '__main__':
 			console_printer.add_line(' '*11 + f'Maximal displacement = {disp_max:.3f} px')
 
 			console_printer.overwrite()
+
+			# The warm start flow is not part of the state, with warm start the checkpoints are saved at the
+			# end of a warm start chain, so that the resumed run starts a new chain, see chain_start()
+			if checkpoint_interval > 0 and time() - last_checkpoint >= checkpoint_interval \
+				and (not warm_start or (i + 1) % warm_chain == 0):
+				checkpoint.save(checkpoint_state(i + 1))
+				last_checkpoint = time()
 			
 			j += 1
 
+		if live_preview:
+			preview.close()
+
+		if not average_only and field_format > 0:
+			for store, name in zip(field_stores, FIELDS):
+				store.close()
+
+				if store.clipped > 0:
+					tag_print('warning', f'{store.clipped} values of [{name}] exceeded +-{store.INT16_MAX * store.resolution:.2f} and were clipped by FieldFormat = 2, use FieldFormat = 1 to keep them')
+
 		print()
 		tag_print('info', 'Starting temporal filtering...\n')
 
-		console_printer.reset()
-		progress_bar = Progress_bar(total=mag_stack.shape[0] * mag_stack.shape[1], prefix=tag_string('info', 'Filtering '))
-		
-		m = 0
-		threshold_ratios = np.ndarray(mag_stack.shape[:2], dtype='float32')
-		mag_mean = np.ndarray(mag_stack.shape[:2], dtype='float32')
-
-		T1_array = np.zeros(mag_stack.shape[:2], dtype='float32')
-		T2_array = np.zeros(mag_stack.shape[:2], dtype='float32')
-		T3_array = np.zeros(mag_stack.shape[:2], dtype='float32')
-
-		for i in range(mag_stack.shape[0]):
-			for j in range(mag_stack.shape[1]):
-				mags_xy = mag_stack[i, j, :]
-
-				# Threshold means
-				#     T1 = threshold is the global mean (T0), average the rest
-				#     T2 = threshold is T1, average the rest
-				#     T3 = threshold is T2, average the rest
-				T1 = temporal_pooling(mags_xy.ravel(), c_size_t(mags_xy.size), c_double(-1.0))
-				T2 = temporal_pooling(mags_xy.ravel(), c_size_t(mags_xy.size), c_double(T1))
-				T3 = temporal_pooling(mags_xy.ravel(), c_size_t(mags_xy.size), c_double(T2))
-
-				T1_array[i, j] = T1
-				T2_array[i, j] = T2
-				T3_array[i, j] = T3
-
-				# Final velocity:
-				#     close to T1 if signal too noisy, likely not water surface,
-				#     close to T2 for dense seeding,
-				#     close to T3 if sparse seeding
-				threshold_ratios[i, j] = (T3 - T2)/(T2 - T1) if T2 != T1 else L1
-				mag_mean[i, j] = vel_ratio(T1, T2, T3)
-
-				console_printer.add_line(progress_bar.get(m))
+		if histogram_bins > 0:
+			T1_array, T2_array, T3_array, threshold_ratios, mag_mean = histogram.temporal_filtering()
+			del histogram
+		else:
+			console_printer.reset()
+			progress_bar = Progress_bar(total=mag_stack.shape[0], prefix=tag_string('info', 'Filtering row '))
+
+			def filtering_progress(rows_done):
+				console_printer.add_line(progress_bar.get(rows_done - 1))
 				console_printer.overwrite()
-				m += 1
 
-		mag_weights = np.ndarray(mag_stack.shape)
+			T1_array, T2_array, T3_array, threshold_ratios, mag_mean = temporal_filtering(mag_stack, filtering_rows, callback=filtering_progress, mask=cell_mask)
 
-		# Weight by ratio to mean
-		for i in range(mag_stack.shape[2]):
-			mag_mean_nonzero = np.where(mag_mean == 0, 0.01, mag_mean)
-			ratio = np.divide(mag_stack[:, :, i], mag_mean_nonzero)
-			ratio_corr = np.where(ratio > 1, 2 - ratio, ratio)
-			ratio_corr_nonneg = np.where(ratio_corr < 0, 0, ratio_corr)
-			mag_weights[:, :, i] = ratio_corr_nonneg
+		if cell_mask is not None:
+			mag_max[~cell_mask] = np.nan
 
-		angle_masked = np.ma.masked_array(angle_stack, np.isnan(angle_stack))
-		angle_mean = np.ma.average(angle_masked, axis=2, weights=mag_weights)
+		if stack_path is not None:
+			# Release the memory maps before removing the files
+			del mag_stack
+			remove(stack_path)
 
-		if angle_func.__name__ == "bitwise_or":
-			angle_mean += angle_upper
-			angle_mean = np.where(angle_mean >= 360, angle_mean - 360, angle_mean)
+		angle_mean = unshift_angles(directions.mean(), angle_func, angle_upper)
+		del directions
 
 		np.savetxt(f'{results_folder}/diagnostics/T1.txt', T1_array, fmt='%.3f')
 		np.savetxt(f'{results_folder}/diagnostics/T2.txt', T2_array, fmt='%.3f')
 		np.savetxt(f'{results_folder}/diagnostics/T3.txt', T3_array, fmt='%.3f')
 
-		np.savetxt(f'{results_folder}/diagnostics/coverage.txt', coverage_list, fmt='%.3f')
-		np.savetxt(f'{results_folder}/diagnostics/disp_mean.txt', disp_mean_list, fmt='%.3f')
-		np.savetxt(f'{results_folder}/diagnostics/disp_median.txt', disp_median_list, fmt='%.3f')
-		np.savetxt(f'{results_folder}/diagnostics/disp_max.txt', disp_max_list, fmt='%.3f')
+		diagnostics_table.save(f'{results_folder}/diagnostics')
 
 		np.savetxt(f'{results_folder}/mag_mean.txt', mag_mean, fmt='%.3f')
 		np.savetxt(f'{results_folder}/mag_max.txt', mag_max, fmt='%.3f')
 		np.savetxt(f'{results_folder}/angle_mean.txt', angle_mean, fmt='%.3f')
 		np.savetxt(f'{results_folder}/threshold_ratios.txt', threshold_ratios, fmt='%.3f')
 
+		if multi_lag:
+			tag_print('info', 'Temporal filtering of additional velocity steps...')
+
+			lag_mag_means = {velocity_step: mag_mean}
+			lag_angle_means = {velocity_step: angle_mean}
+
+			save_lag_results(f'{results_folder}/steps/{velocity_step}', T1_array, T2_array, T3_array, threshold_ratios, mag_mean, angle_mean,
+							 diagnostics_table)
+
+			for lag, accumulator in accumulators.items():
+				*lag_results, lag_angle_mean = accumulator.filter()
+				lag_angle_mean = unshift_angles(lag_angle_mean, angle_func, angle_upper)
+
+				save_lag_results(f'{results_folder}/steps/{lag}', *lag_results, lag_angle_mean, accumulator.diagnostics)
+
+				lag_mag_means[lag] = lag_results[4]
+				lag_angle_means[lag] = lag_angle_mean
+
+			if merge_steps:
+				displacement_range = [float(x) for x in optimal_displacement.split(',')]
+				merged_mag, merged_angle, lag_map = merge_lags(lag_mag_means, lag_angle_means, velocity_step, displacement_range)
+
+				np.savetxt(f'{results_folder}/mag_mean.txt', merged_mag, fmt='%.3f')
+				np.savetxt(f'{results_folder}/angle_mean.txt', merged_angle, fmt='%.3f')
+				np.savetxt(f'{results_folder}/step_map.txt', lag_map, fmt='%.0f')
+
+				tag_print('info', f'Merged velocity steps, optimal displacement = {displacement_range[0]:.1f}-{displacement_range[1]:.1f} px')
+
+		# All results are saved, the interrupted run cannot be resumed anymore
+		checkpoint.remove()
+
 		if chain_start not in ['0, 0', ''] and chain_end not in ['0, 0', ''] and not args.quiet:
 			from profile_data import main as profile_data_main
 			profile_data_main(args.cfg, quiet=1)
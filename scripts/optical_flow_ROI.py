@@ -0,0 +1,182 @@
+"""
+This is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This package is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this package. If not, you can get eh GNU GPL from
+https://www.gnu.org/licenses/gpl-3.0.en.html.
+
+Created by Robert Ljubicic.
+"""
+
+try:
+	from __init__ import *
+	from class_console_printer import tag_print, unix_path
+	from utilities import cfg_get, exit_message, present_exception_and_exit
+	from flow_mask import polygon_to_str, str_to_polygon
+	from glob import glob
+
+	import matplotlib.pyplot as plt
+	import matplotlib.patches as patches
+
+except Exception as ex:
+	present_exception_and_exit('Import failed! For more information see traceback below. Please report this issue to the author:')
+
+
+def xy2str(points_list: list) -> str:
+	"""
+	Formats a display of the polygon vertices.
+	"""
+
+	s = f'Vertices = {len(points_list)}\n'
+
+	if len(points_list) >= 3:
+		x, y = np.array(points_list, dtype='float64').T
+		area = 0.5 * abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+		s += f'Mask area = {area/(img_rgb.shape[0]*img_rgb.shape[1])*100:.1f} % of frame\n'
+
+	s += 'Press ENTER/RETURN to accept mask'
+
+	return s
+
+
+def update_polygon():
+	global polygon
+
+	if polygon is not None:
+		polygon.remove()
+		polygon = None
+
+	img_shown = img_gray3.copy()
+
+	if len(points) >= 3:
+		mask = np.zeros(img_rgb.shape[:2], dtype='uint8')
+		cv2.fillPoly(mask, [np.array(points, dtype='int32')], 1)
+		img_shown[mask > 0] = img_rgb[mask > 0]
+
+		polygon = patches.Polygon(points, closed=True, linewidth=2, edgecolor='r', facecolor='none')
+		ax.add_patch(polygon)
+
+	plt_image.set_data(img_shown)
+	vertices.set_data([p[0] for p in points], [p[1] for p in points])
+	roi_box.set_text(xy2str(points) if len(points) > 0 else '')
+
+	plt.draw()
+
+
+def add_vertex(event):
+	if event.button == 3 and event.xdata is not None:
+		points.append([int(round(event.xdata)), int(round(event.ydata))])
+		update_polygon()
+
+
+def select_roi(event):
+	global cfg
+	global points
+
+	if event.key == 'backspace' and len(points) > 0:
+		points.pop()
+		update_polygon()
+
+	elif event.key == 'delete':
+		points = []
+		update_polygon()
+
+	elif event.key == 'enter':
+		if len(points) >= 3 or len(points) == 0:
+			section = 'Optical flow'
+
+			try:
+				cfg[section]['MaskPolygon'] = polygon_to_str(points)
+			except KeyError:
+				cfg.add_section(section)
+				cfg[section]['MaskPolygon'] = polygon_to_str(points)
+
+			with open(args.cfg, 'w', encoding='utf-8-sig') as configfile:
+				cfg.write(configfile)
+
+			plt.close()
+
+	return
+
+
+if __name__ == '__main__':
+	try:
+		parser = ArgumentParser()
+		parser.add_argument('--cfg', type=str, help='Path to config file')
+		args = parser.parse_args()
+
+		cfg = configparser.ConfigParser()
+		cfg.optionxform = str
+
+		try:
+			cfg.read(args.cfg, encoding='utf-8-sig')
+		except Exception:
+			tag_print('error', 'There was a problem reading the configuration file!')
+			tag_print('error', 'Check if project has valid configuration.')
+			exit_message()
+
+		section = 'Optical flow'
+
+		frames_path = unix_path(cfg_get(cfg, section, 'Folder', str))
+		ext = cfg_get(cfg, section, 'Extension', str, default='jpg')
+
+		points = str_to_polygon(cfg_get(cfg, section, 'MaskPolygon', str, default='')).astype(int).tolist()
+		polygon = None
+
+		img_list = glob(f'{frames_path}/*.{ext}')
+
+		img = cv2.imread(img_list[0])
+		img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+		img_gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+		img_gray3 = cv2.merge([img_gray, img_gray, img_gray])
+
+		fig, ax = plt.subplots()
+
+		plt_image = ax.imshow(img_rgb)
+		vertices, = ax.plot([], [], 'ro')
+		fig.canvas.mpl_connect('button_press_event', add_vertex)
+		fig.canvas.mpl_connect('key_press_event', select_roi)
+
+		legend = 'Right click to add polygon vertex.\n' \
+				 'BACKSPACE = remove last vertex\n' \
+				 'DELETE = remove all vertices\n' \
+				 'ENTER/RETURN = select mask (no vertices = no mask)\n' \
+				 'O = zoom to window\n' \
+				 'P = pan image'
+
+		roi_box = plt.text(0.01, 0.02, '',
+						   horizontalalignment='left',
+						   verticalalignment='bottom',
+						   transform=ax.transAxes,
+						   bbox=dict(facecolor='white', alpha=0.5),
+						   fontsize=9,
+						   )
+
+		plt.text(0.01, 0.98, legend,
+				 horizontalalignment='left',
+				 verticalalignment='top',
+				 transform=ax.transAxes,
+				 bbox=dict(facecolor='white', alpha=0.5),
+				 fontsize=9,
+				 )
+
+		try:
+			mng = plt.get_current_fig_manager()
+			mng.window.state('zoomed')
+			mng.set_window_title('Select water surface mask for optical flow')
+		except Exception:
+			pass
+
+		update_polygon()
+		plt.show()
+
+	except Exception as ex:
+		present_exception_and_exit()
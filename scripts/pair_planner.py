@@ -0,0 +1,176 @@
+"""
+This is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This package is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this package. If not, you can get eh GNU GPL from
+https://www.gnu.org/licenses/gpl-3.0.en.html.
+
+Created by Robert Ljubicic.
+"""
+
+try:
+	from __init__ import *
+	from utilities import present_exception_and_exit
+
+except Exception:
+	present_exception_and_exit('Import failed! For more information see traceback below. Please report this issue to the author:')
+
+
+PAIRING_STEPWISE = 0
+PAIRING_SLIDING = 1
+PAIRING_REFERENCE = 2
+
+
+def stepwise_pairs(num_frames: int, lag: int) -> tuple:
+	"""
+	Pairs (0, lag), (lag, 2*lag), ...
+	"""
+	a = np.arange(0, num_frames - lag, lag)
+	return a, a + lag
+
+
+def sliding_pairs(num_frames: int, lag: int) -> tuple:
+	"""
+	Pairs (0, lag), (1, lag + 1), ...
+	"""
+	a = np.arange(0, num_frames - lag)
+	return a, a + lag
+
+
+def reference_pairs(num_frames: int, lag: int) -> tuple:
+	"""
+	Pairs (0, lag), (0, 2*lag), ..., all with the first frame as frame A.
+	"""
+	b = np.arange(lag, num_frames, lag)
+	return np.zeros_like(b), b
+
+
+# Pairing schemes: Pairing option -> function (num_frames, lag) -> (indices of frames A, indices of frames B).
+# New schemes can be added here, the executors only use the resulting schedule.
+PAIRING_SCHEMES = {
+	PAIRING_STEPWISE: stepwise_pairs,
+	PAIRING_SLIDING: sliding_pairs,
+	PAIRING_REFERENCE: reference_pairs,
+}
+
+pairing_names = {
+	PAIRING_STEPWISE: 'stepwise',
+	PAIRING_SLIDING: 'sliding by 1',
+	PAIRING_REFERENCE: 'reference to first',
+}
+
+
+def plan_pairs(num_frames: int, lag: int, pairing: int) -> np.ndarray:
+	"""
+	Frame index pairs of a single lag, computed in linear time.
+
+	:param lag:		Velocity step [frames].
+	:param pairing:	Pairing scheme, see PAIRING_SCHEMES.
+	:return:		Int array of shape [num_pairs, 2] with rows (a, b) = indices of frames A and B.
+	"""
+	if pairing not in PAIRING_SCHEMES:
+		raise ValueError(f'Unknown pairing scheme {pairing}, available are {list(PAIRING_SCHEMES)}')
+
+	a, b = PAIRING_SCHEMES[pairing](num_frames, lag)
+
+	return np.stack([a, b], axis=1).astype('int64').reshape(-1, 2)
+
+
+def pair_schedule(pairs: np.ndarray, start=0) -> dict:
+	"""
+	Schedule of the frame reads for computing :pairs: from index :start: in order. Every frame is read once,
+	before the first pair which uses it, and kept in the cache until the last pair which uses it.
+
+	:param pairs:	Frame index pairs, see plan_pairs().
+	:param start:	Index of the first pair to compute.
+	:return:		Dictionary with 'pairs', 'cached' = bool array [num_pairs, 2], True where frame A or B is already in the cache,
+					'reads' = indices of the frames to read, in order, and 'releases' = dictionary pair index -> list of frames
+					which can be removed from the cache after that pair.
+	"""
+	pairs = np.asarray(pairs).reshape(-1, 2)
+	cached = np.zeros(pairs.shape, dtype=bool)
+	last_use = {}
+	reads = []
+
+	for i, pair in enumerate(pairs[start:].tolist(), start=start):
+		for j, frame in enumerate(pair):
+			if frame in last_use:
+				cached[i, j] = True
+			else:
+				reads.append(frame)
+
+			last_use[frame] = i
+
+	releases = {}
+
+	for frame, i in last_use.items():
+		releases.setdefault(i, []).append(frame)
+
+	return {'pairs': pairs, 'cached': cached, 'reads': np.array(reads, dtype='int64'), 'releases': releases}
+
+
+def plan_multi_lag(num_frames: int, lags: list, pairing: int, start=None) -> tuple:
+	"""
+	Schedule of a single pass over the frames which computes the pairs of all :lags:. Only the frames used by
+	some pair are read, every pair is computed when its frame B is read, and every frame is released when it
+	is no longer needed by any pair.
+
+	:param start:	Dictionary lag -> index of the first frame pair to compute (e.g. to resume), default is 0 for all lags.
+	:return:		Tuple (reads, pairs_ending, releases), where reads are the indices of the frames to read in order,
+					pairs_ending is a dictionary frame b -> list of (lag, k, a), with k = frame pair index within the lag,
+					and releases is a dictionary frame n -> list of frames which can be released after the pairs ending at frame n.
+	"""
+	start = {} if start is None else start
+	pairs_ending = {}
+	last_use = {}
+
+	for lag in lags:
+		for k, (a, b) in enumerate(plan_pairs(num_frames, lag, pairing).tolist()):
+			if k >= start.get(lag, 0):
+				pairs_ending.setdefault(b, []).append((lag, k, a))
+				last_use[a] = max(last_use.get(a, b), b)
+				last_use[b] = max(last_use.get(b, b), b)
+
+	releases = {}
+
+	for n, last in last_use.items():
+		releases.setdefault(last, []).append(n)
+
+	return sorted(last_use), pairs_ending, releases
+
+
+if __name__ == '__main__':
+	# Time against the previous list building with img_list.index()
+	from time import time
+
+	for num_frames in [1000, 10000, 30000]:
+		img_list = [f'frames/{i:06d}.jpg' for i in range(num_frames)]
+		step = 2
+
+		start = time()
+		paths_frame_A = img_list[:-step]
+		paths_frame_B = img_list[step:]
+		indices_frame_A = [img_list.index(x) for x in paths_frame_A]
+		indices_frame_B = [img_list.index(x) for x in paths_frame_B]
+		time_reference = time() - start
+
+		start = time()
+		pairs = plan_pairs(num_frames, step, PAIRING_SLIDING)
+		schedule = pair_schedule(pairs)
+		time_planner = time() - start
+
+		assert np.array_equal(pairs, np.array([indices_frame_A, indices_frame_B]).T)
+		print(f'{num_frames:6d} frames, sliding pairs: img_list.index() {time_reference:8.3f} sec, planner {time_planner:.4f} sec, '
+			  f'{schedule["reads"].size} reads for {pairs.shape[0]} pairs')
+
+	for pairing in PAIRING_SCHEMES:
+		schedule = pair_schedule(plan_pairs(10, 2, pairing))
+		print(f'Pairing {pairing} ({pairing_names[pairing]}): pairs {schedule["pairs"].tolist()}, reads {schedule["reads"].tolist()}')
@@ -0,0 +1,210 @@
+"""
+This is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This package is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this package. If not, you can get eh GNU GPL from
+https://www.gnu.org/licenses/gpl-3.0.en.html.
+
+Created by Robert Ljubicic.
+"""
+
+try:
+	from __init__ import *
+	from os import path, name as os_name
+	from CPP.dll_import import DLL_Loader
+	from utilities import present_exception_and_exit
+
+except Exception:
+	present_exception_and_exit('Import failed! For more information see traceback below. Please report this issue to the author:')
+
+
+# Compiled pooling library. On other platforms than Windows it can be built from cpp/pooling/ using:
+#     g++ -O3 -shared -fPIC -o scripts/CPP/pooling.so cpp/pooling/pooling.cpp
+POOLING_LIBRARY = 'CPP/pooling.dll' if os_name == 'nt' else 'CPP/pooling.so'
+
+
+def temporal_pooling_numpy(array: np.ndarray, size: int, m: float) -> float:
+	"""
+	Portable version of temporal_pooling() from the pooling library, same arguments.
+	Mean of the first :size: values of :array: which are >= :m:. If :m: < 0, the mean of all values is used instead.
+	"""
+	values = array[:size]
+	mean = values.mean(dtype='float64') if m < 0 else m
+	valid = values[values >= mean]
+
+	with np.errstate(divide='ignore', invalid='ignore'):
+		return valid.sum(dtype='float64') / valid.size
+
+
+def spatial_pooling_numpy(array_mag: np.ndarray, array_dir: np.ndarray, pooled_mag: np.ndarray, pooled_dir: np.ndarray,
+						  rows: int, cols: int, pooling: int):
+	"""
+	Portable version of spatial_pooling() from the pooling library, same arguments.
+	Frame of shape [rows, cols] is split into centered blocks of :pooling: x :pooling: px. For every block, the pooled magnitude
+	is the mean of the magnitudes >= the block mean, and the pooled direction is the mean of the directions of the same vectors
+	with NaN directions skipped (NaN if none are left). Results are written to :pooled_mag: and :pooled_dir:.
+
+	:param array_mag:	Flattened float32 magnitudes of size rows*cols.
+	:param array_dir:	Flattened float32 directions of size rows*cols.
+	:param pooled_mag:	Float32 output of size (rows//pooling)*(cols//pooling).
+	:param pooled_dir:	Float32 output of size (rows//pooling)*(cols//pooling).
+	"""
+	rows_pooled = rows // pooling
+	cols_pooled = cols // pooling
+	row_offset = (rows % pooling) // 2
+	col_offset = (cols % pooling) // 2
+
+	def blocks(array):
+		frame = array.reshape(rows, cols)[row_offset: row_offset + rows_pooled*pooling, col_offset: col_offset + cols_pooled*pooling]
+		return frame.reshape(rows_pooled, pooling, cols_pooled, pooling)
+
+	mag = blocks(array_mag)
+	ang = blocks(array_dir)
+
+	mean = mag.sum(axis=(1, 3), dtype='float64') / (pooling * pooling)
+	selected = mag >= mean[:, np.newaxis, :, np.newaxis]
+	selected_dir = selected & ~np.isnan(ang)
+
+	count = np.count_nonzero(selected, axis=(1, 3))
+	count_dir = np.count_nonzero(selected_dir, axis=(1, 3))
+	total = np.where(selected, mag, 0).sum(axis=(1, 3), dtype='float64')
+	total_dir = np.where(selected_dir, ang, 0).sum(axis=(1, 3), dtype='float64')
+
+	with np.errstate(divide='ignore', invalid='ignore'):
+		pooled_mag.reshape(rows_pooled, cols_pooled)[:] = np.where(count > 0, total / count, 0)
+		pooled_dir.reshape(rows_pooled, cols_pooled)[:] = total_dir / count_dir
+
+
+def load_pooling_library(dll_name=POOLING_LIBRARY) -> tuple:
+	"""
+	Loads spatial_pooling() and temporal_pooling() from the compiled pooling library.
+
+	:return:	Tuple (spatial_pooling, temporal_pooling), or None if the library is missing or cannot be loaded.
+	"""
+	dll_path = path.split(path.realpath(__file__))[0]
+
+	if not path.exists(path.join(dll_path, dll_name)):
+		return None
+
+	try:
+		dll_loader = DLL_Loader(dll_path, dll_name)
+
+		# void spatial_pooling(float* array_mag, float* array_dir, float* pooled_mag, float* pooled_dir, int rows, int cols, int pooling);
+		spatial = dll_loader.get_function('void', 'spatial_pooling', ['float*', 'float*', 'float*', 'float*', 'int', 'int', 'int'])
+
+		# double temporal_pooling(float* array, size_t size, double m);
+		temporal = dll_loader.get_function('double', 'temporal_pooling', ['float*', 'size_t', 'double'])
+
+		return spatial, temporal
+
+	except (OSError, AttributeError):
+		return None
+
+
+# Compiled kernels are used if available, otherwise the portable ones
+pooling_library = load_pooling_library()
+
+if pooling_library is not None:
+	spatial_pooling, temporal_pooling = pooling_library
+	pooling_backend = POOLING_LIBRARY
+else:
+	spatial_pooling, temporal_pooling = spatial_pooling_numpy, temporal_pooling_numpy
+	pooling_backend = 'numpy'
+
+
+if __name__ == '__main__':
+	# Parity of the portable and the compiled kernels against a per-block reference
+	from time import time
+	from class_console_printer import tag_print
+
+	def spatial_pooling_reference(mag, ang, pooling):
+		rows, cols = mag.shape
+		row_offset = (rows % pooling) // 2
+		col_offset = (cols % pooling) // 2
+		pooled_mag = np.zeros([rows // pooling, cols // pooling], dtype='float32')
+		pooled_dir = np.zeros([rows // pooling, cols // pooling], dtype='float32')
+
+		for i in range(rows // pooling):
+			for j in range(cols // pooling):
+				r = row_offset + i*pooling
+				c = col_offset + j*pooling
+				block_mag = mag[r: r + pooling, c: c + pooling].ravel()
+				block_dir = ang[r: r + pooling, c: c + pooling].ravel()
+
+				selected = block_mag >= block_mag.sum(dtype='float64') / block_mag.size
+				pooled_mag[i, j] = block_mag[selected].sum(dtype='float64') / np.count_nonzero(selected) if selected.any() else 0
+				pooled_dir[i, j] = np.nanmean(block_dir[selected].astype('float64')) if np.isfinite(block_dir[selected]).any() else np.nan
+
+		return pooled_mag, pooled_dir
+
+	def realistic_flow(rows, cols, rng):
+		# Rejected vectors have zero magnitude and NaN direction, as after Flow_postprocessor.process()
+		mag = rng.gamma(2.0, 1.5, size=(rows, cols)).astype('float32')
+		ang = rng.uniform(0, 360, size=(rows, cols)).astype('float32')
+		rejected = rng.random((rows, cols)) < 0.3
+		mag[rejected] = 0
+		ang[rejected] = np.nan
+		mag[:rows//8, :cols//8] = 0
+		ang[:rows//8, :cols//8] = np.nan
+		return mag, ang
+
+	rng = np.random.default_rng(0)
+	backends = [('numpy', spatial_pooling_numpy, temporal_pooling_numpy)]
+
+	if pooling_library is not None:
+		backends.append((POOLING_LIBRARY, *pooling_library))
+	else:
+		tag_print('warning', f'{POOLING_LIBRARY} not found, only the portable kernels are tested')
+
+	passed = True
+
+	for rows, cols, pooling in [(64, 64, 8), (101, 77, 8), (270, 480, 16), (33, 50, 5), (16, 16, 16)]:
+		mag, ang = realistic_flow(rows, cols, rng)
+		ref_mag, ref_dir = spatial_pooling_reference(mag, ang, pooling)
+
+		for name, spatial, _ in backends:
+			pooled_mag = np.empty(ref_mag.size, dtype='float32')
+			pooled_dir = np.empty(ref_dir.size, dtype='float32')
+			spatial(mag.ravel(), ang.ravel(), pooled_mag, pooled_dir, rows, cols, pooling)
+
+			diff_mag = np.max(np.abs(pooled_mag - ref_mag.ravel()))
+			diff_dir = np.nanmax(np.abs(pooled_dir - ref_dir.ravel()))
+			same_nan = np.array_equal(np.isnan(pooled_dir), np.isnan(ref_dir.ravel()))
+			ok = diff_mag < 1e-5 and diff_dir < 1e-3 and same_nan
+			passed &= ok
+
+			tag_print('info' if ok else 'error', f'spatial_pooling  [{name:>15s}] {rows}x{cols}/{pooling}: '
+												 f'max. abs. difference magnitude = {diff_mag:.2e}, direction = {diff_dir:.2e}, same NaN = {same_nan}')
+
+	for m in [-1.0, 0.0, 2.5, 100.0]:
+		array = rng.gamma(2.0, 1.0, size=1000).astype('float32')
+		mean = array.mean(dtype='float64') if m < 0 else m
+		expected = array[array >= mean].mean(dtype='float64') if (array >= mean).any() else np.nan
+
+		for name, _, temporal in backends:
+			result = temporal(array, array.size, m)
+			ok = (np.isnan(expected) and np.isnan(result)) or abs(result - expected) < 1e-9
+			passed &= ok
+
+			tag_print('info' if ok else 'error', f'temporal_pooling [{name:>15s}] m = {m:6.1f}: {result:.6f} (reference {expected:.6f})')
+
+	rows, cols, pooling = 1080, 1920, 16
+	mag, ang = realistic_flow(rows, cols, rng)
+	pooled_mag = np.empty((rows // pooling) * (cols // pooling), dtype='float32')
+	pooled_dir = np.empty_like(pooled_mag)
+
+	for name, spatial, _ in backends:
+		start = time()
+		for _ in range(20):
+			spatial(mag.ravel(), ang.ravel(), pooled_mag, pooled_dir, rows, cols, pooling)
+		tag_print('info', f'spatial_pooling  [{name:>15s}] {rows}x{cols}/{pooling}: {(time() - start) / 20 * 1000:.1f} ms')
+
+	tag_print('success' if passed else 'error', 'All parity checks passed' if passed else 'Parity checks failed')
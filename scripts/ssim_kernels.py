@@ -0,0 +1,325 @@
+"""
+This is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This package is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this package. If not, you can get eh GNU GPL from
+https://www.gnu.org/licenses/gpl-3.0.en.html.
+
+Created by Robert Ljubicic.
+"""
+
+try:
+	from __init__ import *
+	from os import path
+	from numpy.lib.stride_tricks import sliding_window_view
+	from CPP.dll_import import DLL_Loader
+	from utilities import present_exception_and_exit
+
+except Exception:
+	present_exception_and_exit('Import failed! For more information see traceback below. Please report this issue to the author:')
+
+
+# SSIM constants, same as SSIM_Byte() in CPP/ssim.dll
+SSIM_K1 = 0.01
+SSIM_K2 = 0.03
+SSIM_WINDOW = 7
+
+# Compiled SSIM library, only available on Windows
+SSIM_LIBRARY = 'CPP/ssim.dll'
+
+# Working memory of ssim_map() [bytes], subareas are scored in blocks of rows which fit into it
+SSIM_MAP_MEMORY = 8 * 2**20
+
+
+def window_sums(image: np.ndarray, win_size: int) -> np.ndarray:
+	"""
+	Sums over all :win_size: x :win_size: windows of a 2D float32 :image:, only the windows inside the image.
+
+	:return:	Array of shape [h - win_size + 1, w - win_size + 1].
+	"""
+	half = win_size // 2
+	sums = cv2.boxFilter(image, -1, (win_size, win_size), normalize=False, borderType=cv2.BORDER_CONSTANT)
+
+	return sums[half: image.shape[0] - half, half: image.shape[1] - half]
+
+
+def window_statistics(image: np.ndarray, win_size: int) -> tuple:
+	"""
+	Means and unbiased variances of all :win_size: x :win_size: windows of a 2D float32 :image:, see window_sums().
+	"""
+	n = win_size * win_size
+	mean = window_sums(image, win_size) / n
+	var = (window_sums(image * image, win_size) / n - mean * mean) * (n / (n - 1))
+
+	return mean, var
+
+
+def ssim_byte_numpy(pDataX: np.ndarray, pDataY: np.ndarray, step: int, width: int, height: int, win_size: int, maxVal: int) -> float:
+	"""
+	Portable version of SSIM_Byte() from CPP/ssim.dll, same arguments. Mean SSIM of two equally sized uint8 images over all
+	:win_size: x :win_size: windows inside the images, with a uniform weighting and unbiased variances. Multichannel images are
+	interleaved with step // width channels, every channel of every window is scored and the mean of all scores is returned.
+	Scores are computed in float32 as in the library.
+
+	:param pDataX:		Flattened uint8 image X of size step*height.
+	:param pDataY:		Flattened uint8 image Y of size step*height.
+	:param step:		Row size [bytes].
+	:param width:		Image width [px].
+	:param height:		Image height [px].
+	:param win_size:	Odd window size [px].
+	:param maxVal:		Dynamic range of the values, 255 for uint8.
+	:return:			Mean SSIM, NaN if the images are smaller than the window.
+	"""
+	channels = step // width
+	c1 = np.float32((SSIM_K1 * maxVal) ** 2)
+	c2 = np.float32((SSIM_K2 * maxVal) ** 2)
+	n = win_size * win_size
+
+	if width < win_size or height < win_size:
+		return float('nan')
+
+	x = pDataX[:step * height].reshape(height, step)[:, :width * channels].reshape(height, width, channels).astype('float32')
+	y = pDataY[:step * height].reshape(height, step)[:, :width * channels].reshape(height, width, channels).astype('float32')
+	scores = []
+
+	for c in range(channels):
+		xc = np.ascontiguousarray(x[:, :, c])
+		yc = np.ascontiguousarray(y[:, :, c])
+
+		mu_x, var_x = window_statistics(xc, win_size)
+		mu_y, var_y = window_statistics(yc, win_size)
+		covariance = (window_sums(xc * yc, win_size) / n - mu_x * mu_y) * (n / (n - 1))
+
+		scores.append(((2 * mu_x * mu_y + c1) * (2 * covariance + c2)) / ((mu_x * mu_x + mu_y * mu_y + c1) * (var_x + var_y + c2)))
+
+	# Row sums in float32 accumulated in float64, as in the library
+	scores = np.stack(scores, axis=-1).astype('float32')
+
+	return float(np.float32(scores.reshape(scores.shape[0], -1).sum(axis=1).sum(dtype='float64') / scores.size))
+
+
+def load_ssim_library(dll_name=SSIM_LIBRARY):
+	"""
+	Loads SSIM_Byte() from the compiled SSIM library.
+
+	:return:	Function SSIM_Byte(), or None if the library is missing or cannot be loaded (e.g. on other platforms than Windows).
+	"""
+	dll_path = path.split(path.realpath(__file__))[0]
+
+	if not path.exists(path.join(dll_path, dll_name)):
+		return None
+
+	try:
+		dll_loader = DLL_Loader(dll_path, dll_name)
+
+		# float SSIM_Byte(Byte* pDataX, Byte* pDataY, int step, int width, int height, int win_size, int maxVal);
+		return dll_loader.get_function('float', 'SSIM_Byte', ['byte*', 'byte*', 'int', 'int', 'int', 'int', 'int'])
+
+	except (OSError, AttributeError):
+		return None
+
+
+# Compiled SSIM_Byte() is used if available, otherwise the portable one
+ssim_library = load_ssim_library()
+
+if ssim_library is not None:
+	ssim_byte = ssim_library
+	ssim_backend = SSIM_LIBRARY
+else:
+	ssim_byte = ssim_byte_numpy
+	ssim_backend = 'numpy'
+
+
+def ssim_map(search_area: np.ndarray, kernel: np.ndarray, win_size=SSIM_WINDOW, max_val=255, max_memory=SSIM_MAP_MEMORY) -> np.ndarray:
+	"""
+	SSIM of :kernel: against every kernel-sized subarea of :search_area:, computed at once. Every score is the same as
+	SSIM_Byte(subarea, kernel, ...) from CPP/ssim.dll, i.e. the mean SSIM over all :win_size: x :win_size: windows
+	with a uniform weighting and unbiased variances. Window means and variances of the search area and of the kernel
+	are computed once, and the covariances of all subareas from a single box filter over the stacked products.
+	Subareas are scored in blocks of rows, so that the working arrays take about :max_memory: bytes at most.
+
+	:param search_area:	Grayscale uint8 image [H, W].
+	:param kernel:		Grayscale uint8 kernel [k, k].
+	:param max_memory:	Working memory [bytes], at least one row of subareas is scored at a time.
+	:return:			Float64 array [H - k + 1, W - k + 1], where element [r, c] is the score of the subarea with top-left corner [r, c].
+	"""
+	k_rows, k_cols = kernel.shape
+	half = win_size // 2
+	n = win_size * win_size
+	c1 = (SSIM_K1 * max_val) ** 2
+	c2 = (SSIM_K2 * max_val) ** 2
+
+	# Products of uint8 values and their window sums are exact in float32
+	x = search_area.astype('float32')
+	y = kernel.astype('float32')
+
+	mu_x, var_x = window_statistics(x, win_size)
+	mu_y, var_y = window_statistics(y, win_size)
+
+	# Terms of the search area for every subarea, shape [H - k + 1, W - k + 1, k - win_size + 1, k - win_size + 1], as views
+	window_shape = (k_rows - 2*half, k_cols - 2*half)
+	luminance_x = sliding_window_view((mu_x * mu_x + c1).astype('float32'), window_shape)
+	contrast_x = sliding_window_view((var_x + c2).astype('float32'), window_shape)
+	mu_x = sliding_window_view(mu_x.astype('float32'), window_shape)
+	luminance_y = (mu_y * mu_y).astype('float32')
+	var_y = var_y.astype('float32')
+	mu_y = mu_y.astype('float32')
+
+	rows, cols = luminance_x.shape[:2]
+	scores = np.empty([rows, cols])
+
+	# Products and their box filter, and three arrays of the window terms per row of subareas
+	row_memory = 4 * cols * (2 * k_rows * k_cols + 3 * window_shape[0] * window_shape[1])
+	block_rows = int(max(1, min(rows, max_memory // row_memory)))
+
+	for r0 in range(0, rows, block_rows):
+		r1 = min(r0 + block_rows, rows)
+
+		# Products of every subarea with the kernel, stacked vertically. Windows which cross two subareas are dropped.
+		products = sliding_window_view(x[r0: r1 + k_rows - 1], (k_rows, k_cols)) * y
+		sxy = cv2.boxFilter(products.reshape(-1, k_cols), -1, (win_size, win_size), normalize=False, borderType=cv2.BORDER_CONSTANT)
+		sxy = sxy.reshape(r1 - r0, cols, k_rows, k_cols)[:, :, half: k_rows - half, half: k_cols - half]
+		del products
+
+		# Operations are done in place, the arrays of this shape are the bulk of the work
+		mu_xy = mu_x[r0: r1] * mu_y
+		numerator = mu_xy * np.float32(2) + np.float32(c1)
+
+		covariance = sxy * np.float32(2 / (n - 1))
+		del sxy
+		mu_xy *= np.float32(2 * n / (n - 1))
+		covariance -= mu_xy
+		covariance += np.float32(c2)
+		numerator *= covariance
+
+		denominator = np.add(luminance_x[r0: r1], luminance_y, out=mu_xy)
+		denominator *= np.add(contrast_x[r0: r1], var_y, out=covariance)
+		numerator /= denominator
+
+		scores[r0: r1] = numerator.mean(axis=(-2, -1), dtype='float64')
+
+	return scores
+
+
+if __name__ == '__main__':
+	# Parity of ssim_byte() against SSIM_Byte() from the library, then time and parity of ssim_map() against one SSIM per subarea.
+	# Where the library loads (Windows), its scores are also saved as reference data for the platforms where it does not.
+	from time import time
+	from itertools import product
+	from class_console_printer import tag_print
+
+	reference_data = path.join(path.split(path.realpath(__file__))[0], 'CPP/ssim_reference.npz')
+
+	def ssim_byte_reference(x, y, win_size=SSIM_WINDOW, max_val=255):
+		# Direct mean SSIM over the windows of two equally sized uint8 images, channels in the last axis
+		c1 = (SSIM_K1 * max_val) ** 2
+		c2 = (SSIM_K2 * max_val) ** 2
+		n = win_size * win_size
+		scores = []
+		x = x.reshape(x.shape[0], x.shape[1], -1)
+		y = y.reshape(y.shape[0], y.shape[1], -1)
+
+		for r, c, ch in product(range(x.shape[0] - win_size + 1), range(x.shape[1] - win_size + 1), range(x.shape[2])):
+			wx = x[r: r + win_size, c: c + win_size, ch].astype('float64')
+			wy = y[r: r + win_size, c: c + win_size, ch].astype('float64')
+			mu_x, mu_y = wx.mean(), wy.mean()
+			var_x, var_y = wx.var() * n / (n - 1), wy.var() * n / (n - 1)
+			cov = ((wx - mu_x) * (wy - mu_y)).sum() / (n - 1)
+			scores.append(((2*mu_x*mu_y + c1) * (2*cov + c2)) / ((mu_x**2 + mu_y**2 + c1) * (var_x + var_y + c2)))
+
+		return np.mean(scores)
+
+	def ssim_byte_cases(rng):
+		# Pairs of similar images as in find_gcp(): (x, y), grayscale and interleaved BGR
+		cases = []
+
+		for h, w, channels in [(11, 11, 1), (21, 21, 1), (31, 31, 1), (15, 40, 1), (7, 7, 1), (21, 21, 3)]:
+			x = cv2.GaussianBlur((rng.random((h + 4, w + 4, channels)) * 255).astype('uint8'), (5, 5), 1.2)[2:-2, 2:-2]
+			x = x.reshape(h, w, channels)
+			y = np.clip(x.astype('int16') + rng.integers(-20, 21, x.shape), 0, 255).astype('uint8')
+			cases.append((x, y))
+
+		return cases
+
+	def call(function, x, y):
+		h, w = x.shape[:2]
+		return function(np.ascontiguousarray(x).ravel(), np.ascontiguousarray(y).ravel(), x[0].size, w, h, SSIM_WINDOW, 255)
+
+	rng = np.random.default_rng(0)
+	cases = ssim_byte_cases(rng)
+	passed = True
+
+	if ssim_library is not None:
+		library_scores = np.array([call(ssim_library, x, y) for x, y in cases])
+		np.savez(reference_data, scores=library_scores, **{f'x{k}': x for k, (x, _) in enumerate(cases)},
+				 **{f'y{k}': y for k, (_, y) in enumerate(cases)})
+		tag_print('info', f'Reference scores of {SSIM_LIBRARY} saved to {reference_data}')
+	elif path.exists(reference_data):
+		data = np.load(reference_data)
+		library_scores = data['scores']
+		cases = [(data[f'x{k}'], data[f'y{k}']) for k in range(library_scores.size)]
+		tag_print('info', f'{SSIM_LIBRARY} cannot be loaded, using the reference scores from {reference_data}')
+	else:
+		library_scores = None
+		tag_print('warning', f'{SSIM_LIBRARY} cannot be loaded and {reference_data} not found, only the per-window reference is used')
+
+	for k, (x, y) in enumerate(cases):
+		score = call(ssim_byte_numpy, x, y)
+		reference = ssim_byte_reference(x, y)
+		diff = abs(score - reference)
+
+		if library_scores is not None:
+			diff = max(diff, abs(score - library_scores[k]))
+
+		ok = diff < 1e-5
+		passed &= ok
+		tag_print('info' if ok else 'error', f'ssim_byte [{ssim_backend:>12s}] {x.shape[0]}x{x.shape[1]}x{x[0, 0].size}: {score:.6f}, '
+											 f'max. abs. difference = {diff:.2e}')
+
+	x, y = cases[2]
+	repeats = 200
+	for name, function in [('numpy', ssim_byte_numpy)] + ([(SSIM_LIBRARY, ssim_library)] if ssim_library is not None else []):
+		start = time()
+		for _ in range(repeats):
+			call(function, x, y)
+		tag_print('info', f'ssim_byte [{name:>12s}] {x.shape[0]}x{x.shape[1]}: {(time() - start) / repeats * 1000:.3f} ms')
+
+	frame = cv2.GaussianBlur((rng.random((600, 600)) * 255).astype('uint8'), (5, 5), 1.2)
+
+	for search_size, k_size in [(21, 11), (41, 21), (61, 31), (243, 31)]:
+		center = 300
+		search_area = cv2.getRectSubPix(frame, (search_size, search_size), (center, center))
+		kernel = cv2.getRectSubPix(frame, (k_size, k_size), (center + 2, center - 3))
+		padding = k_size // 2
+		search_range = range(padding, search_size - padding)
+
+		start = time()
+		reference = np.zeros([search_size, search_size])
+		for i, j in product(search_range, search_range):
+			subarea = cv2.getRectSubPix(search_area, (k_size, k_size), (i, j))
+			reference[j, i] = call(ssim_byte, subarea, kernel)
+		time_reference = time() - start
+
+		start = time()
+		repeats = 20
+		for _ in range(repeats):
+			scores = ssim_map(search_area, kernel)
+		time_map = (time() - start) / repeats
+
+		diff = np.max(np.abs(scores - reference[padding: search_size - padding, padding: search_size - padding]))
+		peak = np.unravel_index(np.argmax(scores), scores.shape)
+		offset = (peak[1] - scores.shape[1] // 2, peak[0] - scores.shape[0] // 2)
+		passed &= diff < 1e-5
+		tag_print('info' if diff < 1e-5 else 'error', f'SA {search_size}, IA {k_size}: per subarea ssim_byte {time_reference * 1000:8.1f} ms, '
+													  f'ssim_map {time_map * 1000:6.2f} ms, max. abs. difference = {diff:.2e}, '
+													  f'peak offset = ({offset[0]}, {offset[1]}) px')
+
+	tag_print('success' if passed else 'error', 'All parity checks passed' if passed else 'Parity checks failed')
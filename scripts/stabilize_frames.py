@@ -26,6 +26,7 @@ try:
 	from math import log
 	from glob import glob
 	from class_console_printer import Console_printer, tag_string, tag_print, unix_path
+	from class_frame_reader import Frame_reader
 	from class_progress_bar import Progress_bar
 	from class_logger import time_hms
 	from class_timing import Timer, time_hms
@@ -371,13 +372,11 @@ if __name__ == '__main__':
 		else:
 			M_ortho = None
 
-		i = 0
-
 		console_printer = Console_printer()
 		progress_bar = Progress_bar(total=num_frames, prefix=tag_string('info', 'Stabilized frame '))
 		timer = Timer(total_iter=num_frames)
 
-		while True:
+		for i, img in enumerate(Frame_reader(raw_frames_list, grayscale=False)):
 			try:
 				start_time = time()
 
@@ -386,9 +385,6 @@ if __name__ == '__main__':
 				else:
 					features = anchors
 
-				img_path = raw_frames_list[i]
-				img = cv2.imread(img_path)
-
 				stabilized, M, status = coordTransform(img, features, anchors, width=w, height=h,
 														method=methods[stabilization_method] if moving_camera else None,
 														M_ortho=M_ortho,
@@ -435,8 +431,6 @@ if __name__ == '__main__':
 
 				console_printer.overwrite()
 
-				i += 1
-
 			except (IOError, IndexError):
 				break
 
@@ -0,0 +1,201 @@
+"""
+This is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This package is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this package. If not, you can get eh GNU GPL from
+https://www.gnu.org/licenses/gpl-3.0.en.html.
+
+Created by Robert Ljubicic.
+"""
+
+try:
+	from __init__ import *
+	from vel_ratio import threshold_ratio_array, vel_ratio_array
+	from utilities import present_exception_and_exit
+
+except Exception as ex:
+	present_exception_and_exit('Import failed! For more information see traceback below. Please report this issue to the author:')
+
+
+# Max. number of stack values processed at once, keeps the temporaries at ~100 MB
+CHUNK_SIZE = 2**22
+
+# Approx. working memory per stack value during filtering, including the temporaries [bytes]
+BYTES_PER_VALUE = 32
+
+
+def chunk_rows(shape: tuple, chunk_size=CHUNK_SIZE) -> int:
+	"""
+	Number of stack rows which fit into a single chunk of :chunk_size: values.
+	"""
+	return max(1, chunk_size // max(1, shape[1] * shape[2]))
+
+
+def memory_chunk_size(memory_limit: float) -> int:
+	"""
+	Number of stack values which can be processed at once within :memory_limit: [MB].
+	"""
+	return max(1, int(memory_limit * 2**20) // BYTES_PER_VALUE)
+
+
+def time_chunk(shape: tuple, memory_limit: float, bytes_per_value=4) -> int:
+	"""
+	Number of frame pairs written to memory-mapped stacks between two flushes to disk.
+
+	:param shape:			Stack shape [rows, cols, frame pairs].
+	:param memory_limit:	Memory limit [MB].
+	:param bytes_per_value:	Bytes per cell and frame pair over all stacks. Default is 4 (float32 magnitudes).
+	:return:				Number of frame pairs.
+	"""
+	frame_bytes = max(1, shape[0] * shape[1] * bytes_per_value)
+	return int(np.clip(int(memory_limit * 2**20) // 2 // frame_bytes, 1, shape[2]))
+
+
+def create_stack(shape: tuple, dtype='float32', filename=None, mode='w+') -> np.ndarray:
+	"""
+	Allocates a stack of shape [rows, cols, frame pairs], either in RAM or as a memory-mapped .npy file.
+	Memory-mapped stacks are stored frame-major so that writing a single frame pair to disk is contiguous.
+
+	:param shape:		Stack shape [rows, cols, frame pairs].
+	:param dtype:		Data type. Default is float32.
+	:param filename:	Path to the .npy file. If None, the stack is kept in RAM.
+	:param mode:		Mode of the memory-mapped file, 'w+' creates a new one, 'r+' opens an existing one (e.g. to resume).
+	:return:			Array (or memmap view) of shape [rows, cols, frame pairs].
+	"""
+	if filename is None:
+		return np.zeros(shape, dtype=dtype)
+
+	stack = np.lib.format.open_memmap(filename, mode=mode, dtype=dtype, shape=(shape[2], shape[0], shape[1]))
+
+	return stack.transpose(1, 2, 0)
+
+
+def threshold_mean(stack: np.ndarray, threshold: np.ndarray) -> np.ndarray:
+	"""
+	Mean of the values along the last axis which are >= :threshold:, evaluated for all cells at once.
+	Equivalent to calling temporal_pooling() from CPP/pooling.dll for every cell.
+
+	:param stack:		Array of shape [rows, cols, time].
+	:param threshold:	Array of shape [rows, cols].
+	:return:			Array of shape [rows, cols], float64.
+	"""
+	mask = stack >= threshold[..., np.newaxis]
+	count = np.count_nonzero(mask, axis=-1)
+	total = np.where(mask, stack, 0).sum(axis=-1, dtype='float64')
+
+	with np.errstate(divide='ignore', invalid='ignore'):
+		return total / count
+
+
+def threshold_means(stack: np.ndarray) -> tuple:
+	"""
+	Threshold means T1, T2 and T3 along the last axis:
+		T1 = threshold is the global mean (T0), average the rest
+		T2 = threshold is T1, average the rest
+		T3 = threshold is T2, average the rest
+
+	:param stack:	Array of shape [rows, cols, time].
+	:return:		Tuple (T1, T2, T3) of float64 arrays of shape [rows, cols].
+	"""
+	T0 = stack.mean(axis=-1, dtype='float64')
+	T1 = threshold_mean(stack, T0)
+	T2 = threshold_mean(stack, T1)
+	T3 = threshold_mean(stack, T2)
+
+	return T1, T2, T3
+
+
+def temporal_filtering(mag_stack: np.ndarray, rows=None, callback=None, mask=None) -> tuple:
+	"""
+	Temporal filtering of the whole magnitude stack, processed in chunks of rows.
+
+	:param mag_stack:	Pooled magnitudes of shape [rows, cols, frame pairs].
+	:param rows:		Number of rows per chunk. Default is given by chunk_rows().
+	:param callback:	Function called with the number of processed rows after each chunk.
+	:param mask:		Boolean array of shape [rows, cols]. If given, only these cells are filtered, the rest are NaN.
+	:return:			Tuple (T1, T2, T3, threshold_ratios, mag_mean) of float32 arrays.
+	"""
+	shape = mag_stack.shape[:2]
+	rows = chunk_rows(mag_stack.shape) if rows is None else rows
+	fill = 0 if mask is None else np.nan
+
+	T1_array = np.full(shape, fill, dtype='float32')
+	T2_array = np.full(shape, fill, dtype='float32')
+	T3_array = np.full(shape, fill, dtype='float32')
+	threshold_ratios = np.full(shape, fill, dtype='float32')
+	mag_mean = np.full(shape, fill, dtype='float32')
+
+	for r in range(0, shape[0], rows):
+		chunk = slice(r, min(r + rows, shape[0]))
+		cells = np.s_[:, :] if mask is None else mask[chunk]
+		T1, T2, T3 = threshold_means(np.ascontiguousarray(mag_stack[chunk])[cells])
+
+		T1_array[chunk][cells] = T1
+		T2_array[chunk][cells] = T2
+		T3_array[chunk][cells] = T3
+
+		# Final velocity:
+		#     close to T1 if signal too noisy, likely not water surface,
+		#     close to T2 for dense seeding,
+		#     close to T3 if sparse seeding
+		threshold_ratios[chunk][cells] = threshold_ratio_array(T1, T2, T3)
+		mag_mean[chunk][cells] = vel_ratio_array(T1, T2, T3)
+
+		if callback is not None:
+			callback(chunk.stop)
+
+	return T1_array, T2_array, T3_array, threshold_ratios, mag_mean
+
+
+if __name__ == '__main__':
+	# Benchmark against the per-cell loop previously used in optical_flow.py
+	from time import time
+	from class_console_printer import tag_print
+	from vel_ratio import vel_ratio, L1
+
+	def temporal_pooling(mags: np.ndarray, m: float) -> float:
+		mean = mags.mean(dtype='float64') if m < 0 else m
+		valid = mags[mags >= mean]
+		return valid.sum(dtype='float64') / valid.size
+
+	rng = np.random.default_rng(0)
+	stack = rng.gamma(2.0, 1.0, size=(90, 160, 300)).astype('float32')
+
+	tag_print('info', f'Stack shape = {stack.shape}')
+
+	start = time()
+	loop_results = [np.zeros(stack.shape[:2], dtype='float32') for _ in range(5)]
+
+	for i in range(stack.shape[0]):
+		for j in range(stack.shape[1]):
+			mags_xy = stack[i, j, :]
+			T1 = temporal_pooling(mags_xy, -1.0)
+			T2 = temporal_pooling(mags_xy, T1)
+			T3 = temporal_pooling(mags_xy, T2)
+
+			loop_results[0][i, j] = T1
+			loop_results[1][i, j] = T2
+			loop_results[2][i, j] = T3
+			loop_results[3][i, j] = (T3 - T2)/(T2 - T1) if T2 != T1 else L1
+			loop_results[4][i, j] = vel_ratio(T1, T2, T3)
+
+	time_loop = time() - start
+
+	start = time()
+	batch_results = temporal_filtering(stack)
+	time_batch = time() - start
+
+	max_diff = max(np.nanmax(np.abs(a - b)) for a, b in zip(loop_results, batch_results))
+
+	tag_print('info', f'Per-cell loop = {time_loop:.3f} sec')
+	tag_print('info', f'Batched       = {time_batch:.3f} sec')
+	tag_print('info', f'Speedup       = {time_loop / time_batch:.1f}x')
+	tag_print('info', f'Max. abs. difference = {max_diff:.2e}')
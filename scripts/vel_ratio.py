@@ -16,6 +16,8 @@ https://www.gnu.org/licenses/gpl-3.0.en.html.
 Created by Robert Ljubicic.
 """
 
+import numpy as np
+
 
 L1 = 1.00
 L2 = 0.67
@@ -78,6 +80,28 @@ def vel_ratio(t1, t2, t3):
     return c1 * t1 + c2 * t2 + c3 * t3
 
 
+def threshold_ratio_array(t1: np.ndarray, t2: np.ndarray, t3: np.ndarray) -> np.ndarray:
+    """
+    Elementwise (T3 - T2)/(T2 - T1) for arrays of threshold means, L1 where T2 == T1.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(t2 != t1, (t3 - t2) / (t2 - t1), L1)
+
+
+def vel_ratio_array(t1: np.ndarray, t2: np.ndarray, t3: np.ndarray) -> np.ndarray:
+    """
+    Vectorized version of vel_ratio() for arrays of threshold means.
+    C1, C2 and C3 are piecewise linear and clamped, which is exactly what np.interp() does.
+    """
+    ratio = threshold_ratio_array(t1, t2, t3)
+
+    c1 = np.interp(ratio, [L2, L1], [0.0, 1.0])
+    c2 = np.interp(ratio, [L3, L2, L1], [0.0, 1.0, 0.0])
+    c3 = np.interp(ratio, [L3, L2], [1.0, 0.0])
+
+    return c1 * t1 + c2 * t2 + c3 * t3
+
+
 if __name__ == '__main__':
     import matplotlib.pyplot as plt
 